@@ -0,0 +1,195 @@
+""" Local stand-ins for solr, the cybercommons catalog, the recipe host and drush used by the benchmarks """
+import re
+import stat
+import sys
+import threading
+import time
+from json import dumps, loads
+from os import chmod
+from os.path import join
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urlparse import parse_qs, urlparse
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.parse import parse_qs, urlparse
+
+PAGE_BYTES = 64 * 1024
+PID_PATTERN = re.compile(r'"([^"]+)"')
+
+drush_script = '''#!{python}
+""" fake drush: sleeps latency per object and registers ingested PIDs with the fake solr """
+import json, os, sys, time
+try:
+    from urllib2 import Request, urlopen
+except ImportError:
+    from urllib.request import Request, urlopen
+
+latency = float(os.environ.get("FAKE_DRUSH_LATENCY", "0"))
+options = dict(arg[2:].split("=", 1) for arg in sys.argv[1:] if arg.startswith("--") and "=" in arg)
+command = [arg for arg in sys.argv[1:] if not arg.startswith("-") and arg != "1"]
+if "oubib" in command:
+    with open(options["recipe_uri"]) as f:
+        recipe = json.load(f)["recipe"]
+    uuids = [recipe["uuid"]] + [page["uuid"] for page in recipe.get("pages", [])]
+    time.sleep(latency * len(uuids))
+    pids = ["{{0}}:{{1}}".format(options["pid_namespace"], uuid) for uuid in uuids]
+    request = Request(os.environ["FAKE_SOLR_URL"] + "/_ingest", json.dumps(pids).encode("utf-8"),
+                      {{"Content-Type": "application/json"}})
+    urlopen(request).read()
+elif "iim" in command:
+    time.sleep(latency)
+    sys.stdout.write(options.get("pid", "") + "\\n")
+'''
+
+
+def make_recipe(base_url, bag, pages):
+    """ return a recipe for bag with pages served by the fake recipe host """
+    return {"recipe": {
+        "uuid": "{0}-book".format(bag),
+        "label": bag,
+        "metadata": {"marcxml": "{0}/derivative/{1}/marc.xml".format(base_url, bag)},
+        "update": "false",
+        "pages": [{"uuid": "{0}-page-{1}".format(bag, index), "label": str(index + 1),
+                   "file": "{0}/images/{1}/{2:04d}.jpg".format(base_url, bag, index)}
+                  for index in range(pages)]
+    }}
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeServices(object):
+    """
+    Local HTTP servers standing in for solr (/solr), the data catalog (/catalog) and the recipe
+    host (/derivative and /images), one port each so metrics can tell them apart. Every request
+    waits latency seconds before answering.
+    """
+    roles = ("solr", "catalog", "recipe_host")
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.pages_per_book = 10
+        self.solr_pids = set()
+        self.catalog = {}
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.servers = dict((role, _Server(("127.0.0.1", 0), self._handler())) for role in self.roles)
+        self.netlocs = dict((role, "127.0.0.1:{0}".format(server.server_address[1]))
+                            for role, server in self.servers.items())
+        self.base_url = "http://{0}".format(self.netlocs["recipe_host"])
+        self.solr_url = "http://{0}/solr".format(self.netlocs["solr"])
+        self.catalog_url = "http://{0}/catalog/data/catalog/digital_objects/.json".format(self.netlocs["catalog"])
+
+    def __enter__(self):
+        for server in self.servers.values():
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+
+    def recipe_url(self, bag, paramstring="jpeg_040_antialias"):
+        return "{0}/derivative/{1}/{2}/{3}.json".format(self.base_url, bag, paramstring, bag.lower())
+
+    def add_catalog_item(self, bag):
+        with self.lock:
+            self.catalog[bag] = {"bag": bag, "application": {}}
+
+    def reset(self, latency=None, pages_per_book=None):
+        with self.lock:
+            self.solr_pids.clear()
+            self.catalog.clear()
+            self.requests = 0
+            if latency is not None:
+                self.latency = latency
+            if pages_per_book is not None:
+                self.pages_per_book = pages_per_book
+
+    def _handler(self):
+        services = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, body, content_type="application/json"):
+                if not isinstance(body, bytes):
+                    body = dumps(body).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return loads(self.rfile.read(length).decode("utf-8")) if length else None
+
+            def _wait(self):
+                with services.lock:
+                    services.requests += 1
+                if services.latency:
+                    time.sleep(services.latency)
+
+            def do_GET(self):
+                self._wait()
+                url = urlparse(self.path)
+                params = dict((key, values[0]) for key, values in parse_qs(url.query).items())
+                if url.path == "/solr/select":
+                    pids = PID_PATTERN.findall(params.get("q", ""))
+                    with services.lock:
+                        docs = [{"PID": pid} for pid in pids if pid in services.solr_pids]
+                    self._send(200, {"response": {"numFound": len(docs), "docs": docs}})
+                elif url.path == "/solr":
+                    self._send(200, b"ok", "text/plain")
+                elif url.path.startswith("/catalog/"):
+                    bags = loads(params.get("query", "{}")).get("filter", {}).get("bag")
+                    bags = bags.get("$in", []) if isinstance(bags, dict) else [bags]
+                    with services.lock:
+                        results = [dict(services.catalog[bag]) for bag in bags if bag in services.catalog]
+                    self._send(200, {"count": len(results), "next": None, "results": results})
+                elif url.path.startswith("/derivative/") and url.path.endswith(".json"):
+                    bag = url.path.split("/")[2]
+                    self._send(200, make_recipe(services.base_url, bag, services.pages_per_book))
+                elif url.path.startswith("/images/"):
+                    self._send(200, b"\0" * PAGE_BYTES, "image/jpeg")
+                else:
+                    self._send(404, {"detail": "Not found"})
+
+            def do_POST(self):
+                body = self._body()
+                if self.path == "/solr/_ingest":  # called by the fake drush, no latency
+                    with services.lock:
+                        services.solr_pids.update(body)
+                    self._send(200, {"ok": True})
+                    return
+                self._wait()
+                if self.path.startswith("/catalog/"):
+                    with services.lock:
+                        services.catalog[body["bag"]] = body
+                    self._send(201, body)
+                else:
+                    self._send(404, {"detail": "Not found"})
+
+        return Handler
+
+
+def install_drush(directory):
+    """ write the fake drush script into directory returning its path """
+    path = join(directory, "drush")
+    with open(path, "w") as f:
+        f.write(drush_script.format(python=sys.executable))
+    mode = stat.S_IRWXU | stat.S_IRGRP | stat.S_IXGRP | stat.S_IROTH | stat.S_IXOTH
+    chmod(path, mode)
+    return path
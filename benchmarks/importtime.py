@@ -0,0 +1,64 @@
+"""
+Profile the import time of islandoraq.tasks in fresh interpreters
+
+usage: python -m benchmarks.importtime [--repeat 5] [--top 15] [--output importtime.json]
+"""
+import argparse
+import subprocess
+import sys
+from json import dump
+
+MODULE = "islandoraq.tasks"
+
+
+def profile(module=MODULE):
+    """ import module in a new interpreter returning {module: (self microseconds, cumulative microseconds)} """
+    process = subprocess.Popen([sys.executable, "-X", "importtime", "-c", "import {0}".format(module)],
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    _, stderr = process.communicate()
+    if process.returncode:
+        raise RuntimeError(stderr.decode("utf-8", "replace"))
+    times = {}
+    for line in stderr.decode("utf-8", "replace").splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        own, cumulative, name = line[len("import time:"):].split("|", 2)
+        times[name.strip()] = (int(own), int(cumulative))
+    return times
+
+
+def run(repeat=5, top=15, module=MODULE):
+    """ median import times over repeat interpreters of module and of its top slowest imports """
+    runs = [profile(module) for _ in range(repeat)]
+
+    def median(values):
+        values = sorted(values)
+        return values[len(values) // 2]
+
+    names = set(runs[0]).intersection(*runs[1:])
+    cumulative = dict((name, median([times[name][1] for times in runs])) for name in names)
+    own = dict((name, median([times[name][0] for times in runs])) for name in names)
+    slowest = sorted(names, key=lambda name: cumulative[name], reverse=True)[:top]
+    return {"module": module, "repeat": repeat, "python": sys.version.split()[0],
+            "total_ms": round(cumulative.get(module, 0) / 1000.0, 1),
+            "slowest": [{"module": name, "cumulative_ms": round(cumulative[name] / 1000.0, 1),
+                         "self_ms": round(own[name] / 1000.0, 1)} for name in slowest]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters to import in")
+    parser.add_argument("--top", type=int, default=15, help="slowest imports listed")
+    parser.add_argument("--output", help="JSON file for the results, default is standard output")
+    args = parser.parse_args(argv)
+    report = run(args.repeat, args.top)
+    if args.output:
+        with open(args.output, "w") as f:
+            dump(report, f, indent=2)
+    else:
+        dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
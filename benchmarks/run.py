@@ -0,0 +1,199 @@
+"""
+Time islandoraq tasks against local stand-ins for solr, the data catalog, the recipe host and drush
+
+usage: python -m benchmarks.run [--recipes 1,4] [--pages 10,50] [--latency 0,0.01] [--output results.json]
+"""
+import argparse
+import logging
+import platform
+import shutil
+import sys
+import time
+from itertools import product
+from json import dump
+from os import environ, getgid, getpid, mkdir, pathsep
+from os.path import join
+from tempfile import mkdtemp
+
+import celery
+
+from islandoraq.tasks import catalog, ledger, metrics, preflight, recipecache, workspace
+from islandoraq.tasks import tasks
+
+from .fakes import FakeServices, install_drush
+
+BENCHMARKS = ("ingest_recipe", "ingest_status", "async_ingest_status", "updatecatalog", "ingest_and_verify")
+COLLECTION = "bench:hos"
+NAMESPACE = "bench"
+PARAMSTRING = "jpeg_040_antialias"
+
+log = logging.getLogger(__name__)
+
+
+class _Group(object):
+    gr_gid = getgid()
+
+
+def _numbers(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+def _prepare(services, workdir, drush_latency):
+    """ point the task module at the fake services and run celery tasks in process """
+    tasks.solr_url = services.solr_url
+    tasks.solr_select_url = "{0}/select".format(services.solr_url)
+    tasks.catalog_url = services.catalog_url
+    tasks.ISLANDORA_DRUPAL_ROOT = workdir
+    workspace.grp.getgrnam = lambda name: _Group()
+    tasks.app.conf.task_always_eager = True
+    tasks.app.conf.task_eager_propagates = True
+    tasks.app.conf.result_backend = "cache+memory://"
+    metrics.DEPENDENCIES = dict((netloc, role) for role, netloc in services.netlocs.items())
+    bindir = join(workdir, "bin")
+    mkdir(bindir)
+    install_drush(bindir)
+    environ["PATH"] = bindir + pathsep + environ["PATH"]
+    preflight.find_drush()  # resolve drush to this run's fake
+    environ["FAKE_SOLR_URL"] = services.solr_url
+    environ["FAKE_DRUSH_LATENCY"] = str(drush_latency)
+
+
+def _reset(services, workdir, run, latency, pages):
+    """ start a run with empty fake services, caches and ledger """
+    services.reset(latency=latency, pages_per_book=pages)
+    catalog.lookup_cache.clear()
+    recipecache.cache = recipecache.RecipeCache(directory=join(workdir, "recipes_{0}".format(run)))
+    ledger._ledger = ledger.SqliteLedger(join(workdir, "ledger_{0}.sqlite".format(run)))
+    ledger._pid = getpid()
+    metrics.registry.reset()
+
+
+def _dependencies():
+    """ summarise the dependency calls recorded during a run """
+    summary = {}
+    for (dependency, operation), counts in list(metrics.dependency_duration.values.items()):
+        totals = summary.setdefault(dependency, {"calls": 0, "seconds": 0.0})
+        totals["calls"] += counts[-2]
+        totals["seconds"] = round(totals["seconds"] + counts[-1], 6)
+    return summary
+
+
+def _urls(services, bags):
+    return [services.recipe_url(bag, PARAMSTRING) for bag in bags]
+
+
+def _seed_catalog(services, bags):
+    for bag in bags:
+        services.add_catalog_item(bag)
+
+
+def _ingest(services, bags):
+    return tasks.ingest_recipe(_urls(services, bags), COLLECTION, NAMESPACE, result_format="compact")["failed"]
+
+
+def _ingest_status(services, bags):
+    return len([url for url in _urls(services, bags)
+                if not tasks.ingest_status(url, NAMESPACE)["successful_load"]])
+
+
+def _async_ingest_status(services, bags):
+    return len([result for result in tasks.async_ingest_status_many(_urls(services, bags), NAMESPACE)
+                if not result["successful_load"]])
+
+
+def _updatecatalog(services, bags):
+    return len([bag for bag in bags if not tasks.updatecatalog(bag, PARAMSTRING, COLLECTION)])
+
+
+def _ingest_and_verify(services, bags):
+    for url in _urls(services, bags):
+        tasks.ingest_and_verify(url, COLLECTION, NAMESPACE)
+    return len([bag for bag in bags if not services.catalog[bag]["application"].get("islandora")])
+
+
+# benchmark name: (untimed setup, timed run returning the number of failed recipes or bags)
+SUITE = {
+    "ingest_recipe": (None, _ingest),
+    "ingest_status": (_ingest, _ingest_status),
+    "async_ingest_status": (_ingest, _async_ingest_status),
+    "updatecatalog": (_seed_catalog, _updatecatalog),
+    "ingest_and_verify": (_seed_catalog, _ingest_and_verify),
+}
+
+
+def run(benchmarks, recipe_counts, page_counts, latencies, repeat=1, drush_latency=0.0):
+    """
+    Time each benchmark over every combination of recipe count, pages per book and service latency
+
+    returns a dictionary of environment, parameters and a list of results
+    """
+    workdir = mkdtemp(prefix="islandoraq_bench_")
+    results = []
+    try:
+        with FakeServices() as services:
+            _prepare(services, workdir, drush_latency)
+            runs = 0
+            for name, recipes, pages, latency in product(benchmarks, recipe_counts, page_counts, latencies):
+                setup, timed = SUITE[name]
+                for iteration in range(repeat):
+                    runs += 1
+                    _reset(services, workdir, runs, latency, pages)
+                    bags = ["Bench_{0}_{1}".format(runs, index) for index in range(recipes)]
+                    if setup:
+                        setup(services, bags)
+                    metrics.registry.reset()
+                    requests_before = services.requests
+                    start = time.time()
+                    failures = timed(services, bags)
+                    seconds = time.time() - start
+                    results.append({
+                        "benchmark": name, "recipes": recipes, "pages": pages, "latency": latency,
+                        "iteration": iteration, "seconds": round(seconds, 6), "failures": failures,
+                        "recipes_per_second": round(recipes / seconds, 3),
+                        "pages_per_second": round(recipes * pages / seconds, 3),
+                        "requests": services.requests - requests_before,
+                        "dependencies": _dependencies()
+                    })
+                    log.info("{0} recipes={1} pages={2} latency={3}: {4:.3f}s".format(
+                        name, recipes, pages, latency, seconds))
+    finally:
+        workspace.get_pool().close()
+        shutil.rmtree(workdir, ignore_errors=True)
+    return {
+        "environment": {"python": platform.python_version(), "platform": platform.platform(),
+                        "celery": celery.__version__, "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())},
+        "parameters": {"benchmarks": list(benchmarks), "recipes": recipe_counts, "pages": page_counts,
+                       "latency": latencies, "repeat": repeat, "drush_latency": drush_latency},
+        "results": results
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--benchmarks", type=lambda value: value.split(","), default=list(BENCHMARKS),
+                        help="comma separated benchmarks to run: {0}".format(",".join(BENCHMARKS)))
+    parser.add_argument("--recipes", type=_numbers(int), default=[1, 4], help="comma separated recipe counts")
+    parser.add_argument("--pages", type=_numbers(int), default=[10, 50], help="comma separated pages per book")
+    parser.add_argument("--latency", type=_numbers(float), default=[0.0, 0.01],
+                        help="comma separated seconds added to every solr, catalog and recipe host request")
+    parser.add_argument("--drush-latency", type=float, default=0.001, help="seconds fake drush spends per object")
+    parser.add_argument("--repeat", type=int, default=1, help="runs of each combination")
+    parser.add_argument("--output", help="JSON file for the results, default is standard output")
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: {0}".format(", ".join(sorted(unknown))))
+
+    logging.getLogger().setLevel(logging.WARNING)
+    log.setLevel(logging.INFO)
+    report = run(args.benchmarks, args.recipes, args.pages, args.latency, args.repeat, args.drush_latency)
+    if args.output:
+        with open(args.output, "w") as f:
+            dump(report, f, indent=2)
+    else:
+        dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+
+
+if __name__ == "__main__":
+    main()
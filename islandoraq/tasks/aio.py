@@ -0,0 +1,295 @@
+"""
+Asyncio implementations of the network bound verification and catalog code paths.
+
+Requests go through aiohttp when it is installed, imported on first use as it is slow to import,
+otherwise through the pooled requests sessions
+of httpclient on a thread pool. Either way at most HOST_CONCURRENCY requests run per host at once.
+The coroutines return the same results as their synchronous counterparts in tasks.py.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from json import dumps, loads
+
+import requests
+
+from . import catalog
+from . import health
+from . import httpclient
+from . import metrics
+from . import recipecache
+
+try:
+    from urllib.parse import urlparse
+except ImportError:
+    from urlparse import urlparse
+
+_NOT_LOADED = object()
+aiohttp = _NOT_LOADED  # the aiohttp module, or None when it is not installed, see _aiohttp
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+HOST_CONCURRENCY = getattr(celeryconfig, "ISLANDORA_ASYNC_HOST_CONCURRENCY", 20)
+BOOK_CONCURRENCY = getattr(celeryconfig, "ISLANDORA_ASYNC_BOOK_CONCURRENCY", 50)
+
+
+def _aiohttp():
+    """ return the aiohttp module, importing it on first use, or None when it is not installed """
+    global aiohttp
+    if aiohttp is _NOT_LOADED:
+        try:
+            import aiohttp as module
+        except ImportError:
+            module = None
+        aiohttp = module
+    return aiohttp
+
+
+def failure_errors():
+    """ exceptions counted as failures by the circuit breakers """
+    module = _aiohttp()
+    return health.FAILURE_ERRORS + ((module.ClientConnectionError, asyncio.TimeoutError) if module else ())
+
+
+class CatalogWriteError(Exception):
+    """ raised when a catalog item could not be saved """
+
+
+class Response(object):
+    """ status and body of a finished request with the parts of requests.Response the tasks use """
+
+    def __init__(self, status_code, text):
+        self.status_code = status_code
+        self.text = text
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+    def raise_for_status(self):
+        if not self.ok:
+            raise requests.HTTPError("{0} error".format(self.status_code))
+
+
+class AsyncClient(object):
+    """
+    Async HTTP client limiting concurrent requests per host, retrying the same statuses with the
+    same backoff as httpclient
+    """
+
+    def __init__(self, host_concurrency=None, use_aiohttp=None):
+        self.host_concurrency = host_concurrency or HOST_CONCURRENCY
+        self.use_aiohttp = _aiohttp() is not None if use_aiohttp is None else use_aiohttp
+        self._limits = {}
+        self._session = None
+        self._executor = None
+
+    async def __aenter__(self):
+        if self.use_aiohttp:
+            connect, read = httpclient.TIMEOUT
+            module = _aiohttp()
+            self._session = module.ClientSession(
+                connector=module.TCPConnector(limit=0, limit_per_host=self.host_concurrency),
+                timeout=module.ClientTimeout(sock_connect=connect, sock_read=read))
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=self.host_concurrency * 4)
+        return self
+
+    async def __aexit__(self, *exc_info):
+        if self._session is not None:
+            await self._session.close()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _limit(self, url):
+        host = urlparse(url).netloc
+        limit = self._limits.get(host)
+        if limit is None:
+            limit = self._limits[host] = asyncio.Semaphore(self.host_concurrency)
+        return limit
+
+    async def _send(self, method, url, guard=True, **kwargs):
+        if self._session is None:
+            loop = asyncio.get_event_loop()
+            resp = await loop.run_in_executor(
+                self._executor, partial(httpclient.request, method, url, guard=guard, **kwargs))
+            return Response(resp.status_code, resp.text)
+        if isinstance(kwargs.get("timeout"), tuple):  # (connect, read) seconds as taken by requests
+            connect, read = kwargs["timeout"]
+            kwargs["timeout"] = _aiohttp().ClientTimeout(sock_connect=connect, sock_read=read)
+        for attempt in range(httpclient.MAX_RETRIES + 1):
+            async with self._session.request(method, url, **kwargs) as resp:
+                text = await resp.text()
+            if resp.status not in httpclient.RETRY_STATUSES or attempt == httpclient.MAX_RETRIES:
+                return Response(resp.status, text)
+            await asyncio.sleep(httpclient.BACKOFF * (2 ** attempt))
+
+    async def request(self, method, url, guard=True, **kwargs):
+        """ send a request through the circuit breaker of its dependency; guard=False bypasses it, e.g. for probes """
+        dependency = metrics.dependency_for(url)
+        async with self._limit(url):
+            if not guard:
+                with metrics.timed(dependency, method):
+                    return await self._send(method, url, guard=False, **kwargs)
+            with health.guarded(dependency, failure_errors()) as breaker:
+                with metrics.timed(dependency, method):
+                    resp = await self._send(method, url, guard=False, **kwargs)
+                health.record_status(breaker, resp.status_code)
+                return resp
+
+    async def probe(self, url, **kwargs):
+        """ send a health probe GET to url once with the probe timeout, bypassing the circuit breaker """
+        kwargs.setdefault("timeout", health.PROBE_TIMEOUT)
+        async with self._limit(url):
+            with metrics.timed(metrics.dependency_for(url), "GET"):
+                if self._session is None:
+                    loop = asyncio.get_event_loop()
+                    resp = await loop.run_in_executor(self._executor, partial(httpclient.probe, url, **kwargs))
+                    return Response(resp.status_code, resp.text)
+                connect, read = kwargs.pop("timeout")
+                kwargs["timeout"] = _aiohttp().ClientTimeout(sock_connect=connect, sock_read=read)
+                async with self._session.get(url, **kwargs) as resp:
+                    return Response(resp.status, await resp.text())
+
+    async def get(self, url, **kwargs):
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url, data=None, **kwargs):
+        return await self.request("POST", url, data=data, **kwargs)
+
+
+def run(coroutine_function, *args, **kwargs):
+    """ run coroutine_function(client, *args, **kwargs) on a new event loop with its own client """
+    async def main():
+        async with AsyncClient() as client:
+            return await coroutine_function(client, *args, **kwargs)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(main())
+    finally:
+        loop.close()
+
+
+def _tasks():
+    """ the synchronous tasks module, imported late as it imports this module """
+    from . import tasks
+    return tasks
+
+
+async def verify_solr_up(client):
+    """ probe solr like the synchronous verify_solr_up, even while its circuit breaker is open """
+    try:
+        return (await client.probe(_tasks().solr_url)).ok
+    except (requests.ConnectionError, OSError) + failure_errors() as err:
+        logging.error("Error verifying solr is running")
+        logging.error(err)
+        return False
+
+
+async def object_exists(client, uuid, namespace):
+    tasks = _tasks()
+    resp = await client.get('{0}?q=PID:"{1}:{2}"&fl=numFound&wt=json'.format(tasks.solr_select_url, namespace, uuid))
+    data = loads(resp.text)
+    return data['response']['numFound'] >= 1
+
+
+async def objects_exist(client, uuids, namespace, chunk_size=None):
+    tasks = _tasks()
+    uuids = list(uuids)
+    chunk_size = chunk_size or tasks.solr_chunk_size
+
+    async def query(chunk):
+        terms = " OR ".join('"{0}:{1}"'.format(namespace, uuid) for uuid in chunk)
+        resp = await client.get(tasks.solr_select_url, params={
+            "q": "PID:({0})".format(terms),
+            "fl": "PID",
+            "rows": str(len(chunk)),
+            "wt": "json"
+        })
+        return [doc['PID'].split(":", 1)[-1] for doc in loads(resp.text)['response']['docs']]
+
+    chunks = [uuids[start:start + chunk_size] for start in range(0, len(uuids), chunk_size)]
+    found = set()
+    for pids in await asyncio.gather(*[query(chunk) for chunk in chunks]):
+        found.update(pids)
+    return dict((uuid, uuid in found) for uuid in uuids)
+
+
+async def _recipe_uuids(recipe_url):
+    try:
+        recipe = await asyncio.get_event_loop().run_in_executor(None, recipecache.fetch, recipe_url)
+    except (requests.RequestException, recipecache.RecipeError):
+        raise Exception("Bad recipe url")
+    if not recipe['is_recipe']:
+        raise Exception("Bad recipe url")
+    return recipe['book_uuid'], recipe['page_uuids']
+
+
+async def ingest_status(client, recipe_url, namespace=None):
+    tasks = _tasks()
+    book_uuid, page_uuids = await _recipe_uuids(recipe_url)
+
+    if not await object_exists(client, book_uuid, namespace):
+        tasks._record_ledger(namespace, book_uuid, False, None)
+        return {"book": book_uuid, "page_status": None, "successful_load": False,
+                "error": "Book not loaded. Book's UUID not found: {0}".format(book_uuid)}
+
+    status = await objects_exist(client, page_uuids, namespace)
+    tasks._record_ledger(namespace, book_uuid, True, status)
+    return {"book": book_uuid, "page_status": status, "successful_load": all(status.values())}
+
+
+async def ingest_status_many(client, recipe_urls, namespace=None, concurrency=None):
+    """ ingest_status of many recipes at once; a failing recipe gives {"recipe": url, "error": reason} """
+    limit = asyncio.Semaphore(concurrency or BOOK_CONCURRENCY)
+
+    async def status(recipe_url):
+        async with limit:
+            try:
+                return await ingest_status(client, recipe_url, namespace)
+            except Exception as err:
+                logging.error("Unable to verify {0}: {1}".format(recipe_url, err))
+                return {"recipe": recipe_url, "successful_load": False, "error": str(err)}
+
+    return list(await asyncio.gather(*[status(url) for url in recipe_urls]))
+
+
+async def searchcatalog(client, bag, use_cache=True):
+    catalogitem = catalog.cached_item(bag) if use_cache else None
+    if catalogitem is not None:
+        return catalogitem
+    tasks = _tasks()
+    resp = await client.get(tasks.search_url.format(tasks.catalog_url, bag))
+    catalogitems = loads(resp.text)
+    catalogitem = catalogitems['results'][0] if catalogitems['count'] else {}
+    catalog.cache_item(bag, catalogitem)
+    return catalogitem
+
+
+async def updatecatalog(client, bag, paramstring, collection, ingested=True):
+    """
+    returns True once written or False when the bag has no catalog entry.
+    Raises CatalogWriteError when the write fails.
+    """
+    tasks = _tasks()
+    catalogitem = await searchcatalog(client, bag, use_cache=False)
+    if not catalogitem.get("bag"):
+        return False
+    catalog.apply_update(catalogitem, catalog.make_update(bag, paramstring, collection, ingested))
+    headers = {"Content-Type": "application/json", "Authorization": "Token {0}".format(tasks.CYBERCOMMONS_TOKEN)}
+    try:
+        resp = await client.post(tasks.catalog_url, data=dumps(catalogitem), headers=headers)
+        resp.raise_for_status()
+    except health.DependencyUnavailable:
+        catalog.lookup_cache.pop(bag)
+        raise
+    except Exception as err:
+        catalog.lookup_cache.pop(bag)
+        raise CatalogWriteError(err)
+    catalog.cache_item(bag, catalogitem)
+    return True
@@ -0,0 +1,100 @@
+""" Small in-process caches shared by islandoraq tasks """
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Thread safe mapping holding at most maxsize entries, evicting the least recently used
+    """
+
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """ return hit, miss and eviction counters with the current size """
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+                "size": len(self._data), "maxsize": self.maxsize}
+
+
+class TTLCache(LRUCache):
+    """
+    LRUCache whose entries expire ttl seconds after they are set. Entries set as negative
+    (e.g. lookups that found nothing) expire after negative_ttl seconds instead.
+    """
+
+    def __init__(self, maxsize=128, ttl=300, negative_ttl=None):
+        super(TTLCache, self).__init__(maxsize)
+        self.ttl = ttl
+        self.negative_ttl = ttl if negative_ttl is None else negative_ttl
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires <= time.time():
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._data[key] = (expires, value)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, negative=False):
+        ttl = self.negative_ttl if negative else self.ttl
+        if ttl <= 0:
+            self.pop(key)
+            return
+        super(TTLCache, self).set(key, (time.time() + ttl, value))
+
+    def pop(self, key, default=None):
+        entry = super(TTLCache, self).pop(key)
+        return default if entry is None else entry[1]
+
+    def stats(self):
+        stats = super(TTLCache, self).stats()
+        stats["expirations"] = self.expirations
+        return stats
@@ -0,0 +1,155 @@
+""" Helpers for reading and writing Islandora ingest status in the cybercommons data catalog """
+import datetime
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+from json import loads, dumps
+
+from .cache import TTLCache
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+SEARCH_CHUNK_SIZE = getattr(celeryconfig, "ISLANDORA_CATALOG_SEARCH_CHUNK_SIZE", 50)
+WRITE_CONCURRENCY = getattr(celeryconfig, "ISLANDORA_CATALOG_WRITE_CONCURRENCY", 4)
+WRITE_RETRIES = getattr(celeryconfig, "ISLANDORA_CATALOG_WRITE_RETRIES", 3)
+WRITE_BEHIND = getattr(celeryconfig, "ISLANDORA_CATALOG_WRITE_BEHIND", False)
+WRITE_BEHIND_SIZE = getattr(celeryconfig, "ISLANDORA_CATALOG_WRITE_BEHIND_SIZE", 50)
+WRITE_BEHIND_AGE = getattr(celeryconfig, "ISLANDORA_CATALOG_WRITE_BEHIND_AGE", 60)  # seconds
+CACHE_SIZE = getattr(celeryconfig, "ISLANDORA_CATALOG_CACHE_SIZE", 1024)
+CACHE_TTL = getattr(celeryconfig, "ISLANDORA_CATALOG_CACHE_TTL", 300)  # seconds, 0 disables the cache
+CACHE_NEGATIVE_TTL = getattr(celeryconfig, "ISLANDORA_CATALOG_CACHE_NEGATIVE_TTL", 60)  # seconds for bags not found
+
+
+def make_update(bag, paramstring, collection, ingested=True, timestamp=None):
+    """ return an update record for a bag """
+    return {"bag": bag, "paramstring": paramstring, "collection": collection, "ingested": ingested,
+            "datetime": timestamp or datetime.datetime.utcnow().isoformat()}
+
+
+def normalize_updates(updates):
+    """
+    Accept update records as dictionaries or [bag, paramstring, collection, ingested] lists and
+    coalesce them by bag keeping the last update for each bag in first-seen order
+    """
+    coalesced = OrderedDict()
+    for update in updates:
+        if not isinstance(update, dict):
+            update = make_update(*update)
+        elif "datetime" not in update:
+            update = make_update(**update)
+        coalesced[update["bag"]] = update
+    return list(coalesced.values())
+
+
+def apply_update(catalogitem, update):
+    """ set the application.islandora status of a catalog item from an update record """
+    islandora = catalogitem.setdefault("application", {}).setdefault("islandora", {})
+    islandora["derivative"] = update["paramstring"]
+    islandora["collection"] = update["collection"]
+    islandora["ingested"] = update["ingested"]
+    islandora["datetime"] = update["datetime"]
+    return catalogitem
+
+
+def search_bags(get, catalog_url, bags, chunk_size=SEARCH_CHUNK_SIZE):
+    """
+    Look up many bags with $in filters returning a dictionary of bag name to catalog item
+
+    args:
+      get: function performing a GET request, e.g. httpclient.get
+      catalog_url: catalog collection URL
+      bags: list of bag names
+    """
+    found = {}
+    for start in range(0, len(bags), chunk_size):
+        chunk = bags[start:start + chunk_size]
+        query = dumps({"filter": {"bag": {"$in": chunk}}})
+        resp = get(catalog_url, params={"query": query, "page_size": len(chunk)})
+        while True:
+            resp.raise_for_status()
+            catalogitems = loads(resp.text)
+            for item in catalogitems.get("results", []):
+                found.setdefault(item.get("bag"), item)
+            if not catalogitems.get("next"):
+                break
+            resp = get(catalogitems["next"])
+    return found
+
+
+class WriteBuffer(object):
+    """
+    Thread safe write-behind buffer merging repeated updates to the same bag until it is due
+    for a flush by size or age. When on_due is set, a timer calls it max_age seconds after the
+    first update reaches an empty buffer, so the age limit holds without further updates.
+    """
+
+    def __init__(self, max_items=WRITE_BEHIND_SIZE, max_age=WRITE_BEHIND_AGE, on_due=None):
+        self.max_items = max_items
+        self.max_age = max_age
+        self.on_due = on_due
+        self._updates = OrderedDict()
+        self._oldest = None
+        self._timer = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._updates)
+
+    def add(self, update):
+        with self._lock:
+            self._updates.pop(update["bag"], None)
+            self._updates[update["bag"]] = update
+            if self._oldest is None:
+                self._oldest = time.time()
+            if self.on_due is not None and self._timer is None:
+                self._timer = threading.Timer(self.max_age, self._expire)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def restore(self, updates):
+        """ put back drained updates that failed to write, keeping newer buffered updates of the same bags """
+        for update in updates:
+            with self._lock:
+                if update["bag"] in self._updates:
+                    continue
+            self.add(update)
+
+    def _expire(self):
+        with self._lock:
+            self._timer = None
+        self.on_due()
+
+    def due(self):
+        with self._lock:
+            return bool(self._updates) and (
+                len(self._updates) >= self.max_items or time.time() - self._oldest >= self.max_age)
+
+    def drain(self):
+        """ remove and return all buffered updates """
+        with self._lock:
+            updates = list(self._updates.values())
+            self._updates.clear()
+            self._oldest = None
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            return updates
+
+
+def cached_item(bag):
+    """ return a copy of the cached catalog item of a bag, {} for a cached miss or None when unknown """
+    item = lookup_cache.get(bag)
+    return None if item is None else deepcopy(item)
+
+
+def cache_item(bag, item):
+    """ remember the catalog item of a bag; an empty item is cached as a negative lookup """
+    lookup_cache.set(bag, deepcopy(item), negative=not item)
+
+
+write_buffer = WriteBuffer()
+lookup_cache = TTLCache(CACHE_SIZE, CACHE_TTL, CACHE_NEGATIVE_TTL)
@@ -0,0 +1,59 @@
+<?php
+
+/**
+ * @file
+ * Long lived islandoraq helper run with "drush php-script".
+ *
+ * Drush bootstraps Drupal once, then this script reads one JSON request per
+ * line on STDIN and answers with one JSON response per line on STDOUT:
+ *   {"id": 1, "operation": "read", "pid": "oku:uuid"}
+ *   {"id": 1, "ok": true, "output": "..."}
+ * Supported operations are ping, read, delete (through the iim command) and
+ * cache-clear.
+ */
+
+$stdin = fopen('php://stdin', 'r');
+$stdout = fopen('php://stdout', 'w');
+fwrite($stdout, json_encode(array('ready' => TRUE)) . "\n");
+fflush($stdout);
+
+while (($line = fgets($stdin)) !== FALSE) {
+  $request = json_decode($line, TRUE);
+  $response = array(
+    'id' => isset($request['id']) ? $request['id'] : NULL,
+    'ok' => TRUE,
+    'output' => '',
+  );
+  $operation = isset($request['operation']) ? $request['operation'] : NULL;
+  ob_start();
+  switch ($operation) {
+    case 'ping':
+      print 'pong';
+      break;
+
+    case 'read':
+    case 'delete':
+      drush_set_option('pid', $request['pid']);
+      drush_set_option('operation', $operation);
+      $result = drush_invoke('iim');
+      $response['ok'] = $result !== FALSE && !drush_get_error();
+      break;
+
+    case 'cache-clear':
+      $result = drush_invoke('cache-clear', array('drush'));
+      $response['ok'] = $result !== FALSE && !drush_get_error();
+      break;
+
+    default:
+      $response['ok'] = FALSE;
+      $response['error'] = 'Unknown operation';
+  }
+  $response['output'] = ob_get_clean();
+  if (!$response['ok'] && !isset($response['error'])) {
+    $response['error'] = implode("\n", array_keys(drush_get_error_log()));
+  }
+  drush_clear_error();
+  drush_set_context('DRUSH_ERROR_CODE', DRUSH_SUCCESS);
+  fwrite($stdout, json_encode($response) . "\n");
+  fflush($stdout);
+}
@@ -0,0 +1,146 @@
+"""
+Streaming capture of drush output with bounded memory and batch progress parsing.
+
+Output is read line by line as drush writes it. Only the last OUTPUT_BYTES are kept in memory;
+with ISLANDORA_DRUSH_SPILL_DIR set the full output is also written to a spill file that is kept
+when drush fails. Batch progress lines are parsed as they arrive and reported to a callback.
+"""
+import logging
+import re
+import time
+import uuid
+from collections import deque
+from os import SEEK_END, makedirs, remove
+from os.path import exists, join
+from subprocess import CalledProcessError, PIPE, Popen, STDOUT
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+OUTPUT_BYTES = getattr(celeryconfig, "ISLANDORA_DRUSH_OUTPUT_BYTES", 64 * 1024)
+SPILL_DIR = getattr(celeryconfig, "ISLANDORA_DRUSH_SPILL_DIR", None)
+PROGRESS_INTERVAL = getattr(celeryconfig, "ISLANDORA_PROGRESS_INTERVAL", 2)  # seconds between progress reports
+
+# drush batch messages, e.g. "Completed 12 of 240." or "Processed 12 out of 240"
+BATCH_PROGRESS = re.compile(br"(?:Completed|Processed)\s+(\d+)\s+(?:of|out of)\s+(\d+)")
+# islandora_batch reports every object it ingests, e.g. "Ingested oku:1234."
+INGESTED = re.compile(br"\bIngested\b")
+
+
+class RingBuffer(object):
+    """ Last max_bytes of a stream of lines """
+
+    def __init__(self, max_bytes=OUTPUT_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.dropped = 0
+        self._lines = deque()
+
+    def append(self, line):
+        if len(line) > self.max_bytes:
+            self.dropped += len(line) - self.max_bytes
+            line = line[-self.max_bytes:]
+        self._lines.append(line)
+        self.size += len(line)
+        while self.size > self.max_bytes:
+            dropped = self._lines.popleft()
+            self.size -= len(dropped)
+            self.dropped += len(dropped)
+
+    def getvalue(self):
+        output = b"".join(self._lines)
+        if self.dropped:
+            output = "[{0} earlier bytes dropped]\n".format(self.dropped).encode("utf-8") + output
+        return output
+
+
+class ProgressParser(object):
+    """ Objects done and total parsed from drush batch output; total is None until drush reports it """
+
+    def __init__(self, total=None):
+        self.done = 0
+        self.total = total
+        self._ingested = 0
+
+    def feed(self, line):
+        """ parse a line returning True when the progress changed """
+        match = BATCH_PROGRESS.search(line)
+        if match:
+            self.done, self.total = int(match.group(1)), int(match.group(2))
+            return True
+        if INGESTED.search(line):
+            self._ingested += 1
+            self.done = max(self.done, self._ingested)
+            return True
+        return False
+
+
+def stream_output(command, stderr=STDOUT, shell=True, progress=None, total=None, max_bytes=None,
+                  spill_dir=None):
+    """
+    Run command like subprocess.check_output keeping only the last max_bytes of its output
+
+    args:
+      command: command to run
+      progress: function called with (objects done, total objects) as batch progress is parsed, at
+                most every PROGRESS_INTERVAL seconds and once more when drush exits
+      total: total objects expected, used until drush reports its own total
+      max_bytes: bytes of output kept in memory. Default is ISLANDORA_DRUSH_OUTPUT_BYTES
+      spill_dir: directory of the spill file. Default is ISLANDORA_DRUSH_SPILL_DIR, None for no spill file
+    returns the kept output. Raises CalledProcessError with the kept output for a non zero exit
+    status, its spill_path attribute naming the spill file holding the full output or None.
+    """
+    buffer = RingBuffer(max_bytes or OUTPUT_BYTES)
+    parser = ProgressParser(total)
+    spill_dir = SPILL_DIR if spill_dir is None else spill_dir
+    spill_path = None
+    spill = None
+    if spill_dir:
+        if not exists(spill_dir):
+            makedirs(spill_dir)
+        spill_path = join(spill_dir, "drush-{0}.log".format(uuid.uuid4().hex))
+        spill = open(spill_path, "wb")
+    reported = 0
+    process = Popen(command, stdout=PIPE, stderr=stderr, shell=shell)
+    try:
+        for line in iter(process.stdout.readline, b""):
+            buffer.append(line)
+            if spill is not None:
+                spill.write(line)
+            if parser.feed(line) and progress is not None and time.time() - reported >= PROGRESS_INTERVAL:
+                reported = time.time()
+                progress(parser.done, parser.total)
+    finally:
+        process.stdout.close()
+        returncode = process.wait()
+        if spill is not None:
+            spill.close()
+    if progress is not None and parser.done:
+        progress(parser.done, parser.total)
+    output = buffer.getvalue()
+    if returncode:
+        err = CalledProcessError(returncode, command, output=output)
+        err.spill_path = spill_path
+        raise err
+    if spill_path:
+        try:
+            remove(spill_path)
+        except OSError as err:
+            logging.warning("Unable to remove drush spill file {0}: {1}".format(spill_path, err))
+    return output
+
+
+def tail(path, lines=5, block_size=4096):
+    """ return the last lines of a file, reading backward from its end """
+    with open(path, "rb") as f:
+        f.seek(0, SEEK_END)
+        position = f.tell()
+        data = b""
+        while position > 0 and data.count(b"\n") <= lines:
+            step = min(block_size, position)
+            position -= step
+            f.seek(position)
+            data = f.read(step) + data
+    return [line.decode("utf-8", "replace") for line in data.splitlines(True)[-lines:]]
@@ -0,0 +1,201 @@
+""" Long lived drush helper process that bootstraps Drupal once for many item operations """
+import logging
+import select
+import threading
+import time
+from json import loads, dumps
+from os import devnull, getpid, read
+from os.path import dirname, join
+from subprocess import CalledProcessError, Popen, PIPE
+
+from celery.signals import worker_process_init, worker_process_shutdown
+
+from . import metrics
+from . import preflight
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+ENABLED = getattr(celeryconfig, "ISLANDORA_DRUSH_WORKER", False)
+MAX_OPERATIONS = getattr(celeryconfig, "ISLANDORA_DRUSH_WORKER_MAX_OPERATIONS", 500)
+TIMEOUT = getattr(celeryconfig, "ISLANDORA_DRUSH_WORKER_TIMEOUT", 300)  # seconds per operation
+STARTUP_TIMEOUT = 120
+HEALTH_INTERVAL = 60  # seconds idle before a ping is sent ahead of the next operation
+
+helper_script = join(dirname(__file__), "drush_helper.php")
+helper_template = ["{drush}", "-u", "1", "--root={0}", "php-script", helper_script]
+
+
+class DrushWorkerError(Exception):
+    """
+    raised when the helper process cannot answer a request; sent is True when the operation had
+    been sent to the helper, which may have run it before failing
+    """
+
+    sent = False
+
+
+class DrushOperationError(CalledProcessError):
+    """
+    raised when the helper answered but the operation failed; handled like a failed one-shot
+    drush process rather than retried with one
+    """
+
+    def __init__(self, operation, pid, output, error):
+        super(DrushOperationError, self).__init__(
+            1, "drush helper {0} {1}".format(operation, pid or "").strip(), output=output)
+        self.error = error
+
+
+class DrushWorker(object):
+    """
+    Client for drush_helper.php speaking line delimited json over the helper's stdin and stdout.
+    The helper is started on first use, health checked when it has been idle, and restarted
+    after max_operations requests or after any protocol error.
+    """
+
+    def __init__(self, command, max_operations=MAX_OPERATIONS, timeout=TIMEOUT):
+        self.command = command
+        self.max_operations = max_operations
+        self.timeout = timeout
+        self.process = None
+        self.operations = 0
+        self.last_used = 0
+        self.in_flight = None  # operation sent to the helper and not yet answered
+        self._ids = 0
+        self._buffer = b""
+        self._lock = threading.Lock()
+
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def _readline(self, timeout):
+        """ read one line from the helper, waiting at most timeout seconds """
+        deadline = time.time() + timeout
+        while b"\n" not in self._buffer:
+            ready, _, _ = select.select([self.process.stdout], [], [], max(0, deadline - time.time()))
+            if not ready:
+                raise DrushWorkerError("Drush helper timed out after {0} seconds".format(timeout))
+            data = read(self.process.stdout.fileno(), 65536)
+            if not data:
+                raise DrushWorkerError("Drush helper exited with status {0}".format(self.process.poll()))
+            self._buffer += data
+        line, _, self._buffer = self._buffer.partition(b"\n")
+        return line.decode("utf-8", "replace")
+
+    def start(self):
+        self.stop()
+        logging.info("Starting drush helper: {0}".format(" ".join(self.command)))
+        with open(devnull, "w") as stderr:
+            self.process = Popen(self.command, stdin=PIPE, stdout=PIPE, stderr=stderr)
+        self._buffer = b""
+        deadline = time.time() + STARTUP_TIMEOUT
+        while True:
+            line = self._readline(max(0, deadline - time.time()))
+            try:
+                if loads(line).get("ready"):
+                    break
+            except (ValueError, AttributeError):
+                logging.debug("drush helper: {0}".format(line.rstrip()))
+        self.operations = 0
+        self.last_used = time.time()
+
+    def stop(self):
+        if self.process is None:
+            return
+        try:
+            self.process.stdin.close()
+            if self.process.poll() is None:
+                self.process.terminate()
+            self.process.wait()
+        except (IOError, OSError):
+            pass
+        self.process = None
+
+    def _exchange(self, payload):
+        self._ids += 1
+        payload = dict(payload, id=self._ids)
+        self.process.stdin.write((dumps(payload) + "\n").encode("utf-8"))
+        self.process.stdin.flush()
+        self.in_flight = payload["operation"]
+        while True:
+            try:
+                response = loads(self._readline(self.timeout))
+            except ValueError:
+                continue  # stray output from drush or php notices
+            if isinstance(response, dict) and response.get("id") == payload["id"]:
+                self.operations += 1
+                self.last_used = time.time()
+                self.in_flight = None
+                return response
+
+    def request(self, operation, pid=None):
+        """
+        Send one operation to the helper returning its response dictionary with ok and output keys.
+        Raises DrushWorkerError when the helper is unavailable; the helper is then restarted on next use.
+        The error's sent attribute tells whether the operation reached the helper.
+        """
+        with self._lock:
+            self.in_flight = None
+            try:
+                if not self.alive() or self.operations >= self.max_operations:
+                    self.start()
+                elif time.time() - self.last_used > HEALTH_INTERVAL:
+                    if not self._exchange({"operation": "ping"}).get("ok"):
+                        self.start()
+                return self._exchange({"operation": operation, "pid": pid})
+            except (IOError, OSError, ValueError, DrushWorkerError) as err:
+                sent = self.in_flight == operation
+                self.stop()
+                if not isinstance(err, DrushWorkerError):
+                    err = DrushWorkerError(str(err))
+                err.sent = sent
+                raise err
+
+
+_worker = None
+_pid = getpid()
+
+
+def get_worker(drupal_root):
+    """ return this process's drush helper, never sharing one across a fork """
+    global _worker, _pid
+    if _worker is None or _pid != getpid():
+        _pid = getpid()
+        _worker = DrushWorker([part.format(drupal_root, drush=preflight.drush_path()) for part in helper_template])
+    return _worker
+
+
+@worker_process_init.connect
+def _reset_after_fork(**kwargs):
+    global _worker
+    _worker = None
+
+
+@worker_process_shutdown.connect
+def _stop_on_shutdown(**kwargs):
+    if _worker is not None and _pid == getpid():
+        _worker.stop()
+
+
+def run(drupal_root, operation, pid=None):
+    """
+    Run an operation on the helper returning its output as bytes, like a one-shot drush process.
+    Raises DrushWorkerError when the helper is unavailable so callers can fall back to a one-shot
+    drush process, and DrushOperationError when the helper ran the operation and it failed.
+    """
+    with metrics.timed("drush", operation):
+        response = get_worker(drupal_root).request(operation, pid)
+    output = response.get("output", "").encode("utf-8")
+    if not response.get("ok"):
+        error = response.get("error") or "Drush helper operation {0} failed".format(operation)
+        raise DrushOperationError(operation, pid, output + error.encode("utf-8"), error)
+    return output
+
+
+def restart():
+    """ stop the helper so the next operation bootstraps a fresh Drupal """
+    if _worker is not None and _pid == getpid():
+        _worker.stop()
@@ -0,0 +1,193 @@
+""" Per-dependency circuit breakers with cached health probes """
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from celery.signals import worker_process_init
+
+from . import metrics
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+ENABLED = getattr(celeryconfig, "ISLANDORA_CIRCUIT_BREAKER", True)
+DEPENDENCIES = getattr(celeryconfig, "ISLANDORA_CIRCUIT_DEPENDENCIES", ("solr", "catalog"))
+FAILURE_THRESHOLD = getattr(celeryconfig, "ISLANDORA_CIRCUIT_FAILURES", 5)  # consecutive failures that open it
+RESET_TIMEOUT = getattr(celeryconfig, "ISLANDORA_CIRCUIT_RESET", 30)  # seconds open before a half-open trial
+PROBE_TTL = getattr(celeryconfig, "ISLANDORA_HEALTH_PROBE_TTL", 10)  # seconds a probe result is reused
+PROBE_TIMEOUT = getattr(celeryconfig, "ISLANDORA_HEALTH_PROBE_TIMEOUT", (2, 3))  # (connect, read) seconds
+DEFER_MAX_RETRIES = getattr(celeryconfig, "ISLANDORA_CIRCUIT_DEFER_RETRIES", 20)
+FAILURE_STATUSES = (502, 503, 504)
+FAILURE_ERRORS = (requests.ConnectionError, requests.Timeout)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+circuit_open = metrics.registry.add(metrics.Gauge(
+    "islandoraq_circuit_open", "1 while the circuit breaker of a dependency is open or half open", ["dependency"]))
+
+
+class DependencyUnavailable(Exception):
+    """ raised instead of calling a dependency whose circuit breaker is open """
+
+    def __init__(self, dependency, retry_after):
+        super(DependencyUnavailable, self).__init__(
+            "{0} is unavailable, retry in {1:.0f} seconds".format(dependency, retry_after))
+        self.dependency = dependency
+        self.retry_after = max(1, int(retry_after + 0.5))
+
+
+class CircuitBreaker(object):
+    """
+    Thread safe circuit breaker. After threshold consecutive failures calls are refused for
+    reset_timeout seconds. The breaker then turns half open: if the probe (when set) reports the
+    dependency healthy one trial call is let through, and its outcome closes or re-opens the breaker.
+    """
+
+    def __init__(self, name, threshold=FAILURE_THRESHOLD, reset_timeout=RESET_TIMEOUT, probe=None,
+                 probe_ttl=PROBE_TTL):
+        self.name = name
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.probe = probe
+        self.probe_ttl = probe_ttl
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = None
+        self.trips = 0
+        self._trial = False
+        self._probed = (0, None)  # (expires, healthy)
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self.state != OPEN:
+            logging.warning("Circuit breaker for {0} opened after {1} failures".format(self.name, self.failures))
+            self.trips += 1
+        self.state = OPEN
+        self.opened = time.time()
+        self._trial = False
+        circuit_open.set(1, dependency=self.name)
+
+    def healthy(self):
+        """ return the probe result, reusing it for probe_ttl seconds; True when there is no probe """
+        if self.probe is None:
+            return True
+        expires, healthy = self._probed
+        if expires > time.time():
+            return healthy
+        try:
+            healthy = bool(self.probe())
+        except Exception as err:
+            logging.warning("Health probe of {0} failed: {1}".format(self.name, err))
+            healthy = False
+        self._probed = (time.time() + self.probe_ttl, healthy)
+        return healthy
+
+    def before(self):
+        """ raise DependencyUnavailable unless a call may be made now """
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            if self.state == OPEN:
+                wait = self.opened + self.reset_timeout - time.time()
+                if wait > 0:
+                    raise DependencyUnavailable(self.name, wait)
+                self.state = HALF_OPEN
+            if self._trial:
+                raise DependencyUnavailable(self.name, self.probe_ttl)
+            self._trial = True
+        if not self.healthy():
+            with self._lock:
+                self._open()
+            raise DependencyUnavailable(self.name, self.reset_timeout)
+
+    def success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logging.info("Circuit breaker for {0} closed".format(self.name))
+                circuit_open.set(0, dependency=self.name)
+            self.state = CLOSED
+            self.failures = 0
+            self._trial = False
+
+    def failure(self):
+        with self._lock:
+            self.failures += 1
+            self._probed = (0, None)
+            if self.state == HALF_OPEN or self.failures >= self.threshold:
+                self._open()
+
+    def status(self):
+        """ return the breaker state with the last probe result """
+        with self._lock:
+            return {"state": self.state, "failures": self.failures, "trips": self.trips, "opened": self.opened,
+                    "healthy": self._probed[1] if self._probed[0] > time.time() else None}
+
+
+breakers = dict((name, CircuitBreaker(name)) for name in DEPENDENCIES)
+
+
+def reset():
+    """ close every breaker, e.g. in a newly forked worker process """
+    for name in list(breakers):
+        breakers[name] = CircuitBreaker(name, probe=breakers[name].probe)
+        circuit_open.set(0, dependency=name)
+
+
+@worker_process_init.connect
+def _reset_after_fork(**kwargs):
+    reset()
+
+
+def register_probe(name, probe):
+    """ set the health probe of a dependency's breaker """
+    if name in breakers:
+        breakers[name].probe = probe
+
+
+def healthy(name):
+    """ cached health of a dependency; dependencies without a breaker are assumed healthy """
+    breaker = breakers.get(name)
+    return breaker is None or breaker.healthy()
+
+
+def status():
+    """ return the state of every breaker keyed by dependency """
+    return dict((name, breaker.status()) for name, breaker in breakers.items())
+
+
+@contextmanager
+def guarded(name, failures=FAILURE_ERRORS):
+    """
+    Refuse the call when the breaker of dependency name is open, otherwise yield the breaker
+    (None when the dependency has none). Exceptions of the failures types, by default connection
+    errors and timeouts, are counted as failures; the caller reports responses with record_status.
+    """
+    breaker = breakers.get(name) if ENABLED else None
+    if breaker is None:
+        yield None
+        return
+    breaker.before()
+    try:
+        yield breaker
+    except failures:
+        breaker.failure()
+        raise
+    except Exception:
+        breaker.success()
+        raise
+
+
+def record_status(breaker, status_code):
+    """ count a response as a failure for statuses meaning the dependency is unavailable """
+    if breaker is None:
+        return
+    if status_code in FAILURE_STATUSES:
+        breaker.failure()
+    else:
+        breaker.success()
@@ -0,0 +1,116 @@
+""" Pooled keep-alive HTTP sessions shared by the tasks of a worker process """
+import threading
+from os import getpid
+
+import requests
+from requests.adapters import HTTPAdapter
+from celery.signals import worker_process_init
+
+from . import health
+from . import metrics
+
+try:
+    from urllib3.util.retry import Retry
+except ImportError:
+    from requests.packages.urllib3.util.retry import Retry
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+POOL_SIZE = getattr(celeryconfig, "ISLANDORA_HTTP_POOL_SIZE", 10)
+TIMEOUT = getattr(celeryconfig, "ISLANDORA_HTTP_TIMEOUT", (5, 120))  # (connect, read) seconds
+MAX_RETRIES = getattr(celeryconfig, "ISLANDORA_HTTP_MAX_RETRIES", 3)
+BACKOFF = getattr(celeryconfig, "ISLANDORA_HTTP_BACKOFF", 0.5)
+RETRY_STATUSES = (502, 503, 504)
+
+_lock = threading.Lock()
+_sessions = {}
+_pid = getpid()
+
+
+def _new_session(retry=True):
+    """ create a session with its own connection pool, retry and backoff policy; retry=False sends each request once """
+    if retry:
+        retry = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=BACKOFF,
+            status_forcelist=RETRY_STATUSES,
+            raise_on_status=False
+        )
+    else:
+        retry = 0
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_SIZE, max_retries=retry)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def reset():
+    """ drop all pooled sessions; connections inherited across a fork are never reused """
+    global _lock, _pid
+    _lock = threading.Lock()
+    _sessions.clear()
+    _pid = getpid()
+
+
+@worker_process_init.connect
+def _reset_after_fork(**kwargs):
+    reset()
+
+
+def session_for(url, probe=False):
+    """ return the pooled session for the scheme and host of url; probe sessions never retry """
+    if getpid() != _pid:
+        reset()
+    parsed = urlparse(url)
+    key = (parsed.scheme, parsed.netloc, probe)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            session = _sessions[key] = _new_session(retry=not probe)
+    return session
+
+
+def request(method, url, guard=True, **kwargs):
+    """
+    send a request through the pooled session for url, applying the default timeout.
+    Unless guard is False the request is refused with health.DependencyUnavailable while the
+    circuit breaker of the dependency is open.
+    """
+    kwargs.setdefault("timeout", TIMEOUT)
+    dependency = metrics.dependency_for(url)
+    if not guard:
+        with metrics.timed(dependency, method):
+            return session_for(url).request(method, url, **kwargs)
+    with health.guarded(dependency) as breaker:
+        with metrics.timed(dependency, method):
+            resp = session_for(url).request(method, url, **kwargs)
+        health.record_status(breaker, resp.status_code)
+        return resp
+
+
+def get(url, **kwargs):
+    kwargs.setdefault("allow_redirects", True)
+    return request("GET", url, **kwargs)
+
+
+def post(url, data=None, **kwargs):
+    return request("POST", url, data=data, **kwargs)
+
+
+def probe(url, **kwargs):
+    """
+    send a health probe GET to url: a single attempt with the short health.PROBE_TIMEOUT, sent
+    even while the circuit breaker of the dependency is open
+    """
+    kwargs.setdefault("timeout", health.PROBE_TIMEOUT)
+    with metrics.timed(metrics.dependency_for(url), "GET"):
+        return session_for(url, probe=True).get(url, **kwargs)
@@ -0,0 +1,176 @@
+""" Persistent per-book and per-page ingest ledger used to resume partial ingests """
+import datetime
+import logging
+import sqlite3
+import threading
+from os import getpid
+from os.path import join
+from tempfile import gettempdir
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+MONGO_URI = getattr(celeryconfig, "ISLANDORA_LEDGER_MONGO_URI", None)
+MONGO_DATABASE = getattr(celeryconfig, "ISLANDORA_LEDGER_MONGO_DATABASE", "islandoraq")
+MONGO_COLLECTION = getattr(celeryconfig, "ISLANDORA_LEDGER_MONGO_COLLECTION", "ingest_ledger")
+SQLITE_PATH = getattr(celeryconfig, "ISLANDORA_LEDGER_PATH", join(gettempdir(), "islandoraq_ledger.sqlite"))
+QUERY_CHUNK_SIZE = 500
+
+
+def _now():
+    return datetime.datetime.utcnow().isoformat()
+
+
+class SqliteLedger(object):
+    """ Ledger stored in a local SQLite database, shared by the workers of one host """
+
+    def __init__(self, path=SQLITE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                "pid TEXT PRIMARY KEY, kind TEXT, book TEXT, ingested INTEGER, updated TEXT)")
+
+    def record(self, records):
+        """ store (pid, kind, book, ingested) records """
+        now = _now()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO objects (pid, kind, book, ingested, updated) VALUES (?, ?, ?, ?, ?)",
+                [(pid, kind, book, int(bool(ingested)), now) for pid, kind, book, ingested in records])
+
+    def ingested(self, pids):
+        """ return the subset of pids recorded as ingested """
+        pids = list(pids)
+        found = set()
+        with self._lock:
+            for start in range(0, len(pids), QUERY_CHUNK_SIZE):
+                chunk = pids[start:start + QUERY_CHUNK_SIZE]
+                rows = self._connection.execute(
+                    "SELECT pid FROM objects WHERE ingested = 1 AND pid IN ({0})".format(",".join("?" * len(chunk))),
+                    chunk)
+                found.update(row[0] for row in rows)
+        return found
+
+    def forget(self, pids):
+        """ mark pids, and the pages of any books among them, as not ingested """
+        pids = list(pids)
+        now = _now()
+        with self._lock, self._connection:
+            for start in range(0, len(pids), QUERY_CHUNK_SIZE):
+                chunk = pids[start:start + QUERY_CHUNK_SIZE]
+                marks = ",".join("?" * len(chunk))
+                self._connection.execute(
+                    "UPDATE objects SET ingested = 0, updated = ? WHERE pid IN ({0}) OR book IN ({0})".format(marks),
+                    [now] + chunk + chunk)
+
+
+class MongoLedger(object):
+    """ Ledger stored in a MongoDB collection, shared by all workers """
+
+    def __init__(self, uri=MONGO_URI, database=MONGO_DATABASE, collection=MONGO_COLLECTION):
+        from pymongo import MongoClient
+        self.collection = MongoClient(uri)[database][collection]
+
+    def record(self, records):
+        """ store (pid, kind, book, ingested) records """
+        from pymongo import UpdateOne
+        now = _now()
+        operations = [UpdateOne({"_id": pid}, {"$set": {"kind": kind, "book": book, "ingested": bool(ingested),
+                                                        "updated": now}}, upsert=True)
+                      for pid, kind, book, ingested in records]
+        if operations:
+            self.collection.bulk_write(operations, ordered=False)
+
+    def ingested(self, pids):
+        """ return the subset of pids recorded as ingested """
+        pids = list(pids)
+        found = set()
+        for start in range(0, len(pids), QUERY_CHUNK_SIZE):
+            cursor = self.collection.find({"_id": {"$in": pids[start:start + QUERY_CHUNK_SIZE]}, "ingested": True},
+                                          {"_id": True})
+            found.update(doc["_id"] for doc in cursor)
+        return found
+
+    def forget(self, pids):
+        """ mark pids, and the pages of any books among them, as not ingested """
+        pids = list(pids)
+        now = _now()
+        for start in range(0, len(pids), QUERY_CHUNK_SIZE):
+            chunk = pids[start:start + QUERY_CHUNK_SIZE]
+            self.collection.update_many({"$or": [{"_id": {"$in": chunk}}, {"book": {"$in": chunk}}]},
+                                        {"$set": {"ingested": False, "updated": now}})
+
+
+_ledger = None
+_pid = None
+
+
+def get_ledger():
+    """ return this process's ledger, MongoDB when ISLANDORA_LEDGER_MONGO_URI is set otherwise SQLite """
+    global _ledger, _pid
+    if _ledger is None or _pid != getpid():
+        _pid = getpid()
+        _ledger = None
+        if MONGO_URI:
+            try:
+                _ledger = MongoLedger()
+            except ImportError:
+                logging.error("pymongo is not installed, using the SQLite ingest ledger")
+        if _ledger is None:
+            _ledger = SqliteLedger()
+    return _ledger
+
+
+def record_status(namespace, book_uuid, book_ingested, page_status, ledger=None):
+    """
+    Record the verified state of a book and its pages
+
+    args:
+      namespace: pid namespace of the book
+      book_uuid: uuid of the book
+      book_ingested: True when the book object exists
+      page_status: dictionary of page uuid to True or False
+    """
+    ledger = ledger or get_ledger()
+    book = "{0}:{1}".format(namespace, book_uuid)
+    records = [(book, "book", book, book_ingested)]
+    records.extend(("{0}:{1}".format(namespace, uuid), "page", book, ingested)
+                   for uuid, ingested in (page_status or {}).items())
+    ledger.record(records)
+
+
+def record_deleted(namespace, uuids, ledger=None):
+    """ record objects of namespace as deleted so a later resumed ingest loads them again """
+    ledger = ledger or get_ledger()
+    ledger.forget("{0}:{1}".format(namespace, uuid) for uuid in uuids)
+
+
+def missing(namespace, book_uuid, page_uuids, objects_exist, ledger=None):
+    """
+    Work out which objects of a book still need ingesting. Objects the ledger does not list as
+    ingested are checked with objects_exist and any found are recorded.
+
+    args:
+      namespace: pid namespace of the book
+      book_uuid: uuid of the book
+      page_uuids: list of page uuids
+      objects_exist: function taking (uuids, namespace) returning a dictionary of uuid to True or False
+    returns a tuple of (book is missing, set of missing page uuids)
+    """
+    ledger = ledger or get_ledger()
+    uuids = [book_uuid] + list(page_uuids)
+    known = ledger.ingested("{0}:{1}".format(namespace, uuid) for uuid in uuids)
+    unknown = [uuid for uuid in uuids if "{0}:{1}".format(namespace, uuid) not in known]
+    exists = objects_exist(unknown, namespace) if unknown else {}
+    found = [uuid for uuid in unknown if exists.get(uuid)]
+    if found:
+        book = "{0}:{1}".format(namespace, book_uuid)
+        ledger.record(("{0}:{1}".format(namespace, uuid), "book" if uuid == book_uuid else "page", book, True)
+                      for uuid in found)
+    absent = set(uuid for uuid in unknown if not exists.get(uuid))
+    return book_uuid in absent, absent - set([book_uuid])
@@ -0,0 +1,283 @@
+""" Low overhead in-process metrics exported as Prometheus text and structured log records """
+import logging
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from json import dumps
+from os import getpid, rename
+
+from celery.signals import task_postrun, task_prerun, worker_process_init
+
+try:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+
+try:
+    from urlparse import urlparse
+except ImportError:
+    from urllib.parse import urlparse
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+ENABLED = getattr(celeryconfig, "ISLANDORA_METRICS", True)
+TEXTFILE = getattr(celeryconfig, "ISLANDORA_METRICS_TEXTFILE", None)  # may contain {pid}
+TEXTFILE_INTERVAL = getattr(celeryconfig, "ISLANDORA_METRICS_TEXTFILE_INTERVAL", 15)  # seconds
+PORT = getattr(celeryconfig, "ISLANDORA_METRICS_PORT", None)  # first port tried by each worker process
+ADDRESS = getattr(celeryconfig, "ISLANDORA_METRICS_ADDRESS", "127.0.0.1")  # "" serves on every interface
+DEPENDENCIES = getattr(celeryconfig, "ISLANDORA_METRICS_DEPENDENCIES",
+                       {"localhost:8080": "solr", "cc.lib.ou.edu": "catalog"})
+DEFAULT_DEPENDENCY = "recipe_host"
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+PORT_ATTEMPTS = 64
+
+log = logging.getLogger("islandoraq.metrics")
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = ['{0}="{1}"'.format(name, _escape(value)) for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{{{0}}}".format(",".join(pairs)) if pairs else ""
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self.lock = threading.Lock()
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def header(self):
+        return ["# HELP {0} {1}".format(self.name, self.documentation), "# TYPE {0} {1}".format(self.name, self.kind)]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        with self.lock:
+            items = sorted(self.values.items())
+        return self.header() + ["{0}{1} {2}".format(self.name, _labels(self.labelnames, key), value)
+                                for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set(self, value, **labels):
+        with self.lock:
+            self.values[self._key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = buckets
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self.lock:
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0] * len(self.buckets) + [0, 0.0]  # buckets, count, sum
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[index] += 1
+                    break
+            counts[-2] += 1
+            counts[-1] += value
+
+    def render(self):
+        with self.lock:
+            items = sorted((key, list(counts)) for key, counts in self.values.items())
+        lines = self.header()
+        for key, counts in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append("{0}_bucket{1} {2}".format(
+                    self.name, _labels(self.labelnames, key, 'le="{0}"'.format(bound)), cumulative))
+            lines.append("{0}_bucket{1} {2}".format(self.name, _labels(self.labelnames, key, 'le="+Inf"'), counts[-2]))
+            lines.append("{0}_count{1} {2}".format(self.name, _labels(self.labelnames, key), counts[-2]))
+            lines.append("{0}_sum{1} {2}".format(self.name, _labels(self.labelnames, key), counts[-1]))
+        return lines
+
+
+class Registry(object):
+    """ ordered collection of metrics rendered together """
+
+    def __init__(self):
+        self.metrics = OrderedDict()
+
+    def add(self, metric):
+        return self.metrics.setdefault(metric.name, metric)
+
+    def render(self):
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        for metric in self.metrics.values():
+            with metric.lock:
+                metric.values.clear()
+
+
+registry = Registry()
+task_duration = registry.add(Histogram("islandoraq_task_duration_seconds", "Celery task run time", ["task"]))
+tasks_total = registry.add(Counter("islandoraq_tasks_total", "Finished Celery tasks by state", ["task", "state"]))
+tasks_in_flight = registry.add(Gauge("islandoraq_tasks_in_flight", "Celery tasks running", ["task"]))
+dependency_duration = registry.add(Histogram(
+    "islandoraq_dependency_duration_seconds", "Latency of calls to external dependencies", ["dependency", "operation"]))
+dependency_errors = registry.add(Counter(
+    "islandoraq_dependency_errors_total", "Failed calls to external dependencies", ["dependency", "operation"]))
+dependency_in_flight = registry.add(Gauge(
+    "islandoraq_dependency_in_flight", "Calls to external dependencies in progress", ["dependency"]))
+pages_ingested = registry.add(Counter("islandoraq_pages_ingested_total", "Pages ingested by drush"))
+pages_per_second = registry.add(Gauge("islandoraq_ingest_pages_per_second", "Page rate of the last drush ingest"))
+
+
+def dependency_for(url):
+    """ name the dependency a URL belongs to """
+    return DEPENDENCIES.get(urlparse(url).netloc, DEFAULT_DEPENDENCY)
+
+
+@contextmanager
+def timed(dependency, operation):
+    """ time a call to an external dependency, counting it as an error if it raises """
+    if not ENABLED:
+        yield
+        return
+    dependency_in_flight.inc(dependency=dependency)
+    start = time.time()
+    try:
+        yield
+    except Exception:
+        dependency_errors.inc(dependency=dependency, operation=operation)
+        raise
+    finally:
+        elapsed = time.time() - start
+        dependency_in_flight.dec(dependency=dependency)
+        dependency_duration.observe(elapsed, dependency=dependency, operation=operation)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(dumps({"event": "dependency", "dependency": dependency, "operation": operation,
+                             "seconds": round(elapsed, 6)}))
+
+
+def record_ingest(pages, seconds):
+    """ count the pages of a finished drush ingest and its page rate """
+    if not ENABLED:
+        return
+    pages_ingested.inc(pages)
+    if seconds > 0:
+        pages_per_second.set(round(pages / float(seconds), 3))
+    log.info(dumps({"event": "ingest", "pages": pages, "seconds": round(seconds, 3)}))
+
+
+_started = {}
+
+
+@task_prerun.connect
+def _task_started(task_id=None, task=None, **kwargs):
+    if ENABLED and task is not None:
+        _started[task_id] = time.time()
+        tasks_in_flight.inc(task=task.name)
+
+
+@task_postrun.connect
+def _task_finished(task_id=None, task=None, state=None, **kwargs):
+    start = _started.pop(task_id, None)
+    if not ENABLED or task is None or start is None:
+        return
+    elapsed = time.time() - start
+    tasks_in_flight.dec(task=task.name)
+    task_duration.observe(elapsed, task=task.name)
+    tasks_total.inc(task=task.name, state=state or "UNKNOWN")
+    log.info(dumps({"event": "task", "task": task.name, "task_id": task_id, "state": state,
+                    "seconds": round(elapsed, 6)}))
+
+
+def write_textfile(path):
+    """ atomically write the Prometheus text exposition of this process to path """
+    path = path.format(pid=getpid())
+    tmp = "{0}.tmp".format(path)
+    with open(tmp, "w") as f:
+        f.write(registry.render())
+    rename(tmp, path)
+
+
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _daemon(target):
+    thread = threading.Thread(target=target)
+    thread.daemon = True
+    thread.start()
+    return thread
+
+
+def start_exporters():
+    """ start the configured textfile writer and HTTP endpoint for this process """
+    if not ENABLED:
+        return
+    if TEXTFILE:
+        def write_loop():
+            while True:
+                time.sleep(TEXTFILE_INTERVAL)
+                try:
+                    write_textfile(TEXTFILE)
+                except (IOError, OSError) as err:
+                    log.error("Unable to write metrics textfile: {0}".format(err))
+        _daemon(write_loop)
+    if PORT:
+        for port in range(PORT, PORT + PORT_ATTEMPTS):
+            try:
+                server = HTTPServer((ADDRESS, port), _Handler)
+            except (IOError, OSError):
+                continue
+            log.info("Serving metrics on {0}:{1}".format(ADDRESS, port))
+            _daemon(server.serve_forever)
+            break
+
+
+@worker_process_init.connect
+def _start_after_fork(**kwargs):
+    registry.reset()
+    _started.clear()
+    start_exporters()
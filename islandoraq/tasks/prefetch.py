@@ -0,0 +1,189 @@
+""" Stage recipe page images into the ingest working directory before drush runs """
+import hashlib
+import logging
+import threading
+from itertools import islice
+from multiprocessing.pool import ThreadPool
+from os import chmod, mkdir, remove, rename
+from os.path import basename, exists, getsize, join
+
+import requests
+
+from . import httpclient
+
+try:
+    from urlparse import urljoin, urlparse
+except ImportError:
+    from urllib.parse import urljoin, urlparse
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+PAGE_PREFETCH = getattr(celeryconfig, "ISLANDORA_PAGE_PREFETCH", False)
+CONCURRENCY = getattr(celeryconfig, "ISLANDORA_PAGE_PREFETCH_CONCURRENCY", 8)
+BUDGET = getattr(celeryconfig, "ISLANDORA_PAGE_PREFETCH_BUDGET", 2 * 1024 ** 3)  # bytes per recipe
+ATTEMPTS = 3
+CHUNK_SIZE = 64 * 1024
+
+
+class _Budget(object):
+    """ thread safe byte allowance shared by the downloads of one recipe """
+
+    def __init__(self, limit):
+        self.remaining = limit
+        self.lock = threading.Lock()
+
+    def reserve(self, size):
+        with self.lock:
+            if size > self.remaining:
+                return False
+            self.remaining -= size
+            return True
+
+    def release(self, size):
+        with self.lock:
+            self.remaining += size
+
+
+def _md5(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _download(url, path, md5, budget):
+    """
+    Download url to path, resuming a partial download left by an earlier attempt. The bytes
+    reserved from budget cover the largest the file has been across attempts, and are handed back
+    with the partial file when the page is left remote.
+    returns True when the file is complete and matches the expected size and checksum
+    """
+    if exists(path) and (not md5 or _md5(path) == md5):
+        return True
+    partial = path + ".part"
+    reserved = [0]
+
+    def reserve(size):
+        """ extend this page's reservation to size bytes """
+        if size > reserved[0]:
+            if not budget.reserve(size - reserved[0]):
+                return False
+            reserved[0] = size
+        return True
+
+    def give_up():
+        if exists(partial):
+            remove(partial)
+        budget.release(reserved[0])
+        return False
+
+    for attempt in range(ATTEMPTS):
+        offset = getsize(partial) if exists(partial) else 0
+        headers = {"Range": "bytes={0}-".format(offset)} if offset else {}
+        try:
+            resp = httpclient.get(url, headers=headers, stream=True)
+            if resp.status_code == 206:
+                mode = "ab"
+            elif resp.status_code == 200:
+                mode, offset = "wb", 0
+            else:
+                logging.error("Page prefetch of {0} failed with status {1}".format(url, resp.status_code))
+                return give_up()
+            length = resp.headers.get("Content-Length")
+            if length is not None and not reserve(offset + int(length)):
+                logging.info("Page prefetch budget exhausted, leaving {0} remote".format(url))
+                resp.close()
+                return give_up()
+            written = offset
+            with open(partial, mode) as f:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    written += len(chunk)
+                    if length is None and not reserve(written):
+                        logging.info("Page prefetch budget exhausted, leaving {0} remote".format(url))
+                        resp.close()
+                        return give_up()
+        except (IOError, requests.RequestException) as err:
+            logging.warning("Page prefetch attempt {0} of {1} failed: {2}".format(attempt + 1, url, err))
+            continue
+        if length is not None and getsize(partial) != offset + int(length):
+            logging.warning("Page prefetch of {0} is incomplete, resuming".format(url))
+            continue
+        if md5 and _md5(partial) != md5:
+            logging.warning("Page prefetch of {0} failed checksum, restarting".format(url))
+            remove(partial)
+            continue
+        rename(partial, path)
+        return True
+    return give_up()
+
+
+def stage_page_stream(pages, tmpdir, recipe_uri=None, concurrency=CONCURRENCY, budget=BUDGET):
+    """
+    Download the page files of an iterable of recipe pages into tmpdir, yielding each page in order
+    pointing at its local file. Pages are handled in small batches so the page list is never held
+    whole. Pages that cannot be staged within the disk budget keep their remote file.
+
+    args:
+      pages: iterable of recipe page dictionaries
+      tmpdir: working directory of the ingest
+      recipe_uri: URL the recipe was fetched from, used to resolve relative page files
+      concurrency: number of simultaneous downloads
+      budget: maximum number of bytes to stage
+    """
+    pagedir = join(tmpdir, "pages")
+    if not exists(pagedir):
+        mkdir(pagedir)
+        chmod(pagedir, 0o775)
+    allowance = _Budget(budget)
+
+    def stage(item):
+        index, page = item
+        url = page.get("file")
+        if not url:
+            return page
+        if recipe_uri:
+            url = urljoin(recipe_uri, url)
+        if not urlparse(url).netloc:
+            return page
+        path = join(pagedir, "{0:05d}_{1}".format(index, basename(urlparse(url).path)))
+        if not _download(url, path, page.get("md5"), allowance):
+            return dict(page, file=url)
+        return dict(page, file=path)
+
+    concurrency = max(1, concurrency)
+    pool = ThreadPool(concurrency)
+    staged = total = 0
+    try:
+        numbered = enumerate(pages)
+        while True:
+            batch = list(islice(numbered, concurrency * 4))
+            if not batch:
+                break
+            for page in pool.map(stage, batch, chunksize=1):
+                total += 1
+                if page.get("file", "").startswith(pagedir):
+                    staged += 1
+                yield page
+    finally:
+        pool.close()
+        pool.join()
+        logging.debug("Staged {0} of {1} pages in {2}".format(staged, total, pagedir))
+
+
+def stage_pages(recipe, tmpdir, recipe_uri=None, concurrency=CONCURRENCY, budget=BUDGET):
+    """
+    Download the page files of a recipe dictionary into tmpdir and return a copy of the recipe
+    pointing at the local files. See stage_page_stream.
+    """
+    pages = recipe["recipe"].get("pages") or []
+    if not pages:
+        return recipe
+    staged = dict(recipe)
+    staged["recipe"] = dict(recipe["recipe"], pages=list(
+        stage_page_stream(pages, tmpdir, recipe_uri, concurrency, budget)))
+    return staged
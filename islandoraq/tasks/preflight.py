@@ -0,0 +1,92 @@
+"""
+Worker process preflight.
+
+When a prefork child starts, the registered checks run once in a background thread, started by
+the tasks module after the other modules have reset their per-process state. They resolve drush
+and the workspace group and probe solr and the catalog, so the HTTP pools and the health probe
+cache are warm before the first task and the child starts taking tasks at once. Results are kept
+in this module and reported by the preflight_status task; the resolved drush path is used by
+every drush command line.
+"""
+import logging
+import threading
+import time
+from os import getpid
+
+try:
+    from shutil import which
+except ImportError:  # Python 2
+    from distutils.spawn import find_executable as which
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+ENABLED = getattr(celeryconfig, "ISLANDORA_PREFLIGHT", True)
+
+checks = []
+results = {}
+_drush = None
+_thread = None
+_pid = None
+
+
+def register(name, check):
+    """ add a check run by the preflight; it returns a JSON compatible value or raises """
+    checks.append((name, check))
+
+
+def find_drush():
+    """ path of the drush executable on PATH, raising when there is none """
+    global _drush
+    path = which("drush")
+    if not path:
+        raise Exception("drush not found on PATH")
+    _drush = path
+    return path
+
+
+def drush_path():
+    """ drush executable found by the preflight, looked up now when it has not run; "drush" when it is not on PATH """
+    if _drush is None:
+        try:
+            return find_drush()
+        except Exception:
+            return "drush"
+    return _drush
+
+
+def run():
+    """ run every check now, returning {name: {"ok", "value" or "error", "seconds"}} """
+    for name, check in checks:
+        start = time.time()
+        try:
+            result = {"ok": True, "value": check()}
+        except Exception as err:
+            logging.warning("Preflight check {0} failed: {1}".format(name, err))
+            result = {"ok": False, "error": str(err)}
+        result["seconds"] = round(time.time() - start, 3)
+        results[name] = result
+    return dict(results)
+
+
+def start():
+    """ run the checks in a background thread of this process """
+    global _thread, _pid
+    _pid = getpid()
+    results.clear()
+    _thread = threading.Thread(target=run, name="preflight")
+    _thread.daemon = True
+    _thread.start()
+    return _thread
+
+
+def status(wait=None):
+    """ return the preflight results of this process, waiting up to wait seconds for it to finish """
+    if _thread is not None and _pid == getpid():
+        _thread.join(wait)
+        running = _thread.is_alive()
+    else:
+        running = False
+    return {"running": running, "checks": dict(results)}
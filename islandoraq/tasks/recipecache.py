@@ -0,0 +1,221 @@
+""" Recipe cache keyed by URL with conditional GETs, an in-process LRU tier and a content-addressed disk tier """
+import hashlib
+import logging
+import threading
+import time
+from json import loads, dumps
+from os import getpid, listdir, makedirs, remove, rename, stat, utime
+from os.path import exists, getsize, join
+from tempfile import gettempdir
+
+import requests
+
+from . import httpclient
+from . import recipestream
+from .cache import LRUCache
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+CACHE_DIR = getattr(celeryconfig, "ISLANDORA_RECIPE_CACHE_DIR", join(gettempdir(), "islandoraq_recipes"))
+CACHE_ENTRIES = getattr(celeryconfig, "ISLANDORA_RECIPE_CACHE_ENTRIES", 32)
+CACHE_MAX_BYTES = getattr(celeryconfig, "ISLANDORA_RECIPE_CACHE_MAX_BYTES", 512 * 1024 ** 2)
+CACHE_MAX_AGE = getattr(celeryconfig, "ISLANDORA_RECIPE_CACHE_MAX_AGE", 300)  # seconds served without revalidation
+
+
+class RecipeError(Exception):
+    """ raised when a recipe URL does not return a recipe """
+
+    def __init__(self, url, status):
+        super(RecipeError, self).__init__("Server status {0} for recipe at: {1}".format(status, url))
+        self.url = url
+        self.status = status
+
+
+def _digest(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _scan(url, chunks, resp):
+    """ build a cache entry from a recipe stream without holding the whole recipe """
+    entry = {
+        "url": url,
+        "etag": resp.headers.get("ETag"),
+        "last_modified": resp.headers.get("Last-Modified"),
+        "fetched": time.time(),
+        "book_uuid": None,
+        "page_uuids": [],
+        "is_recipe": False,
+    }
+    try:
+        for key, value in recipestream.iter_recipe(chunks):
+            entry["is_recipe"] = True
+            if key == "uuid":
+                entry["book_uuid"] = value
+            elif key == "pages":
+                entry["page_uuids"] = [page.get("uuid") for page in value if isinstance(page, dict)]
+    except ValueError as err:
+        logging.error("Unable to parse recipe at {0}: {1}".format(url, err))
+        entry["is_recipe"] = False
+    for _ in chunks:
+        pass  # keep reading so the whole body reaches the cache
+    return entry
+
+
+class RecipeCache(object):
+    """
+    Two tier recipe cache. Entries hold the validators and the book and page UUIDs of a recipe
+    while the body is streamed to disk once per content digest, with an index file per URL.
+    The disk tier is trimmed least recently used first to max_bytes.
+    """
+
+    def __init__(self, directory=CACHE_DIR, entries=CACHE_ENTRIES, max_bytes=CACHE_MAX_BYTES, max_age=CACHE_MAX_AGE):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.memory = LRUCache(entries)
+        self._lock = threading.Lock()
+
+    def _path(self, kind, key):
+        return join(self.directory, kind, key + ".json")
+
+    def _makedirs(self):
+        for kind in ("index", "objects"):
+            try:
+                makedirs(join(self.directory, kind))
+            except OSError:
+                if not exists(join(self.directory, kind)):
+                    raise
+
+    def path(self, entry):
+        """ return the path of the cached recipe body of an entry """
+        return self._path("objects", entry["digest"])
+
+    def _load(self, url):
+        """ load an entry for url from the disk tier """
+        try:
+            with open(self._path("index", _digest(url.encode("utf-8")))) as f:
+                entry = loads(f.read())
+            utime(self.path(entry), None)
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        return entry
+
+    def _write_index(self, entry):
+        index_path = self._path("index", _digest(entry["url"].encode("utf-8")))
+        tmp = "{0}.{1}.{2}.tmp".format(index_path, getpid(), threading.current_thread().ident)
+        with open(tmp, "w") as f:
+            f.write(dumps(entry))
+        rename(tmp, index_path)
+
+    def _evict(self, keep=None):
+        """ remove the least recently used bodies until the disk tier fits max_bytes, sparing keep """
+        with self._lock:
+            objects_dir = join(self.directory, "objects")
+            files = []
+            for name in listdir(objects_dir):
+                path = join(objects_dir, name)
+                try:
+                    info = stat(path)
+                except OSError:
+                    continue
+                if path == keep:
+                    continue
+                files.append((info.st_mtime, info.st_size, path))
+            total = sum(size for _, size, _ in files) + (getsize(keep) if keep and exists(keep) else 0)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    remove(path)
+                except OSError:
+                    pass
+                total -= size
+
+    def _download(self, url, resp):
+        """ stream a response body into the objects directory while scanning it for UUIDs """
+        self._makedirs()
+        digest = hashlib.sha256()
+        tmp = join(self.directory, "objects", "{0}.{1}.tmp".format(getpid(), threading.current_thread().ident))
+        try:
+            with open(tmp, "wb") as f:
+                chunks = recipestream.tee(resp.iter_content(recipestream.CHUNK_SIZE), f.write, digest.update)
+                entry = _scan(url, chunks, resp)
+        except Exception:
+            remove(tmp)
+            raise
+        entry["digest"] = digest.hexdigest()
+        rename(tmp, self.path(entry))
+        return entry
+
+    def fetch(self, url):
+        """
+        Return the cache entry for a recipe URL, revalidating with the server when older than max_age.
+        Raises RecipeError for non 200 responses and requests exceptions for connection problems.
+        """
+        entry = self.memory.get(url) or self._load(url)
+        if entry and not exists(self.path(entry)):
+            entry = None
+        if entry and time.time() - entry["fetched"] < self.max_age:
+            self.memory.set(url, entry)
+            return entry
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        resp = httpclient.get(url, headers=headers, stream=True)
+        try:
+            if resp.status_code == 304 and entry:
+                entry = dict(entry, fetched=time.time())
+            elif resp.status_code != requests.codes.ok:
+                raise RecipeError(url, resp.status_code)
+            else:
+                entry = self._download(url, resp)
+        finally:
+            resp.close()
+        self.memory.set(url, entry)
+        try:
+            self._write_index(entry)
+            self._evict(keep=self.path(entry))
+        except (IOError, OSError) as err:
+            logging.warning("Unable to index recipe {0} in cache: {1}".format(url, err))
+        return entry
+
+    def open(self, entry):
+        """ open the cached recipe body of an entry for binary reading """
+        return open(self.path(entry), "rb")
+
+    def invalidate(self, url):
+        self.memory.pop(url)
+        try:
+            remove(self._path("index", _digest(url.encode("utf-8"))))
+        except OSError:
+            pass
+
+
+cache = RecipeCache()
+
+
+def fetch(url):
+    """ return the cached entry for url from the worker's recipe cache """
+    return cache.fetch(url)
+
+
+def path(entry):
+    """ return the path of the cached recipe body of an entry """
+    return cache.path(entry)
+
+
+def open_recipe(entry):
+    """ open the cached recipe body of an entry for binary reading """
+    return cache.open(entry)
+
+
+def iter_recipe(entry):
+    """ iterate the recipe fields of an entry from disk, see recipestream.iter_recipe """
+    with cache.open(entry) as f:
+        for field in recipestream.iter_recipe(recipestream.read_chunks(f)):
+            yield field
@@ -0,0 +1,162 @@
+""" Incremental reading and writing of recipe json so large books are never held in memory whole """
+import codecs
+from json import JSONDecoder, dumps
+
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = " \t\r\n"
+NUMBER_CHARS = "0123456789+-.eE"
+
+_decoder = JSONDecoder()
+
+
+class _Scanner(object):
+    """ pulls json values one at a time from an iterable of byte or text chunks """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.decoder = codecs.getincrementaldecoder("utf-8")()
+        self.buf = ""
+        self.pos = 0
+        self.eof = False
+
+    def _fill(self):
+        """ append the next chunk to the buffer returning False at the end of the stream """
+        if self.eof:
+            return False
+        chunk = next(self.chunks, None)
+        if chunk is None:
+            self.eof = True
+            data = self.decoder.decode(b"", final=True)
+        elif isinstance(chunk, bytes):
+            data = self.decoder.decode(chunk)
+        else:
+            data = chunk
+        self.buf = self.buf[self.pos:] + data
+        self.pos = 0
+        return True
+
+    def peek(self):
+        """ skip whitespace and return the next character """
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                raise ValueError("Unexpected end of recipe")
+
+    def expect(self, char):
+        if self.peek() != char:
+            raise ValueError("Expected '{0}' in recipe at offset {1}".format(char, self.pos))
+        self.pos += 1
+
+    def value(self):
+        """ decode the next complete json value """
+        self.peek()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buf, self.pos)
+            except ValueError:
+                if not self._fill():
+                    raise
+                continue
+            if isinstance(value, (int, float)) and not self.buf[end:].strip(NUMBER_CHARS) and self._fill():
+                continue  # a number may continue in the next chunk
+            self.pos = end
+            return value
+
+    def members(self):
+        """ iterate the keys of the next object, the caller consumes each value before advancing """
+        self.expect("{")
+        if self.peek() == "}":
+            self.pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(":")
+            yield key
+            char = self.peek()
+            self.pos += 1
+            if char == "}":
+                return
+            if char != ",":
+                raise ValueError("Expected ',' or '}}' in recipe at offset {0}".format(self.pos))
+
+    def items(self):
+        """ iterate the values of the next array """
+        self.expect("[")
+        if self.peek() == "]":
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            char = self.peek()
+            self.pos += 1
+            if char == "]":
+                return
+            if char != ",":
+                raise ValueError("Expected ',' or ']' in recipe at offset {0}".format(self.pos))
+
+
+def iter_recipe(chunks):
+    """
+    Iterate the fields of the "recipe" object of a recipe document as (key, value) pairs.
+    The value for "pages" is a generator of page dictionaries read lazily from the stream; it is
+    drained automatically if not consumed before the next field is requested.
+
+    args:
+      chunks: iterable of byte or text chunks, e.g. response.iter_content() or a file read loop
+    raises ValueError when the document is not a recipe
+    """
+    scanner = _Scanner(chunks)
+    found = False
+    for key in scanner.members():
+        if key != "recipe" or scanner.peek() != "{":
+            scanner.value()
+            continue
+        found = True
+        for field in scanner.members():
+            if field == "pages" and scanner.peek() == "[":
+                pages = scanner.items()
+                yield field, pages
+                for _ in pages:
+                    pass
+            else:
+                yield field, scanner.value()
+    if not found:
+        raise ValueError("Document has no recipe object")
+
+
+def read_chunks(fileobj, size=CHUNK_SIZE):
+    """ iterate a file object in chunks """
+    return iter(lambda: fileobj.read(size), fileobj.read(0))
+
+
+def tee(chunks, *sinks):
+    """ pass chunks through while writing each one to every sink """
+    for chunk in chunks:
+        for sink in sinks:
+            sink(chunk)
+        yield chunk
+
+
+def write_recipe(out, fields, pages=None):
+    """
+    Write a recipe document to out field by field and page by page.
+
+    args:
+      out: text file object
+      fields: iterable of (key, value) recipe fields, e.g. iter_recipe() or recipe["recipe"].items()
+      pages: optional function applied to the iterable of pages before they are written
+    """
+    out.write('{"recipe": {')
+    for index, (key, value) in enumerate(fields):
+        out.write('{0}{1}: '.format(", " if index else "", dumps(key)))
+        if key == "pages" and not isinstance(value, (dict, str, bytes, type(None))):
+            out.write("[")
+            for count, page in enumerate(pages(value) if pages else value):
+                out.write("{0}{1}".format(", " if count else "", dumps(page)))
+            out.write("]")
+        else:
+            out.write(dumps(value))
+    out.write("}}")
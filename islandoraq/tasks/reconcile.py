@@ -0,0 +1,184 @@
+"""
+Collection scale reconciliation of the objects in solr against the objects recipes expect.
+
+PIDs are held as sorted arrays of 64 bit hashes, 8 bytes per PID, so millions of PIDs fit in
+tens of megabytes. With 64 bit hashes the chance of any collision among 10 million PIDs is
+about 3 in a million; a collision can only hide a missing or orphaned object, never invent one.
+"""
+import hashlib
+import heapq
+from array import array
+from bisect import bisect_left
+from json import dumps, loads
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+SOLR_ROWS = getattr(celeryconfig, "ISLANDORA_RECONCILE_SOLR_ROWS", 5000)
+CATALOG_PAGE_SIZE = getattr(celeryconfig, "ISLANDORA_RECONCILE_CATALOG_PAGE_SIZE", 500)
+SORT_CHUNK = 200000  # hashes sorted at a time before merging
+recipe_url_template = "https://bag.ou.edu/derivative/{0}/{1}/{2}.json"
+
+try:
+    TYPECODE = "Q"
+    array(TYPECODE)
+except ValueError:  # Python 2 has no "Q"; "L" is 64 bits on 64 bit Linux
+    TYPECODE = "L"
+
+
+def pid_hash(pid):
+    """ 64 bit hash of a PID """
+    return int(hashlib.md5(pid.encode("utf-8")).hexdigest()[:16], 16)
+
+
+class PidSet(object):
+    """
+    Append-only set of PID hashes. Hashes are sorted in chunks as they arrive and merged into
+    one sorted, de-duplicated array by freeze(), after which membership tests use bisection.
+    """
+
+    def __init__(self):
+        self._pending = []
+        self._chunks = []
+        self.hashes = None
+
+    def add(self, pid):
+        self._pending.append(pid_hash(pid))
+        if len(self._pending) >= SORT_CHUNK:
+            self._flush()
+
+    def _flush(self):
+        if self._pending:
+            self._pending.sort()
+            self._chunks.append(array(TYPECODE, self._pending))
+            self._pending = []
+
+    def freeze(self):
+        self._flush()
+        self.hashes = array(TYPECODE)
+        last = None
+        for value in heapq.merge(*self._chunks):
+            if value != last:
+                self.hashes.append(value)
+                last = value
+        self._chunks = []
+        return self
+
+    def __len__(self):
+        return len(self.hashes)
+
+    def __contains__(self, pid):
+        return self.contains_hash(pid_hash(pid))
+
+    def contains_hash(self, value):
+        index = bisect_left(self.hashes, value)
+        return index < len(self.hashes) and self.hashes[index] == value
+
+    def difference_count(self, other):
+        """ number of hashes in this set and not in other, by walking both sorted arrays """
+        count = 0
+        position = 0
+        theirs = other.hashes
+        for value in self.hashes:
+            while position < len(theirs) and theirs[position] < value:
+                position += 1
+            if position >= len(theirs) or theirs[position] != value:
+                count += 1
+        return count
+
+
+def solr_pids(get, solr_select_url, namespace, rows=SOLR_ROWS):
+    """
+    Stream every PID in a namespace from solr using cursorMark deep paging
+
+    args:
+      get: function performing a GET request, e.g. httpclient.get
+      solr_select_url: solr select handler URL
+      namespace: pid namespace
+    """
+    cursor = "*"
+    while True:
+        resp = get(solr_select_url, params={
+            "q": "PID:{0}\\:*".format(namespace),
+            "fl": "PID",
+            "sort": "PID asc",
+            "rows": rows,
+            "cursorMark": cursor,
+            "wt": "json"
+        })
+        resp.raise_for_status()
+        data = loads(resp.text)
+        for doc in data["response"]["docs"]:
+            yield doc["PID"]
+        next_cursor = data.get("nextCursorMark")
+        if not next_cursor or next_cursor == cursor:
+            break
+        cursor = next_cursor
+
+
+def catalog_recipe_urls(get, catalog_url, collection=None, namespace=None, page_size=CATALOG_PAGE_SIZE):
+    """
+    Stream the recipe URLs of the bags the data catalog records in an Islandora collection, or in
+    any collection of a namespace
+
+    args:
+      get: function performing a GET request, e.g. httpclient.get
+      catalog_url: catalog collection URL
+      collection: collection name with namespace (e.x. oku:hos)
+      namespace: pid namespace (e.x. oku), used when collection is not given
+    """
+    match = collection if collection else {"$regex": "^{0}:".format(namespace)}
+    query = dumps({"filter": {"application.islandora.collection": match}})
+    resp = get(catalog_url, params={"query": query, "page_size": page_size})
+    while True:
+        resp.raise_for_status()
+        catalogitems = loads(resp.text)
+        for item in catalogitems.get("results", []):
+            islandora = item.get("application", {}).get("islandora", {})
+            if item.get("bag") and islandora.get("derivative"):
+                yield recipe_url_template.format(item["bag"], islandora["derivative"], item["bag"].lower())
+        if not catalogitems.get("next"):
+            break
+        resp = get(catalogitems["next"])
+
+
+def reconcile(actual_pids, expected_pids, max_report=1000):
+    """
+    Compare the PIDs present with the PIDs expected
+
+    args:
+      actual_pids: function returning a fresh iterator of PIDs present, called once more when
+                   there are orphaned objects to name
+      expected_pids: iterator of expected PIDs
+      max_report: most missing and orphaned PIDs listed
+    returns counts of present, expected, missing and orphaned objects with up to max_report of each
+    """
+    actual = PidSet()
+    for pid in actual_pids():
+        actual.add(pid)
+    actual.freeze()
+
+    expected = PidSet()
+    missing = []
+    reported = set()
+    for pid in expected_pids:
+        expected.add(pid)
+        if len(missing) < max_report and pid not in actual and pid not in reported:
+            missing.append(pid)
+            reported.add(pid)
+    expected.freeze()
+
+    missing_count = expected.difference_count(actual)
+    orphaned_count = actual.difference_count(expected)
+    orphaned = []
+    if orphaned_count and max_report:
+        for pid in actual_pids():
+            if pid not in expected:
+                orphaned.append(pid)
+                if len(orphaned) >= min(max_report, orphaned_count):
+                    break
+    return {"objects": len(actual), "expected": len(expected), "missing_count": missing_count,
+            "orphaned_count": orphaned_count, "missing": missing, "orphaned": orphaned,
+            "truncated": missing_count > len(missing) or orphaned_count > len(orphaned)}
@@ -0,0 +1,204 @@
+""" Compact task results with the bulky detail kept in a side store """
+import datetime
+import logging
+import re
+import time
+import uuid
+from json import dump, load
+from os import getpid, listdir, makedirs, remove, rename, stat
+from os.path import exists, join
+from socket import gethostname
+from tempfile import gettempdir
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+RESULT_FORMAT = getattr(celeryconfig, "ISLANDORA_RESULT_FORMAT", "compact")  # compact or verbose
+STORE_DIR = getattr(celeryconfig, "ISLANDORA_RESULT_STORE_DIR", join(gettempdir(), "islandoraq_results"))
+STORE_MAX_BYTES = getattr(celeryconfig, "ISLANDORA_RESULT_STORE_MAX_BYTES", 256 * 1024 ** 2)
+RETENTION = getattr(celeryconfig, "ISLANDORA_RESULT_RETENTION", 7 * 24 * 3600)  # seconds
+# detail is read back by result_detail on any worker, so share any MongoDB already configured
+MONGO_URI = getattr(celeryconfig, "ISLANDORA_RESULT_STORE_MONGO_URI",
+                    getattr(celeryconfig, "ISLANDORA_LEDGER_MONGO_URI",
+                            getattr(celeryconfig, "ISLANDORA_SUBMISSION_MONGO_URI", None)))
+MONGO_DATABASE = getattr(celeryconfig, "ISLANDORA_RESULT_STORE_MONGO_DATABASE", "islandoraq")
+MONGO_COLLECTION = getattr(celeryconfig, "ISLANDORA_RESULT_STORE_MONGO_COLLECTION", "task_detail")
+EVICT_INTERVAL = 50  # saves between retention sweeps of the file store
+FORMATS = ("compact", "verbose")
+
+_ID = re.compile(r"^[0-9a-f]{32}$")
+_STATUS = re.compile(r"^(Server|Drush) status (-?\d+)")
+
+
+def error_code(reason):
+    """ return a short code for a failure reason such as "Server status 404" or an exception """
+    if isinstance(reason, Exception):
+        return type(reason).__name__
+    reason = str(reason)
+    match = _STATUS.match(reason)
+    if match:
+        return "{0}_{1}".format("http" if match.group(1) == "Server" else "drush", match.group(2))
+    if reason.startswith("Request error"):
+        return "request_error"
+    if reason.startswith("Invalid recipe"):
+        return "invalid_recipe"
+    return "error"
+
+
+def jsonable(value):
+    """ copy of value safe for JSON, with exceptions and bytes turned into text """
+    if isinstance(value, dict):
+        return dict((str(key), jsonable(item)) for key, item in value.items())
+    if isinstance(value, (list, tuple)):
+        return [jsonable(item) for item in value]
+    if isinstance(value, bytes):
+        return value.decode("utf-8", "replace")
+    if isinstance(value, Exception):
+        return "{0}: {1}".format(type(value).__name__, value)
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+class FileStore(object):
+    """
+    Detail documents kept as JSON files, removed after RETENTION seconds or when over max_bytes.
+    The directory is local to a host, so references name the host the detail can be read on.
+    """
+
+    scheme = "file"
+
+    def __init__(self, directory=STORE_DIR, max_bytes=STORE_MAX_BYTES, retention=RETENTION, host=None):
+        self.directory = directory
+        self.host = host or gethostname()
+        self.max_bytes = max_bytes
+        self.retention = retention
+        self._saves = 0
+        if not exists(directory):
+            makedirs(directory)
+
+    def save(self, key, document):
+        path = join(self.directory, key + ".json")
+        tmp = "{0}.{1}.tmp".format(path, getpid())
+        with open(tmp, "w") as f:
+            dump(document, f)
+        rename(tmp, path)
+        self._saves += 1
+        if self._saves % EVICT_INTERVAL == 1:
+            self.evict()
+
+    def load(self, key):
+        try:
+            with open(join(self.directory, key + ".json")) as f:
+                return load(f)
+        except (IOError, OSError):
+            return None
+
+    def evict(self):
+        """ remove expired documents, then the oldest until the store fits in max_bytes """
+        files = []
+        for name in listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = join(self.directory, name)
+            try:
+                info = stat(path)
+            except OSError:
+                continue
+            files.append((info.st_mtime, info.st_size, path))
+        files.sort()
+        expires = time.time() - self.retention
+        total = sum(size for mtime, size, path in files)
+        for mtime, size, path in files:
+            if mtime >= expires and total <= self.max_bytes:
+                break
+            try:
+                remove(path)
+            except OSError:
+                pass
+            total -= size
+
+
+class MongoStore(object):
+    """ Detail documents kept in a MongoDB collection with a TTL index for retention """
+
+    scheme = "mongodb"
+    host = None  # readable from every worker
+
+    def __init__(self, uri=MONGO_URI, database=MONGO_DATABASE, collection=MONGO_COLLECTION, retention=RETENTION):
+        from pymongo import MongoClient
+        self.collection = MongoClient(uri)[database][collection]
+        self.collection.create_index("created", expireAfterSeconds=int(retention))
+
+    def save(self, key, document):
+        self.collection.insert_one({"_id": key, "created": datetime.datetime.utcnow(), "detail": document})
+
+    def load(self, key):
+        doc = self.collection.find_one({"_id": key})
+        return None if doc is None else doc["detail"]
+
+
+_store = None
+_pid = None
+
+
+def get_store():
+    """ return this process's side store, MongoDB when ISLANDORA_RESULT_STORE_MONGO_URI is set otherwise files """
+    global _store, _pid
+    if _store is None or _pid != getpid():
+        _pid = getpid()
+        _store = None
+        if MONGO_URI:
+            try:
+                _store = MongoStore()
+            except ImportError:
+                logging.error("pymongo is not installed, keeping task detail in files")
+        if _store is None:
+            _store = FileStore()
+    return _store
+
+
+def save_detail(kind, detail, store=None):
+    """
+    Keep detail in the side store returning its reference, or None when it could not be stored
+
+    args:
+      kind: name of the task the detail belongs to
+      detail: JSON compatible document
+    """
+    store = store or get_store()
+    key = uuid.uuid4().hex
+    try:
+        store.save(key, {"kind": kind, "created": datetime.datetime.utcnow().isoformat(), "detail": jsonable(detail)})
+    except Exception as err:
+        logging.error("Unable to store {0} detail: {1}".format(kind, err))
+        return None
+    if store.host:
+        return "{0}@{1}:{2}".format(store.scheme, store.host, key)
+    return "{0}:{1}".format(store.scheme, key)
+
+
+def load_detail(reference, store=None):
+    """
+    return the detail document of a reference, or None when unknown, expired or kept in the
+    file store of another host
+    """
+    store = store or get_store()
+    scheme, _, key = (reference or "").partition(":")
+    scheme, _, host = scheme.partition("@")
+    if scheme != store.scheme or not _ID.match(key):
+        return None
+    if host and host != store.host:
+        logging.warning("Detail {0} is kept on {1}, read it from a worker of that host".format(key, host))
+        return None
+    return store.load(key)
+
+
+def check_format(result_format):
+    """ return result_format or the configured default, rejecting unknown formats """
+    result_format = result_format or RESULT_FORMAT
+    if result_format not in FORMATS:
+        raise ValueError("result_format must be one of {0}".format(FORMATS))
+    return result_format
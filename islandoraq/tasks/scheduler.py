@@ -0,0 +1,250 @@
+"""
+Backlog of scheduled ingests routed to size class queues.
+
+Books are classed by page count and each class has its own Celery queue and a limit on the
+ingests dispatched at once. Within a class ingests are released in start-time fair queueing
+order over flows of (collection, submitter), so a flow submitting many books cannot starve the
+others; a flow's share is set by its weight. The backlog lives in SQLite and is only touched by
+the tasks routed to the scheduler queue, which should be consumed by a single worker process.
+"""
+import sqlite3
+import threading
+import time
+from json import dumps, loads
+from os.path import join
+from tempfile import gettempdir
+
+from . import metrics
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+ENABLED = getattr(celeryconfig, "ISLANDORA_SCHEDULER", False)
+QUEUE = getattr(celeryconfig, "ISLANDORA_SCHEDULER_QUEUE", "islandora_scheduler")
+# (name, largest page count or None, ingests dispatched at once) from the smallest class up
+SIZE_CLASSES = getattr(celeryconfig, "ISLANDORA_SIZE_CLASSES", (("small", 300, 4), ("medium", 1500, 2),
+                                                                ("large", None, 1)))
+QUEUE_TEMPLATE = getattr(celeryconfig, "ISLANDORA_SIZE_QUEUE_TEMPLATE", "islandora_{0}")
+WEIGHTS = getattr(celeryconfig, "ISLANDORA_SCHEDULER_WEIGHTS", {})  # collection or submitter to weight
+PATH = getattr(celeryconfig, "ISLANDORA_SCHEDULER_PATH", join(gettempdir(), "islandoraq_scheduler.sqlite"))
+HEARTBEAT = getattr(celeryconfig, "ISLANDORA_SCHEDULER_HEARTBEAT", 60)  # seconds between heartbeats of a running ingest
+STALE_AFTER = getattr(celeryconfig, "ISLANDORA_SCHEDULER_STALE_AFTER", 900)  # seconds without a heartbeat to free a slot
+RETENTION = getattr(celeryconfig, "ISLANDORA_SCHEDULER_RETENTION", 7 * 24 * 3600)  # seconds finished jobs are kept
+RATE_SMOOTHING = 0.3
+
+queued_books = metrics.registry.add(metrics.Gauge(
+    "islandoraq_scheduler_queued", "Books waiting in the scheduler backlog", ["size_class"]))
+drain_seconds = metrics.registry.add(metrics.Gauge(
+    "islandoraq_scheduler_drain_seconds", "Estimated seconds to ingest the backlog of a size class", ["size_class"]))
+
+
+def size_class(pages):
+    """ return the name of the smallest size class holding a book of pages """
+    for name, limit, concurrency in SIZE_CLASSES:
+        if limit is None or pages <= limit:
+            return name
+    return SIZE_CLASSES[-1][0]
+
+
+def queue_for(name):
+    return QUEUE_TEMPLATE.format(name)
+
+
+def weight(collection, submitter):
+    return float(WEIGHTS.get(collection, 1)) * float(WEIGHTS.get(submitter, 1))
+
+
+class Backlog(object):
+    """ SQLite backed scheduler state: queued and running ingests, flow tags and class page rates """
+
+    def __init__(self, path=PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, recipe_url TEXT, collection TEXT, pid_namespace TEXT, "
+                "submitter TEXT, pages INTEGER, size_class TEXT, state TEXT, start_tag REAL, "
+                "submitted REAL, started REAL, finished REAL, task_id TEXT, submission TEXT, heartbeat REAL, resume INTEGER)")
+            columns = [row[1] for row in self._connection.execute("PRAGMA table_info(jobs)")]
+            for column in ("heartbeat REAL", "resume INTEGER"):
+                if column.split()[0] not in columns:  # backlog created by an earlier version
+                    self._connection.execute("ALTER TABLE jobs ADD COLUMN {0}".format(column))
+            self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (size_class, state, start_tag)")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS flows (size_class TEXT, flow TEXT, finish_tag REAL, "
+                "PRIMARY KEY (size_class, flow))")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS classes (size_class TEXT PRIMARY KEY, virtual_time REAL, "
+                "pages_per_second REAL)")
+
+    def _class(self, name):
+        row = self._connection.execute(
+            "SELECT virtual_time, pages_per_second FROM classes WHERE size_class = ?", (name,)).fetchone()
+        return row or (0.0, None)
+
+    def submit(self, recipe_url, collection, pid_namespace, submitter, pages, submission=None):
+        """ queue an ingest returning (job id, size class); submission is the (key, owner) claim passed on to the ingest """
+        name = size_class(pages)
+        flow = "{0}|{1}".format(collection, submitter or "")
+        with self._lock, self._connection:
+            virtual_time = self._class(name)[0]
+            row = self._connection.execute(
+                "SELECT finish_tag FROM flows WHERE size_class = ? AND flow = ?", (name, flow)).fetchone()
+            start_tag = max(virtual_time, row[0] if row else 0.0)
+            finish_tag = start_tag + max(pages, 1) / weight(collection, submitter)
+            self._connection.execute(
+                "INSERT OR REPLACE INTO flows (size_class, flow, finish_tag) VALUES (?, ?, ?)", (name, flow, finish_tag))
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (recipe_url, collection, pid_namespace, submitter, pages, size_class, state, "
+                "start_tag, submitted, submission) VALUES (?, ?, ?, ?, ?, ?, 'queued', ?, ?, ?)",
+                (recipe_url, collection, pid_namespace, submitter, pages, name, start_tag, time.time(),
+                 dumps(submission) if submission else None))
+            return cursor.lastrowid, name
+
+    def next_jobs(self):
+        """
+        Mark the next jobs of every class running, up to the class concurrency, returning them as
+        dictionaries in dispatch order
+        """
+        jobs = []
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.execute(
+                "UPDATE jobs SET state = 'lost', finished = ? "
+                "WHERE state = 'running' AND COALESCE(heartbeat, started) < ?", (now, now - STALE_AFTER))
+            for name, limit, concurrency in SIZE_CLASSES:
+                running = self._connection.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE size_class = ? AND state = 'running'", (name,)).fetchone()[0]
+                if running >= concurrency:
+                    continue
+                rows = self._connection.execute(
+                    "SELECT id, recipe_url, collection, pid_namespace, submitter, pages, submission, resume, start_tag "
+                    "FROM jobs WHERE size_class = ? AND state = 'queued' ORDER BY start_tag, id LIMIT ?",
+                    (name, concurrency - running)).fetchall()
+                for job_id, recipe_url, collection, pid_namespace, submitter, pages, submission, resume, _ in rows:
+                    self._connection.execute(
+                        "UPDATE jobs SET state = 'running', started = ?, heartbeat = NULL WHERE id = ?", (now, job_id))
+                    jobs.append({"id": job_id, "recipe_url": recipe_url, "collection": collection,
+                                 "pid_namespace": pid_namespace, "submitter": submitter, "pages": pages,
+                                 "size_class": name, "queue": queue_for(name),
+                                 "submission": loads(submission) if submission else None, "resume": bool(resume)})
+                if rows:
+                    pages_per_second = self._class(name)[1]
+                    self._connection.execute(
+                        "INSERT OR REPLACE INTO classes (size_class, virtual_time, pages_per_second) VALUES (?, ?, ?)",
+                        (name, rows[-1][-1], pages_per_second))
+        return jobs
+
+    def set_task(self, job_id, task_id):
+        with self._lock, self._connection:
+            self._connection.execute("UPDATE jobs SET task_id = ? WHERE id = ?", (task_id, job_id))
+
+    def heartbeat(self, job_id):
+        """ note that a running job is still alive, returning False when it was already given up as lost """
+        with self._lock, self._connection:
+            return self._connection.execute("UPDATE jobs SET heartbeat = ? WHERE id = ? AND state = 'running'",
+                                            (time.time(), job_id)).rowcount == 1
+
+    def reclaim(self, job_id):
+        """
+        Take the slot of a redelivered job again, returning the job as a dictionary like next_jobs
+        when it may run. A job given up as lost gets a slot only when its class has one free;
+        otherwise it is queued again to resume when dispatched. Returns None for a requeued or
+        finished job.
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute(
+                "SELECT recipe_url, collection, pid_namespace, submitter, pages, submission, size_class, state "
+                "FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row[-1] not in ("running", "lost"):
+                return None
+            recipe_url, collection, pid_namespace, submitter, pages, submission, name, state = row
+            if state == "lost":
+                concurrency = dict((item[0], item[2]) for item in SIZE_CLASSES).get(name, 1)
+                running = self._connection.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE size_class = ? AND state = 'running'", (name,)).fetchone()[0]
+                if running >= concurrency:
+                    self._connection.execute(
+                        "UPDATE jobs SET state = 'queued', resume = 1, finished = NULL WHERE id = ?", (job_id,))
+                    return None
+                self._connection.execute(
+                    "UPDATE jobs SET state = 'running', started = ?, finished = NULL WHERE id = ?", (now, job_id))
+            self._connection.execute("UPDATE jobs SET heartbeat = ? WHERE id = ?", (now, job_id))
+            return {"id": job_id, "recipe_url": recipe_url, "collection": collection,
+                    "pid_namespace": pid_namespace, "submitter": submitter, "pages": pages,
+                    "size_class": name, "queue": queue_for(name),
+                    "submission": loads(submission) if submission else None, "resume": True}
+
+    def finish(self, job_id, ok, seconds):
+        """ mark a job done or failed and fold its page rate into the rate of its class """
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT size_class, pages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return
+            name, pages = row
+            self._connection.execute("UPDATE jobs SET state = ?, finished = ? WHERE id = ?",
+                                     ("done" if ok else "failed", time.time(), job_id))
+            if ok and seconds > 0 and pages:
+                virtual_time, rate = self._class(name)
+                sample = pages / float(seconds)
+                rate = sample if rate is None else rate + RATE_SMOOTHING * (sample - rate)
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO classes (size_class, virtual_time, pages_per_second) VALUES (?, ?, ?)",
+                    (name, virtual_time, rate))
+
+    def stats(self):
+        """
+        return per class queue depth, pages waiting, running ingests, measured page rate and the
+        estimated seconds to drain the class, with queued ingests per flow
+        """
+        result = {}
+        now = time.time()
+        with self._lock:
+            for name, limit, concurrency in SIZE_CLASSES:
+                queued, queued_pages = self._connection.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(pages), 0) FROM jobs WHERE size_class = ? AND state = 'queued'",
+                    (name,)).fetchone()
+                running = self._connection.execute(
+                    "SELECT pages, started FROM jobs WHERE size_class = ? AND state = 'running'", (name,)).fetchall()
+                rate = self._class(name)[1]
+                drain = None
+                if rate:
+                    remaining = sum(max(0.0, pages - rate * (now - started)) for pages, started in running)
+                    drain = round((queued_pages + remaining) / (rate * concurrency), 1)
+                flows = dict(self._connection.execute(
+                    "SELECT collection || ' ' || COALESCE(submitter, ''), COUNT(*) FROM jobs "
+                    "WHERE size_class = ? AND state = 'queued' GROUP BY collection, submitter", (name,)).fetchall())
+                result[name] = {"queue": queue_for(name), "concurrency": concurrency, "queued": queued,
+                                "queued_pages": queued_pages, "running": len(running),
+                                "pages_per_second": None if rate is None else round(rate, 3),
+                                "estimated_drain_seconds": drain, "queued_by_flow": flows}
+        return result
+
+    def prune(self, older_than):
+        """ delete finished jobs older than older_than seconds """
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM jobs WHERE state IN ('done', 'failed', 'lost') AND finished < ?",
+                                     (time.time() - older_than,))
+
+
+def publish(stats):
+    """ set the backlog gauges from the result of Backlog.stats """
+    for name, item in stats.items():
+        queued_books.set(item["queued"], size_class=name)
+        if item["estimated_drain_seconds"] is not None:
+            drain_seconds.set(item["estimated_drain_seconds"], size_class=name)
+
+
+_backlog = None
+
+
+def get_backlog():
+    global _backlog
+    if _backlog is None:
+        _backlog = Backlog()
+    return _backlog
@@ -0,0 +1,128 @@
+"""
+Registry of running ingest submissions keyed by bag and paramstring.
+
+ingest_and_verify claims the key of a recipe before starting its chain and the chain releases it
+when done. A claim is a lease: if the chain dies without releasing it, the key is free again
+after LEASE seconds. A duplicate submission made while the claim is held gets the holder's record,
+with the id of the running chain, instead of starting a second ingest. The claim and its release
+run in different worker processes, so the registry lives in MongoDB.
+"""
+import datetime
+import threading
+import time
+from os import getpid
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+MONGO_URI = getattr(celeryconfig, "ISLANDORA_SUBMISSION_MONGO_URI", None)
+# claims must be shared by every worker process, so de-duplication needs the MongoDB registry
+ENABLED = getattr(celeryconfig, "ISLANDORA_SUBMISSION_DEDUPLICATION", bool(MONGO_URI))
+LEASE = getattr(celeryconfig, "ISLANDORA_SUBMISSION_LEASE", 6 * 3600)  # seconds
+MONGO_DATABASE = getattr(celeryconfig, "ISLANDORA_SUBMISSION_MONGO_DATABASE", "islandoraq")
+MONGO_COLLECTION = getattr(celeryconfig, "ISLANDORA_SUBMISSION_MONGO_COLLECTION", "ingest_submissions")
+
+
+def submission_key(recipe_url):
+    """ bag/paramstring of a recipe URL, e.g. https://bag.ou.edu/derivative/[bag]/[paramstring]/[bag].json """
+    parts = recipe_url.split("/")
+    return "{0}/{1}".format(parts[4], parts[5])
+
+
+class MemoryRegistry(object):
+    """
+    Registry held in memory, a stand-in for MongoRegistry in tests. Registries made with the same
+    claims dictionary share their claims like worker processes sharing a MongoDB collection.
+    """
+    _lock = threading.Lock()
+
+    def __init__(self, claims=None):
+        self._claims = {} if claims is None else claims
+
+    def claim(self, key, owner, lease=LEASE):
+        """ claim key for owner returning (True, record), or (False, record of the current holder) """
+        now = time.time()
+        with self._lock:
+            record = self._claims.get(key)
+            if record is not None and record["expires"] > now:
+                return False, dict(record)
+            record = {"_id": key, "owner": owner, "task_id": None, "claimed": now, "expires": now + lease}
+            self._claims[key] = record
+            return True, dict(record)
+
+    def attach(self, key, owner, task_id):
+        """ record the id of the chain started by the owner of key """
+        with self._lock:
+            record = self._claims.get(key)
+            if record is not None and record["owner"] == owner:
+                record["task_id"] = task_id
+
+    def release(self, key, owner):
+        """ free key if owner still holds it, returning True when released """
+        with self._lock:
+            record = self._claims.get(key)
+            if record is not None and record["owner"] == owner:
+                del self._claims[key]
+                return True
+            return False
+
+    def get(self, key):
+        with self._lock:
+            record = self._claims.get(key)
+            return dict(record) if record is not None and record["expires"] > time.time() else None
+
+
+class MongoRegistry(object):
+    """ Registry stored in a MongoDB collection shared by all workers; claims rely on the unique _id """
+
+    def __init__(self, uri=MONGO_URI, database=MONGO_DATABASE, collection=MONGO_COLLECTION):
+        from pymongo import MongoClient
+        self.collection = MongoClient(uri)[database][collection]
+        # expired claims are removed by the server some time after they lapse; claim treats them as free
+        self.collection.create_index("expires", expireAfterSeconds=0)
+
+    def claim(self, key, owner, lease=LEASE):
+        """ claim key for owner returning (True, record), or (False, record of the current holder) """
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+        now = datetime.datetime.utcnow()
+        try:
+            record = self.collection.find_one_and_update(
+                {"_id": key, "expires": {"$lte": now}},
+                {"$set": {"owner": owner, "task_id": None, "claimed": now,
+                          "expires": now + datetime.timedelta(seconds=lease)}},
+                upsert=True, return_document=ReturnDocument.AFTER)
+            return True, record
+        except DuplicateKeyError:  # a live claim matched _id but not the expiry filter
+            record = self.collection.find_one({"_id": key})
+            if record is None:  # released in between
+                return self.claim(key, owner, lease)
+            return False, record
+
+    def attach(self, key, owner, task_id):
+        """ record the id of the chain started by the owner of key """
+        self.collection.update_one({"_id": key, "owner": owner}, {"$set": {"task_id": task_id}})
+
+    def release(self, key, owner):
+        """ free key if owner still holds it, returning True when released """
+        return self.collection.delete_one({"_id": key, "owner": owner}).deleted_count == 1
+
+    def get(self, key):
+        return self.collection.find_one({"_id": key, "expires": {"$gt": datetime.datetime.utcnow()}})
+
+
+_registry = None
+_pid = None
+
+
+def get_registry():
+    """ return this process's MongoDB registry; raises when ISLANDORA_SUBMISSION_MONGO_URI is not set """
+    global _registry, _pid
+    if _registry is None or _pid != getpid():
+        if not MONGO_URI:
+            raise Exception("Submission de-duplication needs ISLANDORA_SUBMISSION_MONGO_URI")
+        _registry = MongoRegistry()
+        _pid = getpid()
+    return _registry
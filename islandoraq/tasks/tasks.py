@@ -1,16 +1,34 @@
-from celery import Celery
-from os import chown
-from os import chmod
+from celery import Celery, Task
+from celery.signals import worker_process_init, worker_process_shutdown
 from os import environ, pathsep
 from os.path import join
 from subprocess import check_call, check_output, CalledProcessError, STDOUT
-from shutil import rmtree
-from tempfile import mkdtemp
+from shutil import copyfile
+from multiprocessing.pool import ThreadPool
+from threading import Event, Lock, Thread
 from json import loads, dumps
-import datetime
+from functools import partial
+from collections import OrderedDict
+from time import sleep, time
 import logging
-import grp
+import uuid
 import requests
+from . import catalog
+from . import drushworker
+from .drushoutput import stream_output, tail
+from . import health
+from . import httpclient
+from . import ledger
+from . import metrics
+from . import preflight
+from . import prefetch as page_prefetch
+from . import recipecache
+from . import reconcile
+from . import recipestream
+from . import results
+from . import scheduler
+from . import submissions
+from . import workspace
 from requests.exceptions import ConnectionError
 
 logging.basicConfig(level=logging.INFO)
@@ -20,33 +38,84 @@ try:
 except:
     from urllib.parse import urlparse
 
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+try:
+    from shlex import quote
+except ImportError:  # Python 2
+    from pipes import quote
+
+try:
+    from . import aio
+except (ImportError, SyntaxError):  # the asyncio engine needs Python 3
+    aio = None
+
 try:
     import celeryconfig
 except ImportError:
     logging.error('Failed to import celeryconfig!')
     celeryconfig = None
 
-try:
-    from celeryconfig import ISLANDORA_DRUPAL_ROOT, ISLANDORA_FQDN, PATH, CYBERCOMMONS_TOKEN
-except ImportError:
+_environment = ("ISLANDORA_DRUPAL_ROOT", "ISLANDORA_FQDN", "PATH", "CYBERCOMMONS_TOKEN")
+if not all(hasattr(celeryconfig, name) for name in _environment):
     logging.error("Failed to import environment variables from celeryconfig!")
-    ISLANDORA_DRUPAL_ROOT = ""
-    ISLANDORA_FQDN = ""
-    PATH = ""
-    CYBERCOMMONS_TOKEN = ""
+ISLANDORA_DRUPAL_ROOT = getattr(celeryconfig, "ISLANDORA_DRUPAL_ROOT", "")
+ISLANDORA_FQDN = getattr(celeryconfig, "ISLANDORA_FQDN", "")
+PATH = getattr(celeryconfig, "PATH", "")
+CYBERCOMMONS_TOKEN = getattr(celeryconfig, "CYBERCOMMONS_TOKEN", "")
 
 app = Celery()
 app.config_from_object(celeryconfig)
 
-ingest_template = "drush -u 1 oubib --recipe_uri={0} --parent_collection={1} --pid_namespace={2} --tmp_dir={3} --root={4}"
-crud_template = "drush -u 1 iim --pid={0}:{1} --operation={2} --root={3}"
+ingest_template = "{drush} -u 1 oubib --recipe_uri={0} --parent_collection={1} --pid_namespace={2} --tmp_dir={3} --root={4}"
+crud_template = "{drush} -u 1 iim --pid={0}:{1} --operation={2} --root={3}"
+
+INGEST_CONCURRENCY = getattr(celeryconfig, "ISLANDORA_INGEST_CONCURRENCY", 1)
+INGEST_PREFETCH = getattr(celeryconfig, "ISLANDORA_INGEST_PREFETCH", 2)
+INGEST_RESUME = getattr(celeryconfig, "ISLANDORA_INGEST_RESUME", False)
+ITEM_CONCURRENCY = getattr(celeryconfig, "ISLANDORA_ITEM_CONCURRENCY", 4)
+VERIFY_TIMEOUT = getattr(celeryconfig, "ISLANDORA_VERIFY_TIMEOUT", 600)
+VERIFY_INITIAL_DELAY = getattr(celeryconfig, "ISLANDORA_VERIFY_INITIAL_DELAY", 2)
+VERIFY_MAX_DELAY = getattr(celeryconfig, "ISLANDORA_VERIFY_MAX_DELAY", 60)
 
 base_url = "https://cc.lib.ou.edu"
 api_url = "{0}/api".format(base_url)
 catalog_url = "{0}/catalog/data/catalog/digital_objects/.json".format(api_url)
 search_url = "{0}?query={{\"filter\": {{\"bag\": \"{1}\"}}}}"
 
-environ["PATH"] = PATH + pathsep + environ["PATH"]
+solr_url = "http://localhost:8080/solr"
+solr_select_url = "{0}/select".format(solr_url)
+solr_chunk_size = 100
+
+if PATH and PATH not in environ.get("PATH", "").split(pathsep):
+    environ["PATH"] = PATH + pathsep + environ.get("PATH", "")
+
+
+def _drush():
+    """ Internal function returning the drush path resolved by the preflight, quoted for the shell """
+    return quote(preflight.drush_path())
+
+
+class DependencyTask(Task):
+    """
+    Task deferred with a Celery retry, instead of failing, while the circuit breaker of a
+    dependency it needs is open. Called directly the task fails fast with DependencyUnavailable.
+    """
+    abstract = True
+
+    def __call__(self, *args, **kwargs):
+        try:
+            return super(DependencyTask, self).__call__(*args, **kwargs)
+        except health.DependencyUnavailable as err:
+            if self.request.called_directly:
+                raise
+            logging.warning("Deferring {0}: {1}".format(self.name, err))
+            # polling rounds rescheduled by await_ingest are retries too and do not count as deferrals
+            polled = (self.request.kwargs or {}).get("rounds", 0)
+            raise self.retry(exc=err, countdown=err.retry_after, max_retries=health.DEFER_MAX_RETRIES + polled)
 
 
 def is_uri(item):
@@ -70,15 +139,25 @@ def is_recipe(item):
         return False
 
 
-def searchcatalog(bag):
-    resp = requests.get(search_url.format(catalog_url, bag))
+def searchcatalog(bag, use_cache=True):
+    """ catalog item of a bag or {} when it has none; use_cache=False reads the catalog and refreshes the cache """
+    catalogitem = catalog.cached_item(bag) if use_cache else None
+    if catalogitem is not None:
+        return catalogitem
+    resp = httpclient.get(search_url.format(catalog_url, bag))
     catalogitems = loads(resp.text)
-    if catalogitems['count']:
-        return catalogitems['results'][0]
-    return {}
+    catalogitem = catalogitems['results'][0] if catalogitems['count'] else {}
+    catalog.cache_item(bag, catalogitem)
+    return catalogitem
 
 
-@app.task(bind=True)
+@app.task()
+def catalog_cache_stats():
+    """ Return hit, miss, expiration and eviction counters of this worker's catalog lookup cache """
+    return catalog.lookup_cache.stats()
+
+
+@app.task(bind=True, base=DependencyTask)
 def updatecatalog(self, bag, paramstring, collection, ingested=True):
     """
     Update Bag in Data Catalog with repository ingest status
@@ -102,29 +181,152 @@ def updatecatalog(self, bag, paramstring, collection, ingested=True):
       }
     }
     """
-    catalogitem = searchcatalog(bag)
+    catalogitem = searchcatalog(bag, use_cache=False)  # never write back a cached copy
     if not catalogitem.get("bag"):
         return False  # this bag does not have a catalog entry
-    if "application" not in catalogitem:
-        catalogitem["application"] = {}
-    if "islandora" not in catalogitem["application"]:
-        catalogitem["application"]["islandora"] = {}
-    catalogitem["application"]["islandora"]["derivative"] = paramstring
-    catalogitem["application"]["islandora"]["collection"] = collection
-    catalogitem["application"]["islandora"]["ingested"] = ingested
-    catalogitem["application"]["islandora"]["datetime"] = datetime.datetime.utcnow().isoformat()
-    
-    headers = {"Content-Type": "application/json", "Authorization": "Token {0}".format(CYBERCOMMONS_TOKEN)}
+    catalog.apply_update(catalogitem, catalog.make_update(bag, paramstring, collection, ingested))
     try:
-        req = requests.post(catalog_url, data=dumps(catalogitem), headers=headers)
-        req.raise_for_status()
+        _write_catalog_item(catalogitem)
+    except health.DependencyUnavailable:
+        catalog.lookup_cache.pop(bag)
+        raise
     except Exception as e:  # TODO: use specific exceptions to catch
+        catalog.lookup_cache.pop(bag)
         self.retry(countdown=60, max_retries=4)
+    catalog.cache_item(bag, catalogitem)
     return True
 
 
+def _write_catalog_item(catalogitem):
+    """ Internal function to save a catalog item, raising on HTTP errors """
+    headers = {"Content-Type": "application/json", "Authorization": "Token {0}".format(CYBERCOMMONS_TOKEN)}
+    req = httpclient.post(catalog_url, data=dumps(catalogitem), headers=headers)
+    req.raise_for_status()
+
+
+@app.task(bind=True, base=DependencyTask)
+def bulk_updatecatalog(self, updates, attempt=0):
+    """
+    Update many Bags in the Data Catalog with repository ingest status
+
+    Bags are looked up with a single $in query per chunk and written back with bounded
+    concurrency. Each bag is retried on its own; bags still failing are rescheduled in a
+    follow up task holding only those bags.
+
+    args:
+      updates (list); update dictionaries with bag, paramstring, collection and ingested keys
+                      or [bag, paramstring, collection, ingested] lists. Repeated bags are merged
+      attempt (int); number of earlier attempts for these updates, used when rescheduling
+    returns counts of requested and updated bags with bags not in the catalog and failures keyed by bag
+    """
+    updates = catalog.normalize_updates(updates)
+    summary = {"requested": len(updates), "updated": 0, "not_found": [], "failed": {}, "rescheduled": 0}
+    try:
+        found = catalog.search_bags(httpclient.get, catalog_url, [update["bag"] for update in updates])
+    except health.DependencyUnavailable:
+        raise
+    except Exception:  # TODO: use specific exceptions to catch
+        self.retry(countdown=60, max_retries=4)
+    for update in updates:
+        catalog.cache_item(update["bag"], found.get(update["bag"], {}))
+
+    def write(update):
+        catalogitem = catalog.apply_update(found[update["bag"]], update)
+        for retry in range(catalog.WRITE_RETRIES):
+            try:
+                _write_catalog_item(catalogitem)
+                catalog.cache_item(update["bag"], catalogitem)
+                return update, None
+            except health.DependencyUnavailable as err:
+                error = err
+                break
+            except Exception as err:
+                logging.warning("Catalog write of {0} failed: {1}".format(update["bag"], err))
+                error = err
+                sleep(2 ** retry)
+        catalog.lookup_cache.pop(update["bag"])
+        return update, str(error)
+
+    pending = [update for update in updates if update["bag"] in found]
+    summary["not_found"] = [update["bag"] for update in updates if update["bag"] not in found]
+    failed = []
+    for update, error in _map_concurrent(write, pending, catalog.WRITE_CONCURRENCY):
+        if error is None:
+            summary["updated"] += 1
+        else:
+            summary["failed"][update["bag"]] = error
+            failed.append(update)
+    if failed and attempt < 4:
+        bulk_updatecatalog.apply_async(args=[failed], kwargs={"attempt": attempt + 1}, countdown=60)
+        summary["rescheduled"] = len(failed)
+    return summary
+
+
+@app.task()
+def queue_catalog_update(bag, paramstring, collection, ingested=True):
+    """
+    Buffer a Data Catalog update in this worker, merging repeated updates to the same bag.
+    The buffer is written with bulk_updatecatalog once it holds ISLANDORA_CATALOG_WRITE_BEHIND_SIZE
+    bags or, by a timer in the worker process, once its oldest update is
+    ISLANDORA_CATALOG_WRITE_BEHIND_AGE seconds old.
+
+    This task returns before the update is written, so the ingest chain reports done while the
+    update is still buffered. Updates buffered in a worker process that is killed (SIGKILL, out of
+    memory) are lost; at most ISLANDORA_CATALOG_WRITE_BEHIND_AGE seconds of updates are at risk.
+
+    args: see updatecatalog
+    returns the bulk_updatecatalog summary when the buffer was flushed, otherwise None
+    """
+    catalog.write_buffer.add(catalog.make_update(bag, paramstring, collection, ingested))
+    if catalog.write_buffer.due():
+        try:
+            return _flush_catalog()
+        except Exception as err:
+            logging.error("Unable to flush buffered catalog updates, keeping them buffered: {0}".format(err))
+
+
+@app.task(base=DependencyTask)
+def flush_catalog_updates():
+    """ Write all buffered Data Catalog updates of this worker """
+    return _flush_catalog()
+
+
+def _flush_catalog():
+    """ Internal function writing the buffer; on failure the updates go back in the buffer and the error is raised """
+    updates = catalog.write_buffer.drain()
+    if not updates:
+        return None
+    try:
+        return bulk_updatecatalog(updates)
+    except Exception:
+        catalog.write_buffer.restore(updates)
+        raise
+
+
+def _flush_catalog_when_due():
+    """ write-behind timer callback; updates that cannot be written are retried after another interval """
+    try:
+        _flush_catalog()
+    except Exception as err:
+        logging.error("Unable to flush buffered catalog updates, retrying in {0} seconds: {1}".format(
+            catalog.write_buffer.max_age, err))
+
+
+catalog.write_buffer.on_due = _flush_catalog_when_due
+
+
+@worker_process_shutdown.connect
+def _flush_catalog_on_shutdown(**kwargs):
+    try:
+        _flush_catalog()
+    except Exception as err:
+        logging.error("Unable to flush buffered catalog updates, {0} lost at shutdown: {1}".format(
+            len(catalog.write_buffer), err))
+
+
 @app.task()
-def ingest_recipe(recipes, collection='oku:hos', pid_namespace=None):
+def ingest_recipe(recipes, collection='oku:hos', pid_namespace=None, concurrency=None, prefetch=None,
+                  stage_pages=None, resume=None, result_format=None):
     """
     Ingest recipe json into Islandora repository.
     
@@ -134,7 +336,17 @@ def ingest_recipe(recipes, collection='oku:hos', pid_namespace=None):
       recipes: List of URLs pointing to JSON recipe objects or list of JSON recipe objects
       collection: Name of Islandora collection to ingest to. Default is: oku:hos 
       pid_namespace: Namespace to ingest recipe. Default is first half of collection name
+      concurrency: Number of drush ingests to run at once. Default is ISLANDORA_INGEST_CONCURRENCY or 1
+      prefetch: Number of upcoming recipes to fetch and stage while drush runs. Default is ISLANDORA_INGEST_PREFETCH or 2
+      stage_pages: Download page images into the working directory before drush runs. Default is ISLANDORA_PAGE_PREFETCH
+      resume: Skip books already ingested and ingest only the missing pages of partial books. Default is ISLANDORA_INGEST_RESUME
+      result_format: compact or verbose. Default is ISLANDORA_RESULT_FORMAT or compact
+
+    The compact result holds counts, recipe ids (URL or book uuid), failure codes, drush durations
+    and a reference to the full detail kept in the result side store, see result_detail.
+    The verbose result is {"Successful": [recipes], "Failures": [[recipe, reason]]}
     """
+    result_format = results.check_format(result_format)
     logging.debug("ingest recipe args: {0}, {1}, {2}".format(recipes, collection, pid_namespace))
     logging.debug("Environment: {0}".format(environ))
     
@@ -150,55 +362,273 @@ def ingest_recipe(recipes, collection='oku:hos', pid_namespace=None):
     logging.debug("Drupal root path: {0}".format(ISLANDORA_DRUPAL_ROOT))
 
     recipes = [recipes] if not isinstance(recipes, list) else recipes
-    
-    fail = [] 
+    concurrency = concurrency or INGEST_CONCURRENCY
+    prefetch = INGEST_PREFETCH if prefetch is None else prefetch
+    stage_pages = page_prefetch.PAGE_PREFETCH if stage_pages is None else stage_pages
+    resume = INGEST_RESUME if resume is None else resume
+
+    def stage(recipe):
+        return _stage_recipe(recipe, stage_pages, pid_namespace if resume else None)
+
+    def failed(recipe, err):
+        return False, [recipe, err]
+
+    durations = {}
+    task_id = None if ingest_recipe.request.called_directly else ingest_recipe.request.id
+    book_progress = {}
+    progress_lock = Lock()
+
+    def report(key, done, total):
+        """ publish pages done and total of the books ingesting and ingested so far """
+        with progress_lock:
+            book_progress[key] = (min(done, total), total)
+            meta = {"books": len(recipes), "books_done": len(durations),
+                    "pages_done": sum(done for done, total in book_progress.values()),
+                    "pages_total": sum(total for done, total in book_progress.values()),
+                    "seconds": round(time() - start, 3)}
+        ingest_recipe.update_state(task_id=task_id, state="INGESTING", meta=meta)
+
+    def ingest(staged):
+        start = time()
+        ok, result = _ingest_staged(staged, collection, pid_namespace, report if task_id else None)
+        if staged[0]:
+            durations[_recipe_id(result if ok else result[0])] = round(time() - start, 3)
+        return ok, result
+
+    start = time()
+    fail = []
     success = []
-    for recipe in recipes:
-        logging.debug("ingesting: {0}".format(recipe))
-        if is_uri(recipe):
-            recipe_uri = recipe
-            testresp = requests.get(recipe_uri, allow_redirects=True)
-            if testresp.status_code != requests.codes.ok:
-                logging.error("Issue getting recipe at: {0}".format(recipe_uri))
-                fail.append([recipe_uri, "Server status {0}".format(testresp.status_code)])
-                continue
-            if not is_recipe(testresp.json()):
-                logging.error("Invalid recipe at: {0}".format(recipe_uri))
-                fail.append([recipe_uri, "Invalid recipe: {0}".format(recipe_uri)])
-                continue
-            recipe = testresp.json()
-        tmpdir = mkdtemp(prefix="recipeloader_")
-        logging.debug("created working dir: {0}".format(tmpdir))
-        chmod(tmpdir, 0o775)
-        chown(tmpdir, -1, grp.getgrnam("apache").gr_gid)
+    for ok, result in _pipeline(stage, ingest, recipes, concurrency, prefetch, failed):
+        if ok:
+            success.append(result)
+        else:
+            fail.append(result)
+    if result_format == "verbose":
+        return ({"Successful": success, "Failures": fail})
+    detail = results.save_detail("ingest_recipe", {"collection": collection, "pid_namespace": pid_namespace,
+                                                   "Successful": success, "Failures": fail})
+    return {"succeeded": len(success), "failed": len(fail),
+            "successful": [_recipe_id(recipe) for recipe in success],
+            "failures": [[_recipe_id(recipe), results.error_code(reason)] for recipe, reason in fail],
+            "durations": durations, "seconds": round(time() - start, 3), "detail": detail}
+
+
+def _recipe_id(recipe):
+    """ Internal function returning a short id for a recipe: its URL or book uuid """
+    if is_uri(recipe):
+        return recipe
+    try:
+        if isinstance(recipe, (str, bytes)):
+            recipe = loads(recipe)
+        return recipe["recipe"]["uuid"]
+    except Exception:
+        return str(recipe)[:100]
+
+
+@app.task()
+def result_detail(reference):
+    """
+    Return the full detail kept in the result side store for a compact task result
+
+    args:
+      reference: the "detail" value of a compact result
+    returns the stored document or None when it is unknown or has expired
+    """
+    return results.load_detail(reference)
+
+
+def _map_concurrent(func, items, concurrency):
+    """ Internal function applying func to items with at most concurrency threads, preserving order """
+    if concurrency <= 1 or len(items) <= 1:
+        return [func(item) for item in items]
+    pool = ThreadPool(min(concurrency, len(items)))
+    try:
+        return pool.map(func, items, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _pipeline(stage, process, items, workers, depth, failed):
+    """
+    Internal function running stage over items in a fetcher thread while up to workers threads
+    run process on already staged items. At most depth staged items wait in between.
+    When stage or process raises, failed(item, exception) gives the result of the item instead.
+    Returns the results of process in item order.
+    """
+    def stage_item(item):
         try:
-            if not is_uri(recipe):
-                if not is_recipe(recipe):
-                    raise Exception("Not a valid recipe object")
-                recipe_uri = join(tmpdir, "cc_recipe.json")
-                with open(recipe_uri, "w") as f:
-                    f.write(dumps(recipe))
-            drush_response = None
-            drush_response = check_output(
-                ingest_template.format(recipe_uri.strip(), collection, pid_namespace, tmpdir, ISLANDORA_DRUPAL_ROOT),
-                stderr=STDOUT,  # include stderr in output
-                shell=True
-            )
-            logging.debug(drush_response)
-            success.append(recipe)
-        except CalledProcessError as err:
-            fail.append([recipe, "Drush status {0}".format(err.returncode)])
-            logging.error(drush_response)
-            logging.error(err)
-            logging.error(environ)
+            return stage(item)
         except Exception as err:
-            fail.append([recipe, err])
-            logging.error(err)
-            logging.error(recipe)
+            logging.error("Unable to stage {0}: {1}".format(item, err))
+            return failed(item, err)
+
+    def process_item(item, value):
+        try:
+            return process(value)
+        except Exception as err:
+            logging.error("Unable to process {0}: {1}".format(item, err))
+            return failed(item, err)
+
+    if depth < 1 or len(items) <= 1:
+        return _map_concurrent(lambda item: process_item(item, stage_item(item)), items, workers)
+    workers = max(1, min(workers, len(items)))
+    staged = Queue(maxsize=depth)
+    results = [None] * len(items)
+
+    def fetcher():
+        try:
+            for index, item in enumerate(items):
+                staged.put((index, stage_item(item)))
         finally:
-            rmtree(tmpdir)
-            logging.debug("removed working dir")
-    return ({"Successful": success, "Failures": fail})
+            for _ in range(workers):
+                staged.put(None)
+
+    def worker():
+        while True:
+            entry = staged.get()
+            if entry is None:
+                return
+            index, value = entry
+            results[index] = process_item(items[index], value)
+
+    threads = [Thread(target=fetcher)] + [Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _stage_recipe(recipe, stage_pages=False, resume_namespace=None):
+    """
+    Internal function to fetch and validate a recipe and write it into a new working directory.
+    Recipes fetched from a URL are copied or rewritten from the recipe cache as a stream.
+    With stage_pages the page images are downloaded alongside and the written recipe points at them.
+    With resume_namespace books already ingested are skipped, and books with missing pages are
+    staged as an update recipe holding only those pages.
+
+    returns a tuple of (True, (recipe, recipe_uri, tmpdir, pages)) or (False, [recipe, reason]) on failure.
+    recipe_uri and tmpdir are None when nothing needs ingesting; pages is the number of pages staged.
+    """
+    logging.debug("staging: {0}".format(recipe))
+    entry = None
+    if is_uri(recipe):
+        try:
+            entry = recipecache.fetch(recipe)
+        except recipecache.RecipeError as err:
+            logging.error("Issue getting recipe at: {0}".format(recipe))
+            return False, [recipe, "Server status {0}".format(err.status)]
+        except requests.RequestException as err:
+            logging.error("Issue getting recipe at: {0}".format(recipe))
+            return False, [recipe, "Request error {0}".format(err)]
+        if not entry["is_recipe"]:
+            logging.error("Invalid recipe at: {0}".format(recipe))
+            return False, [recipe, "Invalid recipe: {0}".format(recipe)]
+    tmpdir = None
+    try:
+        if entry is None:
+            if not is_recipe(recipe):
+                raise Exception("Not a valid recipe object")
+            if isinstance(recipe, (str, bytes)):
+                recipe = loads(recipe)
+            book_uuid = recipe["recipe"].get("uuid")
+            page_uuids = [page.get("uuid") for page in recipe["recipe"].get("pages") or []]
+        else:
+            book_uuid, page_uuids = entry["book_uuid"], entry["page_uuids"]
+
+        missing_pages = None
+        if resume_namespace and book_uuid:
+            book_missing, missing_pages = ledger.missing(resume_namespace, book_uuid, page_uuids, objects_exist)
+            if not book_missing and not missing_pages:
+                logging.info("Skipping {0}:{1}, book and pages already ingested".format(resume_namespace, book_uuid))
+                return True, (recipe, None, None, 0)
+            if book_missing:
+                missing_pages = None
+            else:
+                logging.info("Resuming {0}:{1} with {2} of {3} pages missing".format(
+                    resume_namespace, book_uuid, len(missing_pages), len(page_uuids)))
+
+        staged_pages = len(page_uuids) if missing_pages is None else len(missing_pages)
+        tmpdir = workspace.acquire(workspace.estimate(entry, recipe if entry is None else None, staged_pages))
+        recipe_uri = join(tmpdir, "cc_recipe.json")
+
+        def pages(page_stream):
+            if missing_pages is not None:
+                page_stream = (page for page in page_stream if page.get("uuid") in missing_pages)
+            if stage_pages:
+                page_stream = page_prefetch.stage_page_stream(page_stream, tmpdir, recipe if entry else None)
+            return page_stream
+
+        if entry is not None and not stage_pages and missing_pages is None:
+            copyfile(recipecache.path(entry), recipe_uri)
+        else:
+            fields = recipecache.iter_recipe(entry) if entry is not None else recipe["recipe"].items()
+            if missing_pages is not None:
+                fields = _update_fields(fields)
+            with open(recipe_uri, "w") as f:
+                recipestream.write_recipe(f, fields, pages)
+    except Exception as err:
+        logging.error(err)
+        logging.error(recipe)
+        if tmpdir:
+            workspace.release(tmpdir)
+        return False, [recipe, err]
+    return True, (recipe, recipe_uri, tmpdir, staged_pages)
+
+
+def _update_fields(fields):
+    """ Internal function marking recipe fields as an update of an existing book, so drush adds the pages to it """
+    for key, value in fields:
+        if key != "update":
+            yield key, value
+    yield "update", "true"
+
+
+def _ingest_staged(staged, collection, pid_namespace, progress=None):
+    """
+    Internal function to run the drush ingest of a recipe staged by _stage_recipe
+
+    progress is called with (recipe_uri, pages done, pages total) as drush reports its batch progress
+
+    returns a tuple of (True, recipe) on success or (False, [recipe, reason]) on failure
+    """
+    ok, value = staged
+    if not ok:
+        return staged
+    recipe, recipe_uri, tmpdir, pages = value
+    if tmpdir is None:
+        return True, recipe
+    drush_response = None
+    on_progress = partial(progress, recipe_uri) if progress else None
+    try:
+        start = time()
+        with metrics.timed("drush", "ingest"):
+            drush_response = stream_output(
+                ingest_template.format(recipe_uri.strip(), collection, pid_namespace, tmpdir, ISLANDORA_DRUPAL_ROOT,
+                                       drush=_drush()),
+                stderr=STDOUT,  # include stderr in output
+                shell=True,
+                progress=on_progress,
+                total=pages
+            )
+        metrics.record_ingest(pages, time() - start)
+        if on_progress:
+            on_progress(pages, pages)
+        logging.debug(drush_response)
+        return True, recipe
+    except CalledProcessError as err:
+        logging.error(err.output)
+        logging.error(err)
+        logging.error(environ)
+        return False, [recipe, "Drush status {0}".format(err.returncode)]
+    except Exception as err:
+        logging.error(err)
+        logging.error(recipe)
+        return False, [recipe, err]
+    finally:
+        workspace.release(tmpdir)
+        logging.debug("released working dir")
 
 
 @app.task()
@@ -207,14 +637,75 @@ def verify_solr_up():
     Check that the solr application is running returning True or False
     """
     try:
-        return requests.get("http://localhost:8080/solr").ok
+        return _probe_solr()
     except ConnectionError as err:
         logging.error("Error verifying solr is running")
         logging.error(err)
         return False
 
 
+def _probe_solr():
+    """ Internal health probe of solr, sent even while its circuit breaker is open """
+    return httpclient.probe(solr_url).ok
+
+
+def _probe_catalog():
+    """ Internal health probe of the data catalog, sent even while its circuit breaker is open """
+    return httpclient.probe(catalog_url, params={"page_size": 1}).ok
+
+
+health.register_probe("solr", _probe_solr)
+health.register_probe("catalog", _probe_catalog)
+
+
+def _preflight_probe(name, probe):
+    """ Internal preflight check probing a dependency through its breaker so the probe result is cached """
+    return health.healthy(name) if name in health.breakers else probe()
+
+
+preflight.register("drush", preflight.find_drush)
+preflight.register("workspace_group", workspace.group_id)
+preflight.register("solr", partial(_preflight_probe, "solr", _probe_solr))
+preflight.register("catalog", partial(_preflight_probe, "catalog", _probe_catalog))
+
+
+@app.task()
+def preflight_status(wait=None):
+    """
+    Return the preflight checks run when this worker process started: the drush path, the
+    workspace group id and whether solr and the catalog answered
+
+    args:
+      wait: seconds to wait for a preflight still running
+    """
+    return preflight.status(wait)
+
+
+@worker_process_init.connect
+def _preflight_on_start(**kwargs):
+    # connected after the reset receivers of the modules imported above, which would otherwise
+    # drop the sessions and probe results the preflight warms up
+    if preflight.ENABLED:
+        preflight.start()
+
+
 @app.task()
+def dependency_health(probe=False):
+    """
+    Return the circuit breaker state of each guarded dependency in this worker
+
+    args:
+      probe: also run the cached health probe of every dependency
+    returns dictionary of dependency to state (closed, open or half_open), consecutive failures,
+    number of times opened, time opened and the cached probe result
+    """
+    if probe:
+        for name in health.breakers:
+            health.healthy(name)
+    return health.status()
+
+
+@app.task(base=DependencyTask)
 def object_exists(uuid, namespace, method="solr"):
     """
     Uses local drush script to check that object exists
@@ -224,16 +715,53 @@ def object_exists(uuid, namespace, method="solr"):
       method: indicate which system to use to check existance: solr (default) or drush
     """
     if method == "drush":
-        return check_output(crud_template.format(namespace, uuid, 'read', ISLANDORA_DRUPAL_ROOT), shell=True) != ""
+        if drushworker.ENABLED:
+            try:
+                return drushworker.run(ISLANDORA_DRUPAL_ROOT, 'read', "{0}:{1}".format(namespace, uuid)).strip() != b""
+            except drushworker.DrushOperationError as err:
+                logging.info("Drush helper could not read {0}:{1}: {2}".format(namespace, uuid, err.error))
+                return False
+            except drushworker.DrushWorkerError as err:
+                logging.warning("Drush helper unavailable, using one-shot drush: {0}".format(err))
+        with metrics.timed("drush", "read"):
+            return check_output(crud_template.format(namespace, uuid, 'read', ISLANDORA_DRUPAL_ROOT, drush=_drush()),
+                                shell=True).strip() != b""
     elif method == "solr":
-        resp = requests.get('http://localhost:8080/solr/select?q=PID:"{0}:{1}"&fl=numFound&wt=json'.format(namespace, uuid))
+        resp = httpclient.get('{0}?q=PID:"{1}:{2}"&fl=numFound&wt=json'.format(solr_select_url, namespace, uuid))
         data = loads(resp.text)
         if data['response']['numFound'] >= 1:
             return True
         return False
 
 
-@app.task()
+@app.task(base=DependencyTask)
+def objects_exist(uuids, namespace, chunk_size=solr_chunk_size):
+    """
+    Check existence of many objects in solr using chunked PID queries
+    args:
+      uuids: list of uuids/pids of objects
+      namespace: indicate which namespace to use
+      chunk_size: number of PIDs to look up per solr query
+    returns dictionary of uuid to True or False
+    """
+    uuids = list(uuids)
+    found = set()
+    for start in range(0, len(uuids), chunk_size):
+        chunk = uuids[start:start + chunk_size]
+        terms = " OR ".join('"{0}:{1}"'.format(namespace, uuid) for uuid in chunk)
+        resp = httpclient.get(solr_select_url, params={
+            "q": "PID:({0})".format(terms),
+            "fl": "PID",
+            "rows": len(chunk),
+            "wt": "json"
+        })
+        data = loads(resp.text)
+        for doc in data['response']['docs']:
+            found.add(doc['PID'].split(":", 1)[-1])
+    return dict((uuid, uuid in found) for uuid in uuids)
+
+
+@app.task(base=DependencyTask)
 def ingest_status(recipe_url, namespace=None):
     """
     Polls the server to check that objects defined in the recipe_url exist on the server.
@@ -243,22 +771,15 @@ def ingest_status(recipe_url, namespace=None):
       namespace: String indicating which collection to use
     """
    
-    # Get UUIDs from recipe file
-    try:
-        recipe_text = requests.get(recipe_url).text
-    except requests.RequestException:
-        raise Exception("Bad recipe url")
-    recipe_data = loads(recipe_text)
-    book_uuid = recipe_data['recipe']['uuid']
-    page_uuids = [page['uuid'] for page in recipe_data['recipe']['pages']]
+    book_uuid, page_uuids = _recipe_uuids(recipe_url)
 
     if not object_exists(book_uuid, namespace):
+        _record_ledger(namespace, book_uuid, False, None)
         return {"book": book_uuid, "page_status": None, "successful_load": False, 
                 "error": "Book not loaded. Book's UUID not found: {0}".format(book_uuid)}
 
-    status = {}
-    for uuid in page_uuids:
-        status[uuid] = object_exists(uuid, namespace)
+    status = objects_exist(page_uuids, namespace)
+    _record_ledger(namespace, book_uuid, True, status)
 
     successful_load = all([value for value in status.values()])
     
@@ -266,8 +787,143 @@ def ingest_status(recipe_url, namespace=None):
 
 
 
+@app.task(base=DependencyTask)
+def reconcile_collection(namespace, recipe_urls=None, collection=None, max_report=1000):
+    """
+    Compare every object solr holds in a namespace with the objects the recipes of the collection
+    expect, in one pass over solr (cursorMark paging) and the recipes.
+
+    args:
+      namespace: pid namespace to reconcile (e.x. oku)
+      recipe_urls: list of recipe URLs expected in the namespace. Default is the recipe of every bag
+                   the data catalog records in collection
+      collection: catalog collection name (e.x. oku:hos) used without recipe_urls. Default is every
+                  collection of the namespace
+      max_report: most missing and orphaned PIDs, and recipe errors, listed in the result
+    returns counts of objects in solr, expected, missing (expected but not in solr) and orphaned
+    (in solr but in no recipe) objects, up to max_report PIDs of each, recipe errors keyed by URL,
+    and truncated when a list was cut short
+    """
+    start = time()
+    if recipe_urls is None:
+        recipe_urls = reconcile.catalog_recipe_urls(httpclient.get, catalog_url, collection, namespace)
+    counts = {"recipes": 0}
+    recipe_errors = {}
+
+    def expected_pids():
+        for recipe_url in recipe_urls:
+            counts["recipes"] += 1
+            try:
+                book_uuid, page_uuids = _recipe_uuids(recipe_url)
+            except Exception as err:
+                if len(recipe_errors) < max_report:
+                    recipe_errors[recipe_url] = str(err)
+                continue
+            yield "{0}:{1}".format(namespace, book_uuid)
+            for page_uuid in page_uuids:
+                yield "{0}:{1}".format(namespace, page_uuid)
+
+    def solr_pids():
+        return reconcile.solr_pids(httpclient.get, solr_select_url, namespace)
+
+    report = reconcile.reconcile(solr_pids, expected_pids(), max_report)
+    report.update({"namespace": namespace, "recipes": counts["recipes"], "recipe_errors": recipe_errors,
+                   "seconds": round(time() - start, 3)})
+    return report
+
+
+def _recipe_uuids(recipe_url):
+    """ Internal function returning the book uuid and page uuids of the recipe at recipe_url """
+    try:
+        recipe = recipecache.fetch(recipe_url)
+    except (requests.RequestException, recipecache.RecipeError):
+        raise Exception("Bad recipe url")
+    if not recipe['is_recipe']:
+        raise Exception("Bad recipe url")
+    return recipe['book_uuid'], recipe['page_uuids']
+
+
+def _report_progress(task, state, meta):
+    """ Internal function to publish task progress when running under a worker """
+    if not task.request.called_directly and task.request.id:
+        task.update_state(state=state, meta=meta)
+
+
+@app.task(bind=True, base=DependencyTask)
+def await_ingest(self, recipe_url, namespace=None, timeout=None, initial_delay=None, max_delay=None,
+                 deadline=None, book_found=False, pending=None, rounds=0):
+    """
+    Polls the server until the objects defined in the recipe_url exist or the timeout passes.
+
+    Each round only re-checks the pages still missing in the previous round, waiting twice as
+    long between rounds up to max_delay. Under a worker the next round is a Celery retry with the
+    polling state in its kwargs, so the worker is free between rounds. Progress is published as
+    the VERIFYING task state.
+
+    args:
+      recipe_url: URL string pointing to a json formatted recipe file
+      namespace: String indicating which collection to use
+      timeout: Seconds to keep polling. Default is ISLANDORA_VERIFY_TIMEOUT or 600
+      initial_delay: Seconds before the second round. Default is ISLANDORA_VERIFY_INITIAL_DELAY or 2
+      max_delay: Longest wait between rounds in seconds. Default is ISLANDORA_VERIFY_MAX_DELAY or 60
+      deadline, book_found, pending, rounds: polling state carried between rounds, not set by callers
+    returns the ingest_status result with the number of polling rounds
+    """
+    delay = VERIFY_INITIAL_DELAY if initial_delay is None else initial_delay
+    max_delay = VERIFY_MAX_DELAY if max_delay is None else max_delay
+    if deadline is None:
+        deadline = time() + (VERIFY_TIMEOUT if timeout is None else timeout)
+
+    book_uuid, page_uuids = _recipe_uuids(recipe_url)
+    pending = list(page_uuids) if pending is None else pending
+    while True:
+        rounds += 1
+        if not book_found:
+            book_found = object_exists(book_uuid, namespace)
+        if book_found and pending:
+            found = objects_exist(pending, namespace)
+            pending = [uuid for uuid in pending if not found.get(uuid)]
+        _report_progress(self, "VERIFYING", {"book": book_uuid, "book_found": book_found, "round": rounds,
+                                             "pages_found": len(page_uuids) - len(pending),
+                                             "pages_total": len(page_uuids)})
+        if (book_found and not pending) or time() + delay > deadline:
+            break
+        if not self.request.called_directly:
+            raise self.retry(countdown=delay, max_retries=None, args=(recipe_url,), kwargs={
+                "namespace": namespace, "initial_delay": min(delay * 2, max_delay), "max_delay": max_delay,
+                "deadline": deadline, "book_found": book_found, "pending": pending, "rounds": rounds})
+        sleep(delay)
+        delay = min(delay * 2, max_delay)
+
+    missing = set(pending)
+    status = dict((uuid, uuid not in missing) for uuid in page_uuids)
+    _record_ledger(namespace, book_uuid, book_found, status if book_found else None)
+    if not book_found:
+        return {"book": book_uuid, "page_status": None, "successful_load": False, "rounds": rounds,
+                "error": "Book not loaded. Book's UUID not found: {0}".format(book_uuid)}
+    return {"book": book_uuid, "page_status": status, "successful_load": not pending, "rounds": rounds}
+
+
+def _record_ledger(namespace, book_uuid, book_ingested, page_status):
+    """ Internal function to record verified ingest state without letting ledger problems fail verification """
+    if not namespace:
+        return
+    try:
+        ledger.record_status(namespace, book_uuid, book_ingested, page_status)
+    except Exception as err:
+        logging.error("Unable to record ingest ledger for {0}:{1}: {2}".format(namespace, book_uuid, err))
+
+
+def _forget_ledger(namespace, pids):
+    """ Internal function to record deleted objects without letting ledger problems fail the delete """
+    try:
+        ledger.record_deleted(namespace, pids)
+    except Exception as err:
+        logging.error("Unable to record deleted objects of {0} in the ingest ledger: {1}".format(namespace, err))
+
+
 @app.task()
-def ingest_and_verify(recipe_url, collection='oku:hos', pid_namespace=None):
+def ingest_and_verify(recipe_url, collection='oku:hos', pid_namespace=None, submitter=None):
     """
     Ingest a recipe into Islandora and then verify if it was loaded succeccfully.
     
@@ -275,57 +931,282 @@ def ingest_and_verify(recipe_url, collection='oku:hos', pid_namespace=None):
       recipe_url: URL string pointing to a json formatted recipe file
       collection: Name of Islandora collection to ingest to. Default is: oku:hos 
       pid_namespace: Namespace to ingest recipe. Default is first half of collection name
+      submitter: name used for fair scheduling between submitters when ISLANDORA_SCHEDULER is set
     """
     if not pid_namespace:
         pid_namespace = collection.split(":")[0]
 
+    submission = None
+    if submissions.ENABLED:
+        submission = (submissions.submission_key(recipe_url), uuid.uuid4().hex)
+        claimed, record = submissions.get_registry().claim(*submission)
+        if not claimed:
+            logging.info("{0} is already being ingested by {1}".format(submission[0], record.get("task_id")))
+            return "Recipe already submitted, attached to running ingest {0}".format(record.get("task_id"))
+
+    try:
+        if scheduler.ENABLED:
+            result = submit_ingest.delay(recipe_url, collection, pid_namespace, submitter=submitter,
+                                         submission=submission)
+            message = "Submitted recipe to the ingest scheduler"
+        else:
+            ingest = ingest_recipe.s(recipe_url, collection, pid_namespace)
+            chain = (ingest | _verify_and_catalog(recipe_url, collection, pid_namespace, submission))
+            if submission:
+                chain.on_error(release_submission.si(*submission))
+            result = chain()
+            message = "Kicked off tasks to ingest recipe and verify ingest"
+    except Exception:
+        if submission:
+            submissions.get_registry().release(*submission)
+        raise
+    if submission:
+        submissions.get_registry().attach(submission[0], submission[1], result.id)
+    return message
+
+
+def _verify_and_catalog(recipe_url, collection, pid_namespace, submission=None):
+    """
+    Internal function returning the chain verifying an ingest and then updating the catalog,
+    releasing the (key, owner) submission claim at the end
+    """
     # recipe_url example: https://bag.ou.edu/derivative/[bag name]/[paramstring]/[lowercase version of bag name].json
     bag = recipe_url.split("/")[4]
     paramstring = recipe_url.split("/")[5]
 
-    ingest = ingest_recipe.s(recipe_url, collection, pid_namespace)
-    verify = ingest_status.si(recipe_url, namespace=pid_namespace)  # immutable signature to prevent result of ingest being appended
-    update_catalog = updatecatalog.si(bag, paramstring, collection, ingested=True)  # immutable signature
-    chain = (ingest | verify | update_catalog)
-    result = chain()
-    return "Kicked off tasks to ingest recipe and verify ingest"
+    verify = await_ingest.si(recipe_url, namespace=pid_namespace)  # immutable signature to prevent result of ingest being appended
+    if catalog.WRITE_BEHIND:
+        update_catalog = queue_catalog_update.si(bag, paramstring, collection, ingested=True)  # immutable signature
+    else:
+        update_catalog = updatecatalog.si(bag, paramstring, collection, ingested=True)  # immutable signature
+    if submission:
+        return verify | update_catalog | release_submission.si(*submission)
+    return verify | update_catalog
+
+
+@app.task()
+def release_submission(key, owner):
+    """ Free the submission claim of a finished or failed ingest_and_verify chain """
+    return submissions.get_registry().release(key, owner)
+
+
+@app.task()
+def submission_status(recipe_url):
+    """
+    Return the running submission of a recipe URL, with the id of its task, or None when the
+    recipe is not being ingested or submissions are not de-duplicated
+    """
+    if not submissions.ENABLED:
+        return None
+    record = submissions.get_registry().get(submissions.submission_key(recipe_url))
+    if record is None:
+        return None
+    return results.jsonable(dict((field, record.get(field)) for field in ("_id", "task_id", "claimed", "expires")))
+
+
+@app.task(queue=scheduler.QUEUE)
+def submit_ingest(recipe_url, collection='oku:hos', pid_namespace=None, submitter=None, pages=None, submission=None):
+    """
+    Add a recipe to the ingest scheduler backlog. The book is classed by its page count and ingested
+    from its size class queue once the class has a free slot, in fair order across collections and
+    submitters, then verified and recorded in the catalog as by ingest_and_verify.
+
+    args:
+      recipe_url: URL string pointing to a json formatted recipe file
+      collection: Name of Islandora collection to ingest to. Default is: oku:hos
+      pid_namespace: Namespace to ingest recipe. Default is first half of collection name
+      submitter: name of the person or system submitting, scheduled fairly against other submitters
+      pages: page count of the book. Default is the number of pages in the recipe
+      submission: (key, owner) claim of ingest_and_verify released once the book is verified
+    returns the backlog job id with the page count, size class and queue
+    """
+    if not pid_namespace:
+        pid_namespace = collection.split(":")[0]
+    if pages is None:
+        try:
+            pages = len(_recipe_uuids(recipe_url)[1])
+        except Exception as err:
+            # ingest_recipe reports the bad recipe; class it small so it fails without holding a large slot
+            logging.error("Unable to count pages of {0}: {1}".format(recipe_url, err))
+            pages = 0
+    job_id, size_class = scheduler.get_backlog().submit(recipe_url, collection, pid_namespace, submitter, pages,
+                                                            submission)
+    dispatch_ingests()
+    return {"job": job_id, "pages": pages, "size_class": size_class, "queue": scheduler.queue_for(size_class)}
+
+
+@app.task(queue=scheduler.QUEUE)
+def dispatch_ingests():
+    """ Send the next backlog ingests of every size class with a free slot to the class queue """
+    backlog = scheduler.get_backlog()
+    dispatched = []
+    for job in backlog.next_jobs():
+        _send_scheduled_ingest(backlog, job)
+        dispatched.append(job["id"])
+    scheduler.publish(backlog.stats())
+    return dispatched
+
+
+def _send_scheduled_ingest(backlog, job):
+    """ Internal function sending a backlog job to its size class queue """
+    result = scheduled_ingest.apply_async(
+        (job["id"], job["recipe_url"], job["collection"], job["pid_namespace"]),
+        {"submission": job["submission"], "resume": job["resume"]}, queue=job["queue"])
+    backlog.set_task(job["id"], result.id)
+
+
+@app.task(bind=True, acks_late=True, reject_on_worker_lost=True)
+def scheduled_ingest(self, job_id, recipe_url, collection, pid_namespace, submission=None, resume=False):
+    """
+    Ingest a backlog job from its size class queue, hand its slot back to the scheduler and then
+    verify the ingest and update the catalog
+
+    The job sends a heartbeat to the scheduler every ISLANDORA_SCHEDULER_HEARTBEAT seconds while it
+    runs. The message is acknowledged once the task ends, so if the worker dies the job is delivered
+    again. A redelivered job may have been given up as lost and its slot handed on, so it asks the
+    scheduler for its slot back and is sent again to resume the ingest of the objects still missing.
+    """
+    if (self.request.delivery_info or {}).get("redelivered") and not resume:
+        logging.warning("Backlog job {0} was delivered again, reclaiming its slot".format(job_id))
+        reclaim_scheduled_ingest.delay(job_id)
+        return None
+    start = time()
+    ok = False
+    stop = _scheduler_heartbeat(job_id)
+    try:
+        result = ingest_recipe(recipe_url, collection, pid_namespace, resume=resume or None)
+        ok = not result.get("failed", len(result.get("Failures", [])))
+    except Exception:
+        if submission:
+            submissions.get_registry().release(*submission)
+        raise
+    finally:
+        stop.set()
+        finish_scheduled_ingest.delay(job_id, ok, time() - start)
+    verify = _verify_and_catalog(recipe_url, collection, pid_namespace, submission)
+    if submission:
+        verify.on_error(release_submission.si(*submission))
+    verify.delay()
+    return result
+
+
+def _scheduler_heartbeat(job_id):
+    """ Internal function sending scheduler heartbeats for a running job until the returned event is set """
+    stop = Event()
+
+    def beat():
+        while True:
+            try:
+                heartbeat_scheduled_ingest.delay(job_id)
+            except Exception as err:
+                logging.warning("Unable to send scheduler heartbeat of job {0}: {1}".format(job_id, err))
+            if stop.wait(scheduler.HEARTBEAT):
+                return
+
+    thread = Thread(target=beat, name="scheduler-heartbeat")
+    thread.daemon = True
+    thread.start()
+    return stop
+
+
+@app.task(queue=scheduler.QUEUE)
+def heartbeat_scheduled_ingest(job_id):
+    """ Record that a dispatched backlog job is still running """
+    return scheduler.get_backlog().heartbeat(job_id)
+
+
+@app.task(queue=scheduler.QUEUE)
+def reclaim_scheduled_ingest(job_id):
+    """
+    Send a redelivered backlog job again to resume its ingest when it still holds, or can take
+    back, a slot of its class; otherwise it waits in the backlog and resumes when dispatched
+    """
+    backlog = scheduler.get_backlog()
+    job = backlog.reclaim(job_id)
+    if job is not None:
+        _send_scheduled_ingest(backlog, job)
+    return dispatch_ingests()
+
 
+@app.task(queue=scheduler.QUEUE)
+def finish_scheduled_ingest(job_id, ok, seconds):
+    """ Record a finished backlog job and dispatch the next ingests """
+    backlog = scheduler.get_backlog()
+    backlog.finish(job_id, ok, seconds)
+    backlog.prune(scheduler.RETENTION)
+    return dispatch_ingests()
 
-def _item_manipulator(pid, namespace, operation):
-    """ Internal function to call the islandora_item_manipulator (iim) drush script """
+
+@app.task(queue=scheduler.QUEUE)
+def ingest_queue_stats():
+    """
+    Return the backlog of every size class: queued books and pages, running ingests, measured pages
+    per second and the estimated seconds to drain the class, with queued books per collection and submitter
+    """
+    return scheduler.get_backlog().stats()
+
+
+def _item_manipulator(pid, namespace, operation, result_format=None):
+    """
+    Internal function to call the islandora_item_manipulator (iim) drush script
+
+    On a drush error the compact format returns {"Error": [code, drush status, detail reference]}
+    with the drush output and log tail kept in the result side store, the verbose format returns
+    {"Error": [drush output, drush status, environ, log tail]}
+    """
+    result_format = results.check_format(result_format)
     operations = ['read', 'delete']
     if operation not in operations:
         raise Exception("operation must be one of {0}".format(operations))
     drush_response = None
     logging.info("operation: {0}, namespace: {1}, pid: {2}".format(operation, namespace, pid))
     try:
-        drush_response = check_output(
-            crud_template.format(namespace, pid, operation, ISLANDORA_DRUPAL_ROOT),
-            shell=True
-        )
+        if drushworker.ENABLED:
+            try:
+                # a failed operation raises DrushOperationError, handled below like a failed drush process
+                drush_response = drushworker.run(ISLANDORA_DRUPAL_ROOT, operation, "{0}:{1}".format(namespace, pid))
+            except drushworker.DrushWorkerError as err:
+                logging.warning("Drush helper unavailable, using one-shot drush: {0}".format(err))
+                # the helper may have deleted the object before failing, never delete it twice
+                if operation == "delete" and err.sent and not object_exists(pid, namespace, method="drush"):
+                    logging.warning("{0}:{1} already deleted by the drush helper".format(namespace, pid))
+                    drush_response = b""
+        if drush_response is None:
+            with metrics.timed("drush", operation):
+                drush_response = stream_output(
+                    crud_template.format(namespace, pid, operation, ISLANDORA_DRUPAL_ROOT, drush=_drush()),
+                    stderr=None,
+                    shell=True
+                )
         logging.debug(drush_response)
     except CalledProcessError as err:
-        logging.error(drush_response)
+        logging.error(err.output)
         logging.error(err)
         logging.error(environ)
         #return {"Error": "Could not perform operation"}
         logpath = environ.get('CELERY_LOG_FILE')
-        with open(logpath, 'r') as f:
-            loglast5 = f.readlines()[-5:]
-        return {"Error": [drush_response, err.returncode, environ, loglast5]}
+        loglast5 = tail(logpath, 5) if logpath else []
+        if result_format == "verbose":
+            return {"Error": [drush_response, err.returncode, environ, loglast5]}
+        detail = results.save_detail("{0}_item".format(operation), {
+            "pid": "{0}:{1}".format(namespace, pid), "output": err.output, "returncode": err.returncode,
+            "command": err.cmd, "PATH": environ.get("PATH"), "log": loglast5,
+            "spill": getattr(err, "spill_path", None)})
+        return {"Error": ["drush_{0}".format(err.returncode), err.returncode, detail]}
     return drush_response
 
 
 @app.task()
-def read_item(pid, namespace):
+def read_item(pid, namespace, result_format=None):
     """
     Read details of an object in Islandora
     
     args:
       pid - The unique identifier of the object (PID / UUID)
       namespace - The collection namespace the object exists in
+      result_format - compact or verbose drush errors. Default is ISLANDORA_RESULT_FORMAT or compact
     """
-    return _item_manipulator(pid, namespace, 'read')
+    return _item_manipulator(pid, namespace, 'read', result_format)
 
 
 @app.task()
@@ -337,16 +1218,184 @@ def delete_item(pid, namespace):
       pid - The unique identifier of the object (PID / UUID)
       namespace - The collection namespace the object exists in
     """
-    _item_manipulator(pid, namespace, 'delete')
+    response = _item_manipulator(pid, namespace, 'delete')
+    if not (isinstance(response, dict) and "Error" in response):
+        _forget_ledger(namespace, [pid])
     return True
 
 
+def _bulk_item_operation(pids, namespace, operation, chunk_size, concurrency):
+    """
+    Internal function applying an item operation to many PIDs in chunks. PIDs that solr reports
+    as missing are skipped. Returns a summary of counts, failures and per-PID results.
+    """
+    pids = list(OrderedDict.fromkeys(pids))
+    concurrency = concurrency or ITEM_CONCURRENCY
+    summary = {"requested": len(pids), "skipped": 0, "succeeded": 0, "failed": 0, "failures": {}, "results": {}}
+
+    def apply_operation(pid):
+        try:
+            response = _item_manipulator(pid, namespace, operation)
+        except Exception as err:
+            logging.error("{0} of {1}:{2} failed: {3}".format(operation, namespace, pid, err))
+            return pid, False, str(err)
+        if isinstance(response, dict) and "Error" in response:
+            return pid, False, "Drush status {0}".format(response["Error"][1])
+        if isinstance(response, bytes):
+            response = response.decode("utf-8", "replace")
+        return pid, True, response
+
+    for start in range(0, len(pids), chunk_size):
+        chunk = pids[start:start + chunk_size]
+        try:
+            exists = objects_exist(chunk, namespace, chunk_size)
+        except Exception as err:
+            logging.warning("Unable to check solr for existing objects, processing all: {0}".format(err))
+            exists = dict((pid, True) for pid in chunk)
+        present = [pid for pid in chunk if exists.get(pid)]
+        summary["skipped"] += len(chunk) - len(present)
+        for pid, ok, result in _map_concurrent(apply_operation, present, concurrency):
+            if ok:
+                summary["succeeded"] += 1
+                summary["results"][pid] = result
+            else:
+                summary["failed"] += 1
+                summary["failures"][pid] = result
+    return summary
+
+
+@app.task()
+def read_items(pids, namespace, chunk_size=solr_chunk_size, concurrency=None):
+    """
+    Read details of many objects in Islandora, skipping objects solr does not know about
+
+    args:
+      pids - List of unique identifiers of the objects (PID / UUID)
+      namespace - The collection namespace the objects exist in
+      chunk_size - Number of PIDs checked and processed per batch
+      concurrency - Number of drush operations run at once. Default is ISLANDORA_ITEM_CONCURRENCY or 4
+    returns counts of requested, skipped, succeeded and failed PIDs with failures and results keyed by PID
+    """
+    return _bulk_item_operation(pids, namespace, 'read', chunk_size, concurrency)
+
+
+@app.task()
+def delete_items(pids, namespace, chunk_size=solr_chunk_size, concurrency=None):
+    """
+    Delete many objects from Islandora, skipping objects solr reports as already gone
+
+    args:
+      pids - List of unique identifiers of the objects (PID / UUID)
+      namespace - The collection namespace the objects exist in
+      chunk_size - Number of PIDs checked and processed per batch
+      concurrency - Number of drush operations run at once. Default is ISLANDORA_ITEM_CONCURRENCY or 4
+    returns counts of requested, skipped, succeeded and failed PIDs with failures keyed by PID
+    """
+    summary = _bulk_item_operation(pids, namespace, 'delete', chunk_size, concurrency)
+    # deleted now or already missing from solr
+    _forget_ledger(namespace, [pid for pid in OrderedDict.fromkeys(pids) if pid not in summary["failures"]])
+    del summary["results"]
+    return summary
+
+
 @app.task()
 def clear_drush_cache():
-    check_call(["drush", "cache-clear", "drush"])
+    if drushworker.ENABLED:
+        try:
+            drushworker.run(ISLANDORA_DRUPAL_ROOT, 'cache-clear')
+            drushworker.restart()  # pick up the rebuilt command cache on next use
+            return True
+        except drushworker.DrushWorkerError as err:
+            logging.warning("Drush helper unavailable, using one-shot drush: {0}".format(err))
+    with metrics.timed("drush", "cache-clear"):
+        check_call([preflight.drush_path(), "cache-clear", "drush"])
+    drushworker.restart()
     return True
 
 
+def _run_async(coroutine_function, *args, **kwargs):
+    """ Internal function running an asyncio engine coroutine to completion in this worker """
+    if aio is None:
+        raise Exception("The asyncio engine needs Python 3")
+    return aio.run(coroutine_function, *args, **kwargs)
+
+
+@app.task()
+def async_verify_solr_up():
+    """
+    Check that the solr application is running returning True or False, using the asyncio engine
+    """
+    return _run_async(aio.verify_solr_up)
+
+
+@app.task(base=DependencyTask)
+def async_object_exists(uuid, namespace):
+    """
+    Check in solr that an object exists using the asyncio engine
+    args:
+      uuid: uuid/pid of object
+      namespace: indicate which namespace to use
+    """
+    return _run_async(aio.object_exists, uuid, namespace)
+
+
+@app.task(base=DependencyTask)
+def async_objects_exist(uuids, namespace, chunk_size=solr_chunk_size):
+    """
+    Check existence of many objects in solr using concurrent chunked PID queries
+    args:
+      uuids: list of uuids/pids of objects
+      namespace: indicate which namespace to use
+      chunk_size: number of PIDs to look up per solr query
+    returns dictionary of uuid to True or False
+    """
+    return _run_async(aio.objects_exist, uuids, namespace, chunk_size)
+
+
+@app.task(base=DependencyTask)
+def async_ingest_status(recipe_url, namespace=None):
+    """
+    Same as ingest_status using the asyncio engine, querying solr for all page chunks at once
+
+    args:
+      recipe_url: URL string pointing to a json formatted recipe file
+      namespace: String indicating which collection to use
+    """
+    return _run_async(aio.ingest_status, recipe_url, namespace)
+
+
+@app.task(base=DependencyTask)
+def async_ingest_status_many(recipe_urls, namespace=None, concurrency=None):
+    """
+    Verify many books at once in one worker process using the asyncio engine
+
+    args:
+      recipe_urls: list of URL strings pointing to json formatted recipe files
+      namespace: String indicating which collection to use
+      concurrency: Number of books verified at once. Default is ISLANDORA_ASYNC_BOOK_CONCURRENCY or 50
+    returns a list of ingest_status results in the order of recipe_urls. A recipe that could not
+    be checked gives {"recipe": url, "successful_load": False, "error": reason}
+    """
+    return _run_async(aio.ingest_status_many, recipe_urls, namespace, concurrency)
+
+
+@app.task(bind=True, base=DependencyTask)
+def async_updatecatalog(self, bag, paramstring, collection, ingested=True):
+    """
+    Same as updatecatalog using the asyncio engine
+
+    args:
+      bag (string); Name of bag to update data catalog entry
+      paramstring (string);  Parameter settings of derivative (e.x. "jpeg_040_antialias")
+      collection (string); collection name with namespace (e.x. oku:hos)
+      ingested (boolean); Indicates the bags ingest status - default is true
+    """
+    try:
+        return _run_async(aio.updatecatalog, bag, paramstring, collection, ingested)
+    except aio.CatalogWriteError:
+        self.retry(countdown=60, max_retries=4)
+
+
 # added to asssist with testing connectivity
 @app.task()
 def add(x, y):
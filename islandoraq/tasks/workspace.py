@@ -0,0 +1,264 @@
+"""
+Pool of reusable scratch directories for staged recipes.
+
+Directories are created once with the group and mode drush needs and handed back to the pool
+after use. They are emptied by a background thread, so releasing one costs the caller nothing.
+A workspace goes on the RAM backed root (e.g. /dev/shm) when the recipe's size estimate fits in
+RAM_BYTES; otherwise it goes on the disk root. Directory names carry the worker's host and pid,
+so the directories of crashed workers on this host can be swept when a worker starts, even when
+the root is shared with other hosts.
+"""
+import errno
+import grp
+import logging
+import os
+import re
+import threading
+from os import chmod, chown, getpid, listdir, remove
+from os.path import exists, getsize, isdir, islink, join
+from shutil import rmtree
+from socket import gethostname
+from tempfile import gettempdir, mkdtemp
+
+from celery.signals import worker_process_init, worker_process_shutdown
+
+try:
+    from Queue import Queue
+except ImportError:
+    from queue import Queue
+
+try:
+    import celeryconfig
+except ImportError:
+    celeryconfig = None
+
+ROOT = getattr(celeryconfig, "ISLANDORA_WORKSPACE_ROOT", gettempdir())
+RAM_ROOT = getattr(celeryconfig, "ISLANDORA_WORKSPACE_RAM_ROOT", None)  # e.g. /dev/shm
+RAM_BYTES = getattr(celeryconfig, "ISLANDORA_WORKSPACE_RAM_BYTES", 512 * 1024 ** 2)  # per worker process
+POOL_SIZE = getattr(celeryconfig, "ISLANDORA_WORKSPACE_POOL_SIZE", 4)  # spare directories kept per root
+GROUP = getattr(celeryconfig, "ISLANDORA_WORKSPACE_GROUP", "apache")
+PAGE_BYTES = getattr(celeryconfig, "ISLANDORA_WORKSPACE_PAGE_BYTES", 8 * 1024 ** 2)  # estimated size of a staged page
+PREFIX = "recipeloader_"
+
+HOST = gethostname().split(".")[0].replace("_", "-")  # no underscores, they separate the name fields
+_NAME = re.compile(r"^{0}{1}_(\d+)_".format(PREFIX, re.escape(HOST)))
+_gid = None
+
+
+def group_id():
+    """ gid of GROUP, looked up once per process """
+    global _gid
+    if _gid is None:
+        _gid = grp.getgrnam(GROUP).gr_gid
+    return _gid
+
+
+def estimate(entry=None, recipe=None, pages=0):
+    """
+    Estimated bytes a staged recipe takes: the recipe body plus PAGE_BYTES per page. Page images
+    end up in the workspace whether they are staged or left remote, since drush downloads remote
+    pages into its tmp_dir.
+
+    args:
+      entry: recipe cache entry of a recipe fetched from a URL
+      recipe: recipe dictionary, used without entry
+      pages: pages ingested from the workspace
+    """
+    size = 0
+    if entry is not None:
+        from . import recipecache
+        try:
+            size = getsize(recipecache.path(entry))
+        except OSError:
+            pass
+    elif recipe is not None:
+        size = len(str(recipe))
+    return size + pages * PAGE_BYTES
+
+
+def _clear(path):
+    """ remove the contents of a directory, keeping the directory """
+    for name in listdir(path):
+        child = join(path, name)
+        if isdir(child) and not islink(child):
+            rmtree(child, ignore_errors=True)
+        else:
+            try:
+                remove(child)
+            except OSError:
+                pass
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except OSError as err:
+        return err.errno == errno.EPERM
+    return True
+
+
+class WorkspacePool(object):
+    """
+    Scratch directories of one worker process. acquire returns an empty directory owned by GROUP
+    with mode 775; release hands it to the cleaner thread which empties it and keeps up to
+    pool_size spare directories per root.
+    """
+
+    def __init__(self, root=ROOT, ram_root=RAM_ROOT, ram_bytes=RAM_BYTES, pool_size=POOL_SIZE):
+        self.root = root
+        self.ram_root = ram_root if ram_root and isdir(ram_root) else None
+        self.ram_bytes = ram_bytes
+        self.pool_size = pool_size
+        self.ram_in_use = 0
+        self.created = 0
+        self.reused = 0
+        self._sizes = {}
+        self._spare = {}
+        self._lock = threading.Lock()
+        self._released = Queue()
+        self._cleaner = None
+
+    def _root_for(self, size):
+        if self.ram_root is not None and self.ram_in_use + size <= self.ram_bytes:
+            try:
+                stat = os.statvfs(self.ram_root)
+                if stat.f_bavail * stat.f_frsize >= size:
+                    return self.ram_root
+            except OSError:
+                pass
+        return self.root
+
+    def acquire(self, size=0):
+        """ return an empty workspace for a recipe of about size bytes """
+        with self._lock:
+            root = self._root_for(size)
+            if root == self.ram_root:
+                self.ram_in_use += size
+            spare = self._spare.get(root)
+            path = spare.pop() if spare else None
+            if path is not None:
+                self.reused += 1
+        if path is None:
+            try:
+                path = mkdtemp(prefix="{0}{1}_{2}_".format(PREFIX, HOST, getpid()), dir=root)
+                chmod(path, 0o775)
+                chown(path, -1, group_id())
+            except Exception:
+                with self._lock:
+                    if root == self.ram_root:
+                        self.ram_in_use -= size
+                if path is not None:
+                    rmtree(path, ignore_errors=True)
+                raise
+            with self._lock:
+                self.created += 1
+        with self._lock:
+            self._sizes[path] = (root, size)
+        logging.debug("acquired working dir: {0}".format(path))
+        return path
+
+    def release(self, path):
+        """ hand a workspace back; it is emptied and reused or removed in the background """
+        with self._lock:
+            root, size = self._sizes.pop(path, (None, 0))
+            if root is not None and root == self.ram_root:
+                self.ram_in_use -= size
+            if self._cleaner is None or not self._cleaner.is_alive():
+                self._cleaner = threading.Thread(target=self._clean, name="workspace-cleaner")
+                self._cleaner.daemon = True
+                self._cleaner.start()
+        self._released.put((path, root))
+
+    def _clean(self):
+        while True:
+            path, root = self._released.get()
+            try:
+                if path is None:
+                    return
+                if root is None or not exists(path):
+                    rmtree(path, ignore_errors=True)
+                    continue
+                _clear(path)
+                with self._lock:
+                    spare = self._spare.setdefault(root, [])
+                    keep = len(spare) < self.pool_size
+                    if keep:
+                        spare.append(path)
+                if not keep:
+                    rmtree(path, ignore_errors=True)
+            except Exception as err:
+                logging.error("Unable to clean working dir {0}: {1}".format(path, err))
+            finally:
+                self._released.task_done()
+
+    def drain(self):
+        """ wait until every released workspace has been cleaned """
+        self._released.join()
+
+    def close(self):
+        """ clean released workspaces and remove the spare directories """
+        self.drain()
+        with self._lock:
+            spares = [path for paths in self._spare.values() for path in paths]
+            self._spare = {}
+        for path in spares:
+            rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {"created": self.created, "reused": self.reused, "in_use": len(self._sizes),
+                    "spare": sum(len(paths) for paths in self._spare.values()), "ram_in_use": self.ram_in_use}
+
+
+def sweep(roots=None):
+    """ remove workspaces of this host left behind by worker processes no longer running; returns their count """
+    removed = 0
+    for root in roots or [ROOT, RAM_ROOT]:
+        if not root or not isdir(root):
+            continue
+        for name in listdir(root):
+            match = _NAME.match(name)
+            if not match or _alive(int(match.group(1))):
+                continue
+            rmtree(join(root, name), ignore_errors=True)
+            removed += 1
+    if removed:
+        logging.warning("Removed {0} working dirs of stopped workers".format(removed))
+    return removed
+
+
+_pool = None
+_pid = None
+
+
+def get_pool():
+    """ return this process's workspace pool """
+    global _pool, _pid
+    if _pool is None or _pid != getpid():
+        _pid = getpid()
+        _pool = WorkspacePool()
+    return _pool
+
+
+def acquire(size=0):
+    return get_pool().acquire(size)
+
+
+def release(path):
+    get_pool().release(path)
+
+
+@worker_process_init.connect
+def _sweep_on_start(**kwargs):
+    global _pool
+    _pool = None
+    try:
+        sweep()
+    except Exception as err:
+        logging.error("Unable to sweep working dirs: {0}".format(err))
+
+
+@worker_process_shutdown.connect
+def _close_on_shutdown(**kwargs):
+    if _pool is not None and _pid == getpid():
+        _pool.close()
@@ -3,7 +3,7 @@
 from setuptools import setup, find_packages
 setup(name='islandoraq',
       version='0.3.6',
-      packages= find_packages(),
+      packages= find_packages(exclude=['benchmarks']),
       install_requires=[
           'celery==5.2.7 ; python_version >= "3.7"',
           'celery==3.1.22 ; python_version == "2.7"',
@@ -12,5 +12,7 @@ setup(name='islandoraq',
           'requests==2.28.2; python_version >= "3.7"',
           'requests==2.24.0; python_version == "2.7"',
       ],
+      extras_require={'async': ['aiohttp ; python_version >= "3.7"']},
       include_package_data=True,
+      package_data={'islandoraq.tasks': ['*.php']},
 )
@@ -0,0 +1,65 @@
+from os import getpid
+
+import pytest
+
+from islandoraq.tasks import catalog, health, ledger, recipecache, results, scheduler, submissions
+
+
+@pytest.fixture(autouse=True)
+def recipe_cache(tmp_path, monkeypatch):
+    """ give every test an empty recipe cache in its own directory """
+    cache = recipecache.RecipeCache(directory=str(tmp_path / "recipe_cache"))
+    monkeypatch.setattr(recipecache, "cache", cache)
+    return cache
+
+
+@pytest.fixture(autouse=True)
+def catalog_cache():
+    """ start every test with an empty catalog lookup cache """
+    catalog.lookup_cache.clear()
+    yield catalog.lookup_cache
+    catalog.lookup_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def ingest_ledger(tmp_path, monkeypatch):
+    """ give every test an empty SQLite ingest ledger """
+    test_ledger = ledger.SqliteLedger(str(tmp_path / "ledger.sqlite"))
+    monkeypatch.setattr(ledger, "_ledger", test_ledger)
+    monkeypatch.setattr(ledger, "_pid", getpid())
+    return test_ledger
+
+
+@pytest.fixture(autouse=True)
+def circuit_breakers():
+    """ start every test with all circuit breakers closed """
+    health.reset()
+    yield health.breakers
+    health.reset()
+
+
+@pytest.fixture(autouse=True)
+def result_store(tmp_path, monkeypatch):
+    """ keep compact result detail in the test's own directory """
+    store = results.FileStore(str(tmp_path / "results"))
+    monkeypatch.setattr(results, "_store", store)
+    monkeypatch.setattr(results, "_pid", getpid())
+    return store
+
+
+@pytest.fixture()
+def backlog(tmp_path, monkeypatch):
+    """ give a test an empty scheduler backlog """
+    test_backlog = scheduler.Backlog(str(tmp_path / "scheduler.sqlite"))
+    monkeypatch.setattr(scheduler, "_backlog", test_backlog)
+    return test_backlog
+
+
+@pytest.fixture(autouse=True)
+def submission_registry(monkeypatch):
+    """ give every test submission de-duplication with an empty in-memory registry """
+    registry = submissions.MemoryRegistry()
+    monkeypatch.setattr(submissions, "ENABLED", True)
+    monkeypatch.setattr(submissions, "_registry", registry)
+    monkeypatch.setattr(submissions, "_pid", getpid())
+    return registry
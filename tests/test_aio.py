@@ -0,0 +1,111 @@
+import asyncio
+import threading
+import time
+
+from six import PY2
+
+import pytest
+import requests
+
+if PY2:
+    pytest.skip("the asyncio engine needs Python 3", allow_module_level=True)
+
+from unittest.mock import Mock, patch
+
+from islandoraq.tasks import aio, health
+from islandoraq.tasks.tasks import (async_ingest_status, async_ingest_status_many, async_objects_exist,
+                                    async_updatecatalog, async_verify_solr_up, ingest_status, verify_solr_up)
+
+RECIPE = b'{"recipe": {"uuid": "book", "pages": [{"uuid": "p1"}, {"uuid": "p2"}, {"uuid": "p3"}]}}'
+INGESTED = set(["oku:book", "oku:p1", "oku:p3"])
+
+
+@pytest.fixture(autouse=True)
+def thread_pool_client(monkeypatch):
+    """ send requests through the patched httpclient even when aiohttp is installed """
+    monkeypatch.setattr(aio, "aiohttp", None)
+
+
+def fake_request(method, url, **kwargs):
+    """ answer recipe, solr and catalog requests the way the real services would """
+    if url.startswith("https://test.somesite.com/") and url.endswith(".json"):
+        return Mock(status_code=200, headers={}, iter_content=Mock(return_value=[RECIPE]))
+    if "solr" in url:
+        query = kwargs.get("params", {}).get("q") or url
+        docs = [{"PID": pid} for pid in sorted(INGESTED) if '"{0}"'.format(pid) in query]
+        return Mock(status_code=200, text='{{"response": {{"numFound": {0}, "docs": {1}}}}}'.format(
+            len(docs), str(docs).replace("'", '"')))
+    return Mock(status_code=500, text="")
+
+
+@patch('islandoraq.tasks.httpclient.request', side_effect=fake_request)
+def test_async_ingest_status_matches_sync(mock_request):
+    expected = ingest_status("https://test.somesite.com/test.json", "oku")
+    assert async_ingest_status("https://test.somesite.com/test.json", "oku") == expected
+    assert expected["page_status"] == {"p1": True, "p2": False, "p3": True}
+
+
+@patch('islandoraq.tasks.httpclient.request', side_effect=fake_request)
+def test_async_ingest_status_many_reports_bad_recipes(mock_request):
+    results = async_ingest_status_many(["https://test.somesite.com/a.json", "https://test.somesite.com/bad"], "oku")
+    assert results[0]["book"] == "book"
+    assert results[1] == {"recipe": "https://test.somesite.com/bad", "successful_load": False,
+                          "error": "Bad recipe url"}
+
+
+@patch('islandoraq.tasks.httpclient.request', side_effect=fake_request)
+def test_async_objects_exist_chunks_queries(mock_request):
+    assert async_objects_exist(["p1", "p2", "p3"], "oku", chunk_size=2) == {"p1": True, "p2": False, "p3": True}
+    assert mock_request.call_count == 2
+
+
+@patch('islandoraq.tasks.tasks.async_updatecatalog.retry')
+@patch('islandoraq.tasks.aio.searchcatalog')
+@patch('islandoraq.tasks.httpclient.request', side_effect=fake_request)
+def test_async_updatecatalog_retries_failed_write(mock_request, mock_search, mock_retry):
+    async def found(client, bag, use_cache=True):
+        assert not use_cache
+        return {"bag": bag}
+    mock_search.side_effect = found
+    async_updatecatalog("Tyler_2019", "jpeg_040_antialias", "oku:hos")
+    assert mock_retry.called
+
+
+def test_client_limits_requests_per_host():
+    active = [0]
+    peak = [0]
+    lock = threading.Lock()
+
+    def slow_request(method, url, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        time.sleep(0.02)
+        with lock:
+            active[0] -= 1
+        return Mock(status_code=200, text="ok")
+
+    async def fetch_all(client):
+        return await asyncio.gather(*[client.get("http://solr.test/{0}".format(i)) for i in range(8)])
+
+    async def main():
+        async with aio.AsyncClient(host_concurrency=2, use_aiohttp=False) as client:
+            return await fetch_all(client)
+
+    with patch('islandoraq.tasks.httpclient.request', side_effect=slow_request):
+        responses = asyncio.new_event_loop().run_until_complete(main())
+    assert all(resp.ok for resp in responses)
+    assert peak[0] == 2
+
+
+@patch('islandoraq.tasks.httpclient.probe')
+def test_async_verify_solr_up_probes_past_open_breaker(mock_request):
+    breaker = health.breakers["solr"]
+    for _ in range(breaker.threshold):
+        breaker.failure()
+    mock_request.return_value = Mock(status_code=200, text="")
+    assert async_verify_solr_up() is True
+    assert mock_request.call_args[1]["timeout"] == health.PROBE_TIMEOUT
+    assert breaker.state == health.OPEN
+    mock_request.side_effect = requests.ConnectionError("refused")
+    assert async_verify_solr_up() is verify_solr_up() is False
@@ -0,0 +1,30 @@
+from six import PY2
+
+if PY2:
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+from islandoraq.tasks.cache import LRUCache, TTLCache
+
+
+def test_lru_evicts_least_recently_used():
+    cache = LRUCache(2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert "b" not in cache
+    assert cache.stats() == {"hits": 1, "misses": 0, "evictions": 1, "size": 2, "maxsize": 2}
+
+
+@patch('islandoraq.tasks.cache.time.time')
+def test_ttl_expires_negative_entries_sooner(mock_time):
+    mock_time.return_value = 1000
+    cache = TTLCache(10, ttl=300, negative_ttl=60)
+    cache.set("found", {"bag": "found"})
+    cache.set("missing", {}, negative=True)
+    mock_time.return_value = 1100
+    assert cache.get("found") == {"bag": "found"}
+    assert cache.get("missing") is None
+    assert cache.stats()["expirations"] == 1
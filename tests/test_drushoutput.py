@@ -0,0 +1,72 @@
+import sys
+from os import listdir
+from subprocess import CalledProcessError
+
+import pytest
+from six import PY2
+
+if PY2:
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+from islandoraq.tasks.drushoutput import RingBuffer, stream_output, tail
+
+
+def script(source):
+    return [sys.executable, "-c", source]
+
+
+def test_ring_buffer_keeps_last_bytes():
+    buffer = RingBuffer(10)
+    for line in [b"aaaa\n", b"bbbb\n", b"cccc\n"]:
+        buffer.append(line)
+    assert buffer.size == 10
+    assert buffer.getvalue() == b"[5 earlier bytes dropped]\nbbbb\ncccc\n"
+
+
+def test_stream_output_bounds_memory():
+    output = stream_output(script("for i in range(1000): print('line %d' % i)"), shell=False, max_bytes=100)
+    assert output.endswith(b"line 999\n")
+    assert len(output.split(b"\n", 1)[1]) <= 100
+
+
+@patch('islandoraq.tasks.drushoutput.PROGRESS_INTERVAL', 0)
+def test_stream_output_reports_progress():
+    reports = []
+    source = "for i in range(1, 4): print('Ingested oku:%d.' % i)\nprint('Completed 5 of 6.')"
+    stream_output(script(source), shell=False, progress=lambda done, total: reports.append((done, total)), total=3)
+    assert reports[:3] == [(1, 3), (2, 3), (3, 3)]
+    assert reports[-1] == (5, 6)
+
+
+def test_stream_output_keeps_spill_file_on_error(tmp_path):
+    spill_dir = str(tmp_path / "spill")
+    with pytest.raises(CalledProcessError) as excinfo:
+        stream_output(script("print('x' * 50); raise SystemExit(3)"), shell=False, max_bytes=10, spill_dir=spill_dir)
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.output.endswith(b"xxxxxxxxx\n")
+    with open(excinfo.value.spill_path, "rb") as f:
+        assert f.read() == b"x" * 50 + b"\n"
+    stream_output(script("print('ok')"), shell=False, spill_dir=spill_dir)
+    assert len(listdir(spill_dir)) == 1
+
+
+def test_tail_reads_backward(tmp_path):
+    path = tmp_path / "celery.log"
+    path.write_text(u"".join(u"line {0}\n".format(i) for i in range(5000)))
+    assert tail(str(path), 3, block_size=16) == [u"line 4997\n", u"line 4998\n", u"line 4999\n"]
+    path.write_text(u"only\n")
+    assert tail(str(path), 5) == [u"only\n"]
+
+
+@patch('islandoraq.tasks.tasks.stream_output')
+def test_item_manipulator_error_tail(mock_stream_output, tmp_path, monkeypatch):
+    from islandoraq.tasks.tasks import read_item
+    log = tmp_path / "celery.log"
+    log.write_text(u"".join(u"log {0}\n".format(i) for i in range(20)))
+    monkeypatch.setenv("CELERY_LOG_FILE", str(log))
+    mock_stream_output.side_effect = CalledProcessError(1, "drush", output=b"boom")
+    response = read_item("abc", "oku", result_format="verbose")
+    assert response["Error"][1] == 1
+    assert response["Error"][3] == [u"log {0}\n".format(i) for i in range(15, 20)]
@@ -0,0 +1,124 @@
+import sys
+
+import pytest
+from six import PY2
+
+if PY2:
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+from islandoraq.tasks import drushworker
+from islandoraq.tasks.drushworker import DrushOperationError, DrushWorker, DrushWorkerError
+
+fake_helper = """
+import json, sys, time
+print("Drupal bootstrap notice")
+print(json.dumps({"ready": True}))
+sys.stdout.flush()
+for line in iter(sys.stdin.readline, ""):
+    request = json.loads(line)
+    if request["operation"] == "crash":
+        sys.exit(3)
+    if request["operation"] == "hang":
+        time.sleep(5)
+    print(json.dumps({"id": request["id"], "ok": request["operation"] != "bad",
+                      "output": "{0} {1}".format(request["operation"], request.get("pid"))}))
+    sys.stdout.flush()
+"""
+
+
+@pytest.fixture
+def worker(tmp_path):
+    script = tmp_path / "helper.py"
+    script.write_text(fake_helper)
+    worker = DrushWorker([sys.executable, str(script)], max_operations=3, timeout=10)
+    yield worker
+    worker.stop()
+
+
+def test_requests_share_one_process(worker):
+    assert worker.request("read", "oku:a")["output"] == "read oku:a"
+    process = worker.process
+    assert worker.request("delete", "oku:b") == {"id": 2, "ok": True, "output": "delete oku:b"}
+    assert worker.process is process
+
+
+def test_restart_after_max_operations(worker):
+    worker.request("read", "oku:a")
+    process = worker.process
+    for _ in range(3):
+        worker.request("read", "oku:a")
+    assert worker.process is not process
+    assert worker.operations == 1
+
+
+def test_crash_raises_and_restarts(worker):
+    with pytest.raises(DrushWorkerError) as excinfo:
+        worker.request("crash")
+    assert excinfo.value.sent
+    assert worker.process is None
+    assert worker.request("read", "oku:a")["ok"]
+
+
+def test_timeout_reports_the_operation_as_sent(worker):
+    worker.timeout = 0.2
+    with pytest.raises(DrushWorkerError) as excinfo:
+        worker.request("hang", "oku:a")
+    assert excinfo.value.sent
+    worker.command = ["/nonexistent/drush"]
+    with pytest.raises(DrushWorkerError) as excinfo:
+        worker.request("delete", "oku:a")
+    assert not excinfo.value.sent
+
+
+@patch('islandoraq.tasks.drushworker.get_worker')
+def test_run_returns_bytes_and_raises_operation_errors(mock_get_worker):
+    mock_get_worker.return_value.request.return_value = {"id": 1, "ok": True, "output": "oku:a\n"}
+    assert drushworker.run("/var/www", "read", "oku:a") == b"oku:a\n"
+    mock_get_worker.return_value.request.return_value = {"id": 2, "ok": False, "output": "", "error": "not found"}
+    with pytest.raises(DrushOperationError) as excinfo:
+        drushworker.run("/var/www", "read", "oku:gone")
+    assert excinfo.value.error == "not found"
+    assert not isinstance(excinfo.value, DrushWorkerError)
+
+
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.drushworker.run')
+@patch('islandoraq.tasks.tasks.drushworker.ENABLED', True)
+def test_item_operation_failure_is_not_rerun(mock_run, mock_stream_output):
+    from islandoraq.tasks.tasks import read_item
+    mock_run.side_effect = DrushOperationError("read", "oku:gone", b"not found", "not found")
+    response = read_item("gone", "oku", result_format="verbose")
+    assert response["Error"][1] == 1
+    assert not mock_stream_output.called
+
+    mock_run.side_effect = DrushWorkerError("helper exited")
+    mock_stream_output.return_value = b"oku:a"
+    assert read_item("a", "oku") == b"oku:a"
+    assert mock_stream_output.call_count == 1
+
+
+@patch('islandoraq.tasks.tasks.object_exists')
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.drushworker.run')
+@patch('islandoraq.tasks.tasks.drushworker.ENABLED', True)
+def test_delete_sent_to_helper_is_not_repeated(mock_run, mock_stream_output, mock_object_exists):
+    from islandoraq.tasks.tasks import delete_item
+    error = DrushWorkerError("Drush helper timed out after 300 seconds")
+    error.sent = True
+    mock_run.side_effect = error
+    mock_object_exists.return_value = False
+    assert delete_item("a", "oku")
+    mock_object_exists.assert_called_once_with("a", "oku", method="drush")
+    assert not mock_stream_output.called
+
+    mock_object_exists.return_value = True
+    mock_stream_output.return_value = b"deleted oku:a"
+    assert delete_item("a", "oku")
+    assert mock_stream_output.call_count == 1
+
+    mock_run.side_effect = DrushWorkerError("helper exited")
+    mock_object_exists.reset_mock()
+    assert delete_item("a", "oku")
+    assert not mock_object_exists.called
@@ -0,0 +1,72 @@
+from six import PY2
+
+if PY2:
+    from mock import Mock, patch
+else:
+    from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+from islandoraq.tasks import health, httpclient
+from islandoraq.tasks.health import CircuitBreaker, DependencyUnavailable
+from islandoraq.tasks.tasks import dependency_health, objects_exist
+
+
+@patch('islandoraq.tasks.health.time.time')
+def test_breaker_opens_and_recovers_half_open(mock_time):
+    mock_time.return_value = 1000
+    probe = Mock(return_value=True)
+    breaker = CircuitBreaker("solr", threshold=2, reset_timeout=30, probe=probe)
+    breaker.failure()
+    breaker.before()
+    breaker.failure()
+    assert breaker.state == health.OPEN
+    with pytest.raises(DependencyUnavailable) as err:
+        breaker.before()
+    assert err.value.retry_after == 30
+
+    mock_time.return_value = 1031
+    breaker.before()  # the one half-open trial
+    assert breaker.state == health.HALF_OPEN
+    with pytest.raises(DependencyUnavailable):
+        breaker.before()  # other calls wait for the trial
+    breaker.success()
+    assert breaker.state == health.CLOSED
+    assert probe.call_count == 1
+
+
+@patch('islandoraq.tasks.health.time.time')
+def test_breaker_stays_open_while_probe_fails(mock_time):
+    mock_time.return_value = 1000
+    breaker = CircuitBreaker("catalog", threshold=1, reset_timeout=30, probe=Mock(return_value=False))
+    breaker.failure()
+    mock_time.return_value = 1031
+    with pytest.raises(DependencyUnavailable):
+        breaker.before()
+    assert breaker.status()["state"] == health.OPEN
+    assert breaker.status()["healthy"] is False
+    assert breaker.opened == 1031
+
+
+def test_connection_errors_open_breaker_and_fail_fast():
+    httpclient.reset()
+    session = httpclient.session_for("http://localhost:8080/solr")
+    with patch.object(session, "request", side_effect=requests.ConnectionError()) as mock_request:
+        for attempt in range(health.FAILURE_THRESHOLD):
+            with pytest.raises(requests.ConnectionError):
+                httpclient.get("http://localhost:8080/solr/select")
+        with pytest.raises(DependencyUnavailable):
+            httpclient.get("http://localhost:8080/solr/select")
+        assert mock_request.call_count == health.FAILURE_THRESHOLD
+        assert dependency_health()["solr"]["state"] == health.OPEN
+
+
+def test_unavailable_dependency_defers_task():
+    health.breakers["solr"].failures = health.FAILURE_THRESHOLD - 1
+    health.breakers["solr"].failure()
+    with pytest.raises(DependencyUnavailable):
+        objects_exist(["a"], "oku")  # called directly fails fast
+    with patch.object(objects_exist, "retry", side_effect=Exception("retried")) as mock_retry:
+        objects_exist.apply(args=[["a"], "oku"])
+    assert mock_retry.call_args[1]["countdown"] == health.RESET_TIMEOUT
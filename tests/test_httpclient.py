@@ -0,0 +1,78 @@
+from six import PY2
+
+if PY2:
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+from islandoraq.tasks import httpclient
+
+
+def test_session_per_host():
+    httpclient.reset()
+    first = httpclient.session_for("https://bag.ou.edu/derivative/a.json")
+    assert httpclient.session_for("https://bag.ou.edu/derivative/b.json") is first
+    assert httpclient.session_for("https://cc.lib.ou.edu/api") is not first
+
+
+def test_sessions_dropped_after_fork():
+    httpclient.reset()
+    first = httpclient.session_for("http://localhost:8080/solr")
+    with patch("islandoraq.tasks.httpclient.getpid", return_value=-1):
+        assert httpclient.session_for("http://localhost:8080/solr") is not first
+
+
+def test_default_timeout_applied():
+    httpclient.reset()
+    session = httpclient.session_for("http://localhost:8080/solr")
+    with patch.object(session, "request") as mock_request:
+        httpclient.get("http://localhost:8080/solr")
+        mock_request.assert_called_once_with("GET", "http://localhost:8080/solr",
+                                             timeout=httpclient.TIMEOUT, allow_redirects=True)
+
+
+def test_probe_is_sent_once_within_its_timeout():
+    import socket
+    import threading
+    import time
+
+    import pytest
+    import requests
+
+    server = socket.socket()
+    server.bind(("127.0.0.1", 0))
+    server.listen(5)
+    port = server.getsockname()[1]
+    accepted = []
+
+    def hang():  # accept connections and never answer
+        while True:
+            try:
+                accepted.append(server.accept()[0])
+            except OSError:
+                return
+
+    thread = threading.Thread(target=hang)
+    thread.daemon = True
+    thread.start()
+    httpclient.reset()
+    try:
+        start = time.time()
+        with pytest.raises(requests.Timeout):
+            httpclient.probe("http://127.0.0.1:{0}/solr".format(port), timeout=(0.5, 0.5))
+        assert time.time() - start < 2
+        assert len(accepted) == 1
+    finally:
+        server.shutdown(socket.SHUT_RDWR)
+        server.close()
+        for connection in accepted:
+            connection.close()
+
+    closed = socket.socket()
+    closed.bind(("127.0.0.1", 0))
+    port = closed.getsockname()[1]
+    closed.close()
+    start = time.time()
+    with pytest.raises(requests.ConnectionError):
+        httpclient.probe("http://127.0.0.1:{0}/solr".format(port))
+    assert time.time() - start < 1
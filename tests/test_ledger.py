@@ -0,0 +1,31 @@
+from islandoraq.tasks import ledger
+
+
+def test_missing_checks_only_unrecorded_objects(ingest_ledger):
+    ledger.record_status("oku", "book", True, {"p1": True, "p2": False})
+    checked = []
+
+    def objects_exist(uuids, namespace):
+        checked.extend(uuids)
+        return dict((uuid, uuid == "p3") for uuid in uuids)
+
+    book_missing, pages = ledger.missing("oku", "book", ["p1", "p2", "p3"], objects_exist)
+    assert not book_missing
+    assert pages == set(["p2"])
+    assert checked == ["p2", "p3"]
+    assert ingest_ledger.ingested(["oku:p1", "oku:p2", "oku:p3"]) == set(["oku:p1", "oku:p3"])
+
+
+def test_missing_book():
+    book_missing, pages = ledger.missing("oku", "book", ["p1"], lambda uuids, namespace: {})
+    assert book_missing
+    assert pages == set(["p1"])
+
+
+def test_deleted_books_are_ingested_again(ingest_ledger):
+    ledger.record_status("oku", "book", True, {"p1": True, "p2": True})
+    ledger.record_deleted("oku", ["book"])
+    assert ingest_ledger.ingested(["oku:book", "oku:p1", "oku:p2"]) == set()
+    book_missing, pages = ledger.missing("oku", "book", ["p1", "p2"], lambda uuids, namespace: {})
+    assert book_missing
+    assert pages == set(["p1", "p2"])
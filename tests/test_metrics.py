@@ -0,0 +1,91 @@
+from six import PY2
+
+if PY2:
+    from mock import Mock, patch
+else:
+    from unittest.mock import Mock, patch
+
+import pytest
+
+from islandoraq.tasks import metrics
+from islandoraq.tasks.metrics import Counter, Histogram, Registry
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    metrics.registry.reset()
+    yield
+    metrics.registry.reset()
+
+
+def test_histogram_renders_cumulative_buckets():
+    registry = Registry()
+    histogram = registry.add(Histogram("latency_seconds", "Latency", ["dependency"], buckets=(0.1, 1)))
+    histogram.observe(0.05, dependency="solr")
+    histogram.observe(0.5, dependency="solr")
+    histogram.observe(5, dependency="solr")
+    text = registry.render()
+    assert 'latency_seconds_bucket{dependency="solr",le="0.1"} 1' in text
+    assert 'latency_seconds_bucket{dependency="solr",le="1"} 2' in text
+    assert 'latency_seconds_bucket{dependency="solr",le="+Inf"} 3' in text
+    assert 'latency_seconds_count{dependency="solr"} 3' in text
+    assert "# TYPE latency_seconds histogram" in text
+
+
+def test_counter_escapes_label_values():
+    counter = Counter("things_total", "Things", ["name"])
+    counter.inc(name='a "b"')
+    assert 'things_total{name="a \\"b\\""} 1' in counter.render()
+
+
+def test_timed_counts_errors_and_clears_in_flight():
+    with pytest.raises(ValueError):
+        with metrics.timed("drush", "read"):
+            assert metrics.dependency_in_flight.values[("drush",)] == 1
+            raise ValueError()
+    assert metrics.dependency_in_flight.values[("drush",)] == 0
+    assert metrics.dependency_errors.values[("drush", "read")] == 1
+    assert metrics.dependency_duration.values[("drush", "read")][-2] == 1
+
+
+def test_dependency_for_maps_hosts():
+    assert metrics.dependency_for("http://localhost:8080/solr/select") == "solr"
+    assert metrics.dependency_for("https://cc.lib.ou.edu/api/catalog/data/catalog/digital_objects/") == "catalog"
+    assert metrics.dependency_for("https://bag.ou.edu/derivative/book/recipe.json") == "recipe_host"
+
+
+def test_task_signals_record_duration_and_state():
+    task = Mock()
+    task.name = "islandoraq.tasks.tasks.add"
+    metrics._task_started(task_id="abc", task=task)
+    metrics._task_finished(task_id="abc", task=task, state="SUCCESS")
+    assert metrics.tasks_total.values[("islandoraq.tasks.tasks.add", "SUCCESS")] == 1
+    assert metrics.tasks_in_flight.values[("islandoraq.tasks.tasks.add",)] == 0
+    assert "abc" not in metrics._started
+
+
+@patch('islandoraq.tasks.tasks.httpclient.session_for')
+def test_http_requests_are_timed_per_dependency(mock_session_for):
+    from islandoraq.tasks import httpclient
+    httpclient.get("http://localhost:8080/solr/select")
+    assert metrics.dependency_duration.values[("solr", "GET")][-2] == 1
+
+
+def test_write_textfile(tmp_path):
+    metrics.record_ingest(10, 2)
+    path = str(tmp_path / "islandoraq_{pid}.prom")
+    metrics.write_textfile(path)
+    files = list(tmp_path.glob("*.prom"))
+    assert len(files) == 1
+    text = files[0].read_text()
+    assert "islandoraq_pages_ingested_total 10" in text
+    assert "islandoraq_ingest_pages_per_second 5.0" in text
+
+
+@patch('islandoraq.tasks.metrics._daemon')
+@patch('islandoraq.tasks.metrics.HTTPServer')
+@patch('islandoraq.tasks.metrics.PORT', 9400)
+def test_endpoint_binds_loopback_by_default(mock_server, mock_daemon):
+    metrics.start_exporters()
+    assert mock_server.call_args[0][0] == ("127.0.0.1", 9400)
+    assert mock_daemon.called
@@ -0,0 +1,69 @@
+import hashlib
+from os.path import exists
+
+from six import PY2
+
+if PY2:
+    from mock import Mock, patch
+else:
+    from unittest.mock import Mock, patch
+
+from islandoraq.tasks import prefetch
+
+
+def _response(body, status=200):
+    resp = Mock(status_code=status, headers={"Content-Length": str(len(body))})
+    resp.iter_content.return_value = [body]
+    return resp
+
+
+def _recipe():
+    return {"recipe": {"uuid": "book", "pages": [
+        {"uuid": "p1", "file": "https://bag.ou.edu/derivative/Tyler_2019/jpeg/data/001.jpg",
+         "md5": hashlib.md5(b"page one").hexdigest()},
+        {"uuid": "p2", "file": "data/002.jpg"},
+    ]}}
+
+
+@patch('islandoraq.tasks.prefetch.httpclient.get')
+def test_stage_pages_rewrites_local_files(mock_get, tmp_path):
+    mock_get.side_effect = lambda url, **kwargs: _response(b"page one" if url.endswith("001.jpg") else b"page two")
+    recipe = _recipe()
+    staged = prefetch.stage_pages(recipe, str(tmp_path), "https://bag.ou.edu/derivative/Tyler_2019/jpeg/tyler_2019.json")
+    files = [page["file"] for page in staged["recipe"]["pages"]]
+    assert all(path.startswith(str(tmp_path)) and exists(path) for path in files)
+    assert open(files[1], "rb").read() == b"page two"
+    assert recipe["recipe"]["pages"][1]["file"] == "data/002.jpg"  # original recipe untouched
+
+
+@patch('islandoraq.tasks.prefetch.httpclient.get')
+def test_stage_pages_keeps_remote_over_budget(mock_get, tmp_path):
+    mock_get.return_value = _response(b"page one")
+    staged = prefetch.stage_pages(_recipe(), str(tmp_path), budget=4)
+    assert staged["recipe"]["pages"][0]["file"] == "https://bag.ou.edu/derivative/Tyler_2019/jpeg/data/001.jpg"
+
+
+@patch('islandoraq.tasks.prefetch.httpclient.get')
+def test_download_resumes_partial(mock_get, tmp_path):
+    path = str(tmp_path / "001.jpg")
+    with open(path + ".part", "wb") as f:
+        f.write(b"page ")
+    mock_get.return_value = _response(b"one", status=206)
+    assert prefetch._download("https://bag.ou.edu/001.jpg", path, hashlib.md5(b"page one").hexdigest(),
+                              prefetch._Budget(100))
+    assert mock_get.call_args[1]["headers"] == {"Range": "bytes=5-"}
+    assert open(path, "rb").read() == b"page one"
+
+
+@patch('islandoraq.tasks.prefetch.httpclient.get')
+def test_retries_reuse_the_page_reservation(mock_get, tmp_path):
+    path = str(tmp_path / "001.jpg")
+    budget = prefetch._Budget(10)
+    mock_get.return_value = _response(b"page two")
+    assert not prefetch._download("https://bag.ou.edu/001.jpg", path, hashlib.md5(b"page one").hexdigest(), budget)
+    assert mock_get.call_count == prefetch.ATTEMPTS
+    assert budget.remaining == 10
+    assert not exists(path + ".part")
+    mock_get.return_value = _response(b"page one")
+    assert prefetch._download("https://bag.ou.edu/001.jpg", path, hashlib.md5(b"page one").hexdigest(), budget)
+    assert budget.remaining == 2
@@ -0,0 +1,100 @@
+from time import time
+
+import pytest
+from six import PY2
+
+if PY2:
+    from mock import patch
+else:
+    from unittest.mock import patch
+
+from islandoraq.tasks import preflight
+from islandoraq.tasks.tasks import preflight_status
+
+
+@pytest.fixture()
+def checks(monkeypatch):
+    """ replace the registered preflight checks """
+    monkeypatch.setattr(preflight, "checks", [])
+    monkeypatch.setattr(preflight, "results", {})
+    return preflight.checks
+
+
+def fail():
+    raise Exception("unreachable")
+
+
+def test_run_records_each_check(checks):
+    preflight.register("drush", lambda: "/usr/bin/drush")
+    preflight.register("solr", fail)
+    results = preflight.run()
+    assert results["drush"]["ok"] and results["drush"]["value"] == "/usr/bin/drush"
+    assert not results["solr"]["ok"]
+    assert results["solr"]["error"] == "unreachable"
+
+
+def test_start_runs_in_background(checks):
+    preflight.register("group", lambda: 48)
+    preflight.start()
+    status = preflight_status(wait=5)
+    assert not status["running"]
+    assert status["checks"]["group"]["value"] == 48
+
+
+@patch('islandoraq.tasks.preflight._drush', None)
+@patch('islandoraq.tasks.preflight.which')
+def test_find_drush(mock_which):
+    mock_which.return_value = None
+    with pytest.raises(Exception):
+        preflight.find_drush()
+    mock_which.return_value = "/usr/local/bin/drush"
+    assert preflight.find_drush() == "/usr/local/bin/drush"
+
+
+@patch('islandoraq.tasks.preflight._drush', None)
+@patch('islandoraq.tasks.tasks.check_output')
+@patch('islandoraq.tasks.preflight.which')
+def test_drush_commands_use_resolved_path(mock_which, mock_check_output):
+    from islandoraq.tasks.tasks import object_exists
+    mock_which.return_value = "/opt/drush 8/drush"
+    mock_check_output.return_value = b"object"
+    assert object_exists("book", "oku", method="drush")
+    assert object_exists("book", "oku", method="drush")
+    assert mock_check_output.call_args[0][0].startswith("'/opt/drush 8/drush' -u 1 iim --pid=oku:book")
+    assert mock_which.call_count == 1
+
+
+def test_warmed_state_survives_worker_process_init(checks, monkeypatch):
+    from celery.signals import worker_process_init
+    from islandoraq.tasks import health, httpclient, metrics, workspace
+    monkeypatch.setattr(metrics, "start_exporters", lambda: None)
+    monkeypatch.setattr(workspace, "sweep", lambda: 0)
+    events = []
+
+    def recorded(module, name):
+        function = getattr(module, name)
+
+        def wrapper(*args, **kwargs):
+            events.append(name)
+            return function(*args, **kwargs)
+        monkeypatch.setattr(module, name, wrapper)
+
+    recorded(health, "reset")
+    recorded(httpclient, "reset")
+    recorded(preflight, "start")
+
+    def warm():
+        httpclient.session_for("http://localhost:8080/solr")
+        health.breakers["solr"]._probed = (time() + 60, True)
+        return True
+
+    preflight.register("warm", warm)
+    worker_process_init.send(sender=None)
+    assert events == ["reset", "reset", "start"]
+    assert preflight.status(wait=5)["checks"]["warm"]["ok"]
+    assert ("http", "localhost:8080", False) in httpclient._sessions
+    assert health.breakers["solr"].status()["healthy"] is True
+
+
+def test_tasks_register_checks():
+    assert [name for name, check in preflight.checks] == ["drush", "workspace_group", "solr", "catalog"]
@@ -0,0 +1,63 @@
+from os import listdir
+
+from six import PY2
+
+if PY2:
+    from mock import Mock, patch
+else:
+    from unittest.mock import Mock, patch
+
+import pytest
+
+from islandoraq.tasks.recipecache import RecipeCache, RecipeError
+
+url = "https://bag.ou.edu/derivative/Tyler_2019/jpeg_040_antialias/tyler_2019.json"
+body = b'{"recipe": {"uuid": "book", "pages": [{"uuid": "p1"}, {"uuid": "p2"}]}}'
+
+
+def _response(status=200, content=body):
+    return Mock(status_code=status, headers={"ETag": '"abc"'}, iter_content=Mock(return_value=[content]))
+
+
+@patch('islandoraq.tasks.recipecache.httpclient.get')
+def test_fetch_extracts_uuids_and_serves_from_memory(mock_get, tmp_path):
+    mock_get.return_value = _response()
+    cache = RecipeCache(directory=str(tmp_path))
+    entry = cache.fetch(url)
+    assert entry["book_uuid"] == "book"
+    assert entry["page_uuids"] == ["p1", "p2"]
+    assert cache.fetch(url) is entry
+    assert mock_get.call_count == 1
+
+
+@patch('islandoraq.tasks.recipecache.httpclient.get')
+def test_fetch_revalidates_from_disk_tier(mock_get, tmp_path):
+    mock_get.return_value = _response()
+    RecipeCache(directory=str(tmp_path), max_age=0).fetch(url)
+
+    mock_get.return_value = _response(status=304, content=b"")
+    entry = RecipeCache(directory=str(tmp_path), max_age=0).fetch(url)
+    assert mock_get.call_args[1]["headers"] == {"If-None-Match": '"abc"'}
+    assert entry["book_uuid"] == "book"
+    with RecipeCache(directory=str(tmp_path)).open(entry) as f:
+        assert f.read() == body
+
+
+@patch('islandoraq.tasks.recipecache.httpclient.get')
+def test_fetch_error_not_cached(mock_get, tmp_path):
+    mock_get.return_value = _response(status=404)
+    cache = RecipeCache(directory=str(tmp_path))
+    with pytest.raises(RecipeError):
+        cache.fetch(url)
+    with pytest.raises(RecipeError):
+        cache.fetch(url)
+    assert mock_get.call_count == 2
+
+
+@patch('islandoraq.tasks.recipecache.httpclient.get')
+def test_disk_tier_evicts_to_size(mock_get, tmp_path):
+    cache = RecipeCache(directory=str(tmp_path), max_bytes=len(body) + 10)
+    for index in range(3):
+        mock_get.return_value = _response(content=body.replace(b"book", "book{0}".format(index).encode("utf-8")))
+        cache.fetch("{0}?v={1}".format(url, index))
+    assert len(listdir(str(tmp_path / "objects"))) == 1
@@ -0,0 +1,37 @@
+import io
+from json import loads
+
+import pytest
+
+from islandoraq.tasks.recipestream import iter_recipe, write_recipe
+
+body = (b'{"recipe": {"uuid": "book", "label": "Caf\xc3\xa9 1.5e3", "size": 1.5e3, '
+        b'"pages": [{"uuid": "p1", "file": "001.jpg"}, {"uuid": "p2", "file": "002.jpg"}], "update": false}}')
+
+
+def _fields(chunks):
+    return [(key, list(value) if key == "pages" else value) for key, value in iter_recipe(chunks)]
+
+
+def test_iter_recipe_across_chunk_boundaries():
+    expected = list(loads(body.decode("utf-8"))["recipe"].items())
+    for size in (1, 3, 7, len(body)):
+        assert _fields(body[i:i + size] for i in range(0, len(body), size)) == expected
+
+
+def test_iter_recipe_drains_unread_pages():
+    fields = [key for key, value in iter_recipe([body])]
+    assert fields == ["uuid", "label", "size", "pages", "update"]
+
+
+def test_iter_recipe_rejects_non_recipe():
+    with pytest.raises(ValueError):
+        list(iter_recipe([b'{"count": 0, "results": []}']))
+
+
+def test_write_recipe_transforms_pages():
+    out = io.StringIO()
+    write_recipe(out, iter_recipe([body]), lambda pages: (dict(page, file="/tmp/" + page["file"]) for page in pages))
+    recipe = loads(out.getvalue())
+    assert recipe["recipe"]["uuid"] == "book"
+    assert [page["file"] for page in recipe["recipe"]["pages"]] == ["/tmp/001.jpg", "/tmp/002.jpg"]
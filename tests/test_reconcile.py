@@ -0,0 +1,69 @@
+from json import dumps
+
+from six import PY2
+
+if PY2:
+    from mock import Mock, patch
+else:
+    from unittest.mock import Mock, patch
+
+from islandoraq.tasks import reconcile
+from islandoraq.tasks.reconcile import PidSet, solr_pids
+from islandoraq.tasks.tasks import reconcile_collection
+
+
+@patch('islandoraq.tasks.reconcile.SORT_CHUNK', 3)
+def test_pid_set_merges_sorted_chunks():
+    pids = ["oku:{0}".format(i) for i in range(10)] + ["oku:3", "oku:7"]
+    pid_set = PidSet()
+    for pid in pids:
+        pid_set.add(pid)
+    pid_set.freeze()
+    assert len(pid_set) == 10
+    assert list(pid_set.hashes) == sorted(pid_set.hashes)
+    assert "oku:9" in pid_set
+    assert "oku:10" not in pid_set
+
+
+def test_reconcile_counts_missing_and_orphaned():
+    actual = ["oku:book", "oku:p1", "oku:stray1", "oku:stray2"]
+    expected = ["oku:book", "oku:p1", "oku:p2", "oku:p2"]
+    report = reconcile.reconcile(lambda: iter(actual), iter(expected), max_report=1)
+    assert report["objects"] == 4
+    assert report["expected"] == 3
+    assert report["missing_count"] == 1
+    assert report["missing"] == ["oku:p2"]
+    assert report["orphaned_count"] == 2
+    assert report["orphaned"] == ["oku:stray1"]
+    assert report["truncated"] is True
+
+
+def _solr_page(pids, cursor):
+    return Mock(text=dumps({"response": {"docs": [{"PID": pid} for pid in pids]}, "nextCursorMark": cursor}))
+
+
+def test_solr_pids_follows_cursor():
+    get = Mock(side_effect=[_solr_page(["oku:a", "oku:b"], "AoE1"), _solr_page(["oku:c"], "AoE2"),
+                            _solr_page([], "AoE2")])
+    assert list(solr_pids(get, "http://localhost:8080/solr/select", "oku", rows=2)) == ["oku:a", "oku:b", "oku:c"]
+    assert [call[1]["params"]["cursorMark"] for call in get.call_args_list] == ["*", "AoE1", "AoE2"]
+    assert get.call_args[1]["params"]["q"] == "PID:oku\\:*"
+
+
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_reconcile_collection(mock_get):
+    recipe = b'{"recipe": {"uuid": "book", "pages": [{"uuid": "p1"}, {"uuid": "p2"}]}}'
+
+    def get(url, **kwargs):
+        if url.endswith("/select"):
+            return _solr_page(["oku:book", "oku:p1", "oku:hos"], "*")
+        if url.endswith("missing.json"):
+            return Mock(status_code=404, headers={})
+        return Mock(status_code=200, headers={}, iter_content=Mock(return_value=[recipe]))
+    mock_get.side_effect = get
+
+    report = reconcile_collection("oku", ["https://bag.ou.edu/book.json", "https://bag.ou.edu/missing.json"])
+    assert report["recipes"] == 2
+    assert report["missing"] == ["oku:p2"]
+    assert report["orphaned"] == ["oku:hos"]
+    assert list(report["recipe_errors"]) == ["https://bag.ou.edu/missing.json"]
@@ -0,0 +1,46 @@
+import os
+import time
+
+from islandoraq.tasks.results import FileStore, error_code, load_detail, save_detail
+
+
+def test_error_codes():
+    assert error_code("Server status 404") == "http_404"
+    assert error_code("Drush status 1") == "drush_1"
+    assert error_code("Request error Connection refused") == "request_error"
+    assert error_code("Invalid recipe: https://bag.ou.edu/a.json") == "invalid_recipe"
+    assert error_code(KeyError("recipe")) == "KeyError"
+
+
+def test_detail_round_trip_is_json_safe(tmp_path):
+    store = FileStore(str(tmp_path))
+    reference = save_detail("ingest_recipe", {"Failures": [["a", ValueError("bad")]], "output": b"drush"}, store)
+    assert reference.startswith("file@")
+    detail = load_detail(reference, store)["detail"]
+    assert detail == {"Failures": [["a", "ValueError: bad"]], "output": "drush"}
+
+
+def test_load_detail_rejects_paths(tmp_path):
+    store = FileStore(str(tmp_path))
+    assert load_detail("file:../../etc/passwd", store) is None
+    assert load_detail("mongodb:" + "0" * 32, store) is None
+
+
+def test_file_store_evicts_expired_and_oldest(tmp_path):
+    directory = tmp_path / "store"
+    store = FileStore(str(directory), max_bytes=20, retention=3600)
+    for key, age in (("a" * 32, 7200), ("b" * 32, 20), ("c" * 32, 10)):
+        store.save(key, {"value": "x"})
+        path = str(directory / (key + ".json"))
+        os.utime(path, (time.time() - age, time.time() - age))
+    store.evict()
+    assert os.listdir(str(directory)) == ["c" * 32 + ".json"]
+
+
+def test_file_references_name_their_host(tmp_path):
+    store = FileStore(str(tmp_path), host="worker1")
+    reference = save_detail("ingest_recipe", {"Successful": 1}, store)
+    assert reference.startswith("file@worker1:")
+    assert load_detail(reference, store)["detail"] == {"Successful": 1}
+    assert load_detail(reference, FileStore(str(tmp_path), host="worker2")) is None
+    assert load_detail(reference.replace("@worker1", ""), store)["detail"] == {"Successful": 1}
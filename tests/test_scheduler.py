@@ -0,0 +1,184 @@
+from six import PY2
+
+if PY2:
+    from mock import Mock, patch
+else:
+    from unittest.mock import Mock, patch
+
+from islandoraq.tasks import scheduler
+from islandoraq.tasks.tasks import (dispatch_ingests, finish_scheduled_ingest, ingest_queue_stats,
+                                    reclaim_scheduled_ingest, submit_ingest)
+
+recipe_url = "https://bag.ou.edu/derivative/Abbey_1234/jpeg_040_antialias/abbey_1234.json"
+
+
+def test_size_class_by_pages():
+    assert scheduler.size_class(0) == "small"
+    assert scheduler.size_class(300) == "small"
+    assert scheduler.size_class(301) == "medium"
+    assert scheduler.size_class(100000) == "large"
+    assert scheduler.queue_for("large") == "islandora_large"
+
+
+def test_backlog_limits_running_jobs_per_class(backlog):
+    for i in range(6):
+        backlog.submit("small{0}".format(i), "oku:hos", "oku", None, 10)
+    backlog.submit("large", "oku:hos", "oku", None, 5000)
+    jobs = backlog.next_jobs()
+    assert [job["size_class"] for job in jobs] == ["small"] * 4 + ["large"]
+    assert backlog.next_jobs() == []
+    backlog.finish(jobs[0]["id"], True, 5)
+    assert [job["recipe_url"] for job in backlog.next_jobs()] == ["small4"]
+
+
+def test_backlog_is_fair_across_flows(backlog):
+    for i in range(4):
+        backlog.submit("alice{0}".format(i), "oku:hos", "oku", "alice", 100)
+    backlog.submit("bob0", "oku:hos", "oku", "bob", 100)
+    backlog.submit("bob1", "oku:hos", "oku", "bob", 100)
+    order = []
+    while True:
+        jobs = backlog.next_jobs()
+        if not jobs:
+            break
+        for job in jobs:
+            order.append(job["recipe_url"])
+            backlog.finish(job["id"], True, 1)
+    assert order[:4] == ["alice0", "bob0", "alice1", "bob1"]
+
+
+@patch('islandoraq.tasks.scheduler.WEIGHTS', {"bob": 3})
+def test_backlog_weights_flows(backlog):
+    for i in range(6):
+        backlog.submit("alice{0}".format(i), "oku:hos", "oku", "alice", 100)
+        backlog.submit("bob{0}".format(i), "oku:hos", "oku", "bob", 100)
+    first = [job["recipe_url"] for job in backlog.next_jobs()]
+    assert sorted(first) == ["alice0", "bob0", "bob1", "bob2"]
+
+
+def test_backlog_stats_estimate_drain(backlog):
+    job_id, name = backlog.submit("a", "oku:hos", "oku", "alice", 100)
+    backlog.submit("b", "oku:hos", "oku", "alice", 200)
+    backlog.submit("c", "oku:hos", "oku", "alice", 200)
+    backlog.submit("d", "oku:hos", "oku", "alice", 200)
+    backlog.submit("e", "oku:hos", "oku", "alice", 200)
+    backlog.next_jobs()
+    backlog.finish(job_id, True, 10)
+    small = backlog.stats()["small"]
+    assert small["queued"] == 1
+    assert small["queued_pages"] == 200
+    assert small["running"] == 3
+    assert small["pages_per_second"] == 10.0
+    assert small["queued_by_flow"] == {"oku:hos alice": 1}
+    assert 0 < small["estimated_drain_seconds"] <= (200 + 600) / 40.0
+    assert backlog.stats()["large"]["estimated_drain_seconds"] is None
+
+
+@patch('islandoraq.tasks.scheduler.STALE_AFTER', -1)
+def test_backlog_frees_slots_of_lost_jobs(backlog):
+    backlog.submit("a", "oku:hos", "oku", None, 5000)
+    backlog.submit("b", "oku:hos", "oku", None, 5000)
+    assert [job["recipe_url"] for job in backlog.next_jobs()] == ["a"]
+    assert [job["recipe_url"] for job in backlog.next_jobs()] == ["b"]
+
+
+@patch('islandoraq.tasks.scheduler.STALE_AFTER', 60)
+@patch('islandoraq.tasks.scheduler.time')
+def test_heartbeats_keep_running_jobs(mock_time, backlog):
+    mock_time.time.return_value = 1000.0
+    first, _ = backlog.submit("a", "oku:hos", "oku", None, 5000)
+    backlog.submit("b", "oku:hos", "oku", None, 5000)
+    assert [job["recipe_url"] for job in backlog.next_jobs()] == ["a"]
+    mock_time.time.return_value = 1050.0
+    assert backlog.heartbeat(first)
+    mock_time.time.return_value = 1100.0
+    assert backlog.next_jobs() == []
+    mock_time.time.return_value = 1200.0
+    assert [job["recipe_url"] for job in backlog.next_jobs()] == ["b"]
+    assert not backlog.heartbeat(first)
+
+
+@patch('islandoraq.tasks.tasks.heartbeat_scheduled_ingest')
+@patch('islandoraq.tasks.tasks.finish_scheduled_ingest')
+@patch('islandoraq.tasks.tasks._verify_and_catalog')
+@patch('islandoraq.tasks.tasks.ingest_recipe')
+def test_scheduled_ingest_heartbeats_and_resumes_when_redelivered(mock_ingest, mock_verify, mock_finish,
+                                                                   mock_heartbeat):
+    from islandoraq.tasks.tasks import scheduled_ingest
+    mock_ingest.return_value = {"Successful": 1, "Failures": []}
+    scheduled_ingest.apply((7, recipe_url, "oku:hos", "oku"))
+    assert mock_ingest.call_args[1]["resume"] is None
+    scheduled_ingest.apply((7, recipe_url, "oku:hos", "oku"), {"resume": True})
+    assert mock_ingest.call_args[1]["resume"] is True
+    mock_heartbeat.delay.assert_called_with(7)
+    assert mock_finish.delay.call_args[0][:2] == (7, True)
+    assert scheduled_ingest.acks_late and scheduled_ingest.reject_on_worker_lost
+
+
+@patch('islandoraq.tasks.tasks.scheduled_ingest')
+@patch('islandoraq.tasks.tasks._recipe_uuids')
+def test_submit_ingest_routes_to_size_class_queue(mock_uuids, mock_ingest, backlog):
+    mock_uuids.return_value = ("book", ["page{0}".format(i) for i in range(400)])
+    mock_ingest.apply_async.return_value = Mock(id="task-1")
+    result = submit_ingest(recipe_url, "oku:hos", submitter="alice")
+    assert result == {"job": 1, "pages": 400, "size_class": "medium", "queue": "islandora_medium"}
+    args, kwargs = mock_ingest.apply_async.call_args
+    assert args[0] == (1, recipe_url, "oku:hos", "oku")
+    assert kwargs["queue"] == "islandora_medium"
+    assert ingest_queue_stats()["medium"]["running"] == 1
+
+
+@patch('islandoraq.tasks.tasks.scheduled_ingest')
+def test_finish_scheduled_ingest_dispatches_next(mock_ingest, backlog):
+    mock_ingest.apply_async.return_value = Mock(id="task")
+    first, _ = backlog.submit("a", "oku:hos", "oku", None, 5000)
+    backlog.submit("b", "oku:hos", "oku", None, 5000)
+    assert dispatch_ingests() == [first]
+    assert finish_scheduled_ingest(first, True, 50) == [first + 1]
+    assert backlog.stats()["large"]["pages_per_second"] == 100.0
+
+
+@patch('islandoraq.tasks.tasks.reclaim_scheduled_ingest')
+@patch('islandoraq.tasks.tasks.ingest_recipe')
+def test_redelivered_scheduled_ingest_reclaims_its_slot(mock_ingest, mock_reclaim):
+    from islandoraq.tasks.tasks import scheduled_ingest
+    scheduled_ingest.push_request(delivery_info={"redelivered": True})
+    try:
+        assert scheduled_ingest.run(7, recipe_url, "oku:hos", "oku") is None
+    finally:
+        scheduled_ingest.pop_request()
+    mock_reclaim.delay.assert_called_once_with(7)
+    assert not mock_ingest.called
+
+
+@patch('islandoraq.tasks.tasks.scheduled_ingest')
+@patch('islandoraq.tasks.scheduler.STALE_AFTER', 60)
+@patch('islandoraq.tasks.scheduler.time')
+def test_lost_job_redelivered_waits_for_a_free_slot(mock_time, mock_ingest, backlog):
+    mock_ingest.apply_async.return_value = Mock(id="task")
+    mock_time.time.return_value = 1000.0
+    first, _ = backlog.submit("a", "oku:hos", "oku", None, 5000)
+    second, _ = backlog.submit("b", "oku:hos", "oku", None, 5000)
+    assert dispatch_ingests() == [first]
+    mock_time.time.return_value = 1100.0
+    assert dispatch_ingests() == [second]
+    assert reclaim_scheduled_ingest(first) == []
+    assert mock_ingest.apply_async.call_count == 2
+    assert backlog.stats()["large"]["running"] == 1
+    assert backlog.stats()["large"]["queued"] == 1
+    finish_scheduled_ingest(second, True, 50)
+    args, kwargs = mock_ingest.apply_async.call_args
+    assert args == ((first, "a", "oku:hos", "oku"), {"submission": None, "resume": True})
+    assert backlog.stats()["large"]["running"] == 1
+
+
+@patch('islandoraq.tasks.tasks.scheduled_ingest')
+def test_redelivered_job_keeps_a_slot_it_still_holds(mock_ingest, backlog):
+    mock_ingest.apply_async.return_value = Mock(id="task")
+    first, _ = backlog.submit("a", "oku:hos", "oku", None, 5000)
+    backlog.submit("b", "oku:hos", "oku", None, 5000)
+    assert dispatch_ingests() == [first]
+    assert reclaim_scheduled_ingest(first) == []
+    args, kwargs = mock_ingest.apply_async.call_args
+    assert args[1]["resume"] is True
+    assert backlog.stats()["large"]["running"] == 1
@@ -0,0 +1,91 @@
+from six import PY2
+
+if PY2:
+    from mock import MagicMock, Mock, patch
+else:
+    from unittest.mock import MagicMock, Mock, patch
+
+import pytest
+
+from islandoraq.tasks import submissions
+from islandoraq.tasks.submissions import MemoryRegistry, submission_key
+from islandoraq.tasks.tasks import ingest_and_verify, release_submission, submission_status
+
+recipe_url = "https://bag.ou.edu/derivative/Abbey_1234/jpeg_040_antialias/abbey_1234.json"
+
+
+def test_submission_key():
+    assert submission_key(recipe_url) == "Abbey_1234/jpeg_040_antialias"
+
+
+def test_claim_is_exclusive_until_released():
+    registry = MemoryRegistry()
+    assert registry.claim("bag/params", "a")[0]
+    claimed, record = registry.claim("bag/params", "b")
+    assert not claimed
+    assert record["owner"] == "a"
+    assert not registry.release("bag/params", "b")
+    assert registry.release("bag/params", "a")
+    assert registry.claim("bag/params", "b")[0]
+
+
+def test_expired_lease_can_be_claimed():
+    registry = MemoryRegistry()
+    registry.claim("bag/params", "a", lease=-1)
+    assert registry.get("bag/params") is None
+    assert registry.claim("bag/params", "b")[0]
+    assert not registry.release("bag/params", "a")
+
+
+@patch('islandoraq.tasks.tasks.ingest_recipe')
+def test_duplicate_submission_attaches_to_running_chain(mock_ingest, submission_registry):
+    chain = MagicMock()
+    chain.return_value = Mock(id="chain-1")
+    mock_ingest.s.return_value.__or__.return_value = chain
+
+    assert ingest_and_verify(recipe_url) == "Kicked off tasks to ingest recipe and verify ingest"
+    assert ingest_and_verify(recipe_url) == "Recipe already submitted, attached to running ingest chain-1"
+    assert chain.call_count == 1
+    assert chain.on_error.called
+    assert submission_status(recipe_url)["task_id"] == "chain-1"
+
+    owner = submission_registry.get("Abbey_1234/jpeg_040_antialias")["owner"]
+    assert release_submission("Abbey_1234/jpeg_040_antialias", owner)
+    assert submission_status(recipe_url) is None
+    ingest_and_verify(recipe_url)
+    assert chain.call_count == 2
+
+
+@patch('islandoraq.tasks.tasks.ingest_recipe')
+def test_failed_start_releases_claim(mock_ingest):
+    chain = MagicMock(side_effect=IOError("broker down"))
+    mock_ingest.s.return_value.__or__.return_value = chain
+    try:
+        ingest_and_verify(recipe_url)
+    except IOError:
+        pass
+    assert submission_status(recipe_url) is None
+
+
+@patch('islandoraq.tasks.tasks.ingest_recipe')
+def test_claim_released_by_another_worker_process(mock_ingest, submission_registry, monkeypatch):
+    chain = MagicMock()
+    chain.return_value = Mock(id="chain-1")
+    mock_ingest.s.return_value.__or__.return_value = chain
+    ingest_and_verify(recipe_url)
+    owner = submission_registry.get("Abbey_1234/jpeg_040_antialias")["owner"]
+
+    # the chain ends in another worker process with its own registry on the same store
+    monkeypatch.setattr(submissions, "_registry", MemoryRegistry(submission_registry._claims))
+    assert release_submission("Abbey_1234/jpeg_040_antialias", owner)
+    monkeypatch.setattr(submissions, "_registry", submission_registry)
+    assert submission_status(recipe_url) is None
+    assert ingest_and_verify(recipe_url) == "Kicked off tasks to ingest recipe and verify ingest"
+    assert chain.call_count == 2
+
+
+def test_registry_needs_a_shared_store(monkeypatch):
+    monkeypatch.setattr(submissions, "_registry", None)
+    monkeypatch.setattr(submissions, "MONGO_URI", None)
+    with pytest.raises(Exception):
+        submissions.get_registry()
@@ -1,5 +1,6 @@
 import sys
 from os.path import exists
+from json import loads
 
 from six import PY2
 
@@ -11,7 +12,7 @@ else:
 
 import pytest
 
-from islandoraq.tasks.tasks import verify_solr_up, searchcatalog, updatecatalog, ingest_status, ingest_recipe
+from islandoraq.tasks.tasks import verify_solr_up, searchcatalog, updatecatalog, ingest_status, ingest_recipe, objects_exist
 from requests.exceptions import HTTPError
 
 
@@ -22,7 +23,7 @@ mock_path = patch("islandoraq.tasks.tasks.PATH", return_value="/tmp").start()
 mock_cybercommons_token = patch("islandoraq.tasks.tasks.CYBERCOMMONS_TOKEN", return_value="test").start()
 
 
-@patch('islandoraq.tasks.tasks.requests.get')
+@patch('islandoraq.tasks.tasks.httpclient.get')
 def test_searchcatalog_not_found(mock_get):
     not_found = """
     {
@@ -43,7 +44,7 @@ def test_searchcatalog_not_found(mock_get):
     assert response == {}
 
 
-@patch('islandoraq.tasks.tasks.requests.get')
+@patch('islandoraq.tasks.tasks.httpclient.get')
 def test_searchcatalog_found(mock_get):
     found = """
     {
@@ -109,7 +110,7 @@ def test_searchcatalog_found(mock_get):
     assert response['project'] == 'fake_bag'
 
 
-@patch('islandoraq.tasks.tasks.requests.post')
+@patch('islandoraq.tasks.tasks.httpclient.post')
 @patch('islandoraq.tasks.tasks.searchcatalog')
 def test_updatecatalog_success(mock_search, mock_post):
     mock_search.return_value = {"bag": "Tyler_2019", "project": "fake_bag"}
@@ -118,7 +119,7 @@ def test_updatecatalog_success(mock_search, mock_post):
     assert response == True
 
 
-@patch('islandoraq.tasks.tasks.requests.post')
+@patch('islandoraq.tasks.tasks.httpclient.post')
 @patch('islandoraq.tasks.tasks.searchcatalog')
 def test_updatecatalog_fail_not_in_catalog(mock_search, mock_post):
     mock_search.return_value = {}
@@ -128,7 +129,7 @@ def test_updatecatalog_fail_not_in_catalog(mock_search, mock_post):
 
 
 @pytest.mark.skip(reason="Need to test for exceeded retries")
-@patch('islandoraq.tasks.tasks.requests.post')
+@patch('islandoraq.tasks.tasks.httpclient.post')
 @patch('islandoraq.tasks.tasks.searchcatalog')
 @patch('islandoraq.tasks.tasks.app.Task.retry')
 def test_updatecatalog_fail_server_500(mock_retry, mock_search, mock_post):
@@ -138,12 +139,10 @@ def test_updatecatalog_fail_server_500(mock_retry, mock_search, mock_post):
     assert mock_retry.called
 
 
-@patch('islandoraq.tasks.tasks.grp.getgrnam')
-@patch('islandoraq.tasks.tasks.chown')
-@patch('islandoraq.tasks.tasks.mkdtemp')
-@patch('islandoraq.tasks.tasks.rmtree')
-@patch('islandoraq.tasks.tasks.check_output')
-def test_ingest_recipe_with_recipe_object(mock_check_output, mock_rmtree, mock_mkdtemp, mock_chown, mock_getgrnam, tmp_path):
+@patch('islandoraq.tasks.tasks.workspace.acquire')
+@patch('islandoraq.tasks.tasks.workspace.release')
+@patch('islandoraq.tasks.tasks.stream_output')
+def test_ingest_recipe_with_recipe_object(mock_stream_output, mock_release, mock_acquire, tmp_path):
     recipe = {
         "recipe": {
             "uuid": "test", 
@@ -170,7 +169,7 @@ def test_ingest_recipe_with_recipe_object(mock_check_output, mock_rmtree, mock_m
             ]
         }
     }
-    mock_mkdtemp.return_value = str(tmp_path)
+    mock_acquire.return_value = str(tmp_path)
     ingest_recipe(recipe)
     
     if PY2:
@@ -181,18 +180,17 @@ def test_ingest_recipe_with_recipe_object(mock_check_output, mock_rmtree, mock_m
     assert exists(recipe_file)
 
 
-@patch('islandoraq.tasks.tasks.grp.getgrnam')
-@patch('islandoraq.tasks.tasks.chown')
-@patch('islandoraq.tasks.tasks.mkdtemp')
-@patch('islandoraq.tasks.tasks.rmtree')
-@patch('islandoraq.tasks.tasks.check_output')
-@patch('islandoraq.tasks.tasks.requests.get')
-def test_ingest_recipe_with_url(mock_requests_get, mock_check_output, mock_rmtree, mock_mkdtemp, mock_chown, mock_getgrnam, tmp_path):
+@patch('islandoraq.tasks.tasks.workspace.acquire')
+@patch('islandoraq.tasks.tasks.workspace.release')
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_ingest_recipe_with_url(mock_requests_get, mock_stream_output, mock_release, mock_acquire, tmp_path):
     recipe = "https://test.somesite.com/nonexistent_path/test.json"
     
-    mock_requests_get.return_value = Mock(status_code=200, content={"recipe": {"uuid": "test"}})
+    mock_requests_get.return_value = Mock(status_code=200, headers={},
+                                          iter_content=Mock(return_value=[b'{"recipe": {"uuid": "test"}}']))
 
-    mock_mkdtemp.return_value = str(tmp_path)
+    mock_acquire.return_value = str(tmp_path)
     ingest_recipe(recipe)
     
     if PY2:
@@ -203,19 +201,17 @@ def test_ingest_recipe_with_url(mock_requests_get, mock_check_output, mock_rmtre
     assert exists(recipe_file)
 
 
-@patch('islandoraq.tasks.tasks.grp.getgrnam')
-@patch('islandoraq.tasks.tasks.chown')
-@patch('islandoraq.tasks.tasks.mkdtemp')
-@patch('islandoraq.tasks.tasks.rmtree')
-@patch('islandoraq.tasks.tasks.check_output')
-@patch('islandoraq.tasks.tasks.requests.get')
-def test_ingest_recipe_with_url_404(mock_requests_get, mock_check_output, mock_rmtree, mock_mkdtemp, mock_chown, mock_getgrnam, tmp_path):
+@patch('islandoraq.tasks.tasks.workspace.acquire')
+@patch('islandoraq.tasks.tasks.workspace.release')
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_ingest_recipe_with_url_404(mock_requests_get, mock_stream_output, mock_release, mock_acquire, tmp_path):
     recipe = "https://test.somesite.com/nonexistent_path/test.json"
     
     mock_requests_get.return_value = Mock(status_code=404, content={"recipe": {"uuid": "test"}})
 
-    mock_mkdtemp.return_value = str(tmp_path)
-    results = ingest_recipe(recipe)
+    mock_acquire.return_value = str(tmp_path)
+    results = ingest_recipe(recipe, result_format="verbose")
     
     if PY2:
         recipe_file = join(str(tmp_path), "cc_recipe.json")
@@ -225,7 +221,28 @@ def test_ingest_recipe_with_url_404(mock_requests_get, mock_check_output, mock_r
     assert results == {'Failures': [[recipe, 'Server status 404']], 'Successful': []}
 
 
-@patch('islandoraq.tasks.tasks.requests.get')
+@patch('islandoraq.tasks.tasks.workspace.acquire')
+@patch('islandoraq.tasks.tasks.workspace.release')
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_ingest_recipe_compact_result(mock_requests_get, mock_stream_output, mock_release, mock_acquire, tmp_path):
+    from islandoraq.tasks.tasks import result_detail
+    missing = "https://test.somesite.com/nonexistent_path/test.json"
+    book = {"recipe": {"uuid": "book", "pages": [{"uuid": "p1"}]}}
+    mock_requests_get.return_value = Mock(status_code=404, headers={})
+    mock_acquire.return_value = str(tmp_path)
+    results = ingest_recipe([book, missing], result_format="compact")
+    assert results["succeeded"] == 1
+    assert results["successful"] == ["book"]
+    assert results["failures"] == [[missing, "http_404"]]
+    assert set(results["durations"]) == set(["book"])
+    detail = result_detail(results["detail"])
+    assert detail["kind"] == "ingest_recipe"
+    assert detail["detail"]["Successful"] == [book]
+    assert detail["detail"]["Failures"] == [[missing, "Server status 404"]]
+
+
+@patch('islandoraq.tasks.tasks.httpclient.probe')
 def test_verify_solr_up(mock_get):
     mock_get.return_value.ok=True
     response = verify_solr_up()
@@ -236,7 +253,7 @@ def test_verify_solr_up(mock_get):
     assert response == False
 
 
-@patch('islandoraq.tasks.tasks.requests.get')
+@patch('islandoraq.tasks.tasks.httpclient.probe')
 def test_verify_solr_down(mock_get):
     mock_get.return_value.ok = False
     response = verify_solr_up()
@@ -246,4 +263,325 @@ def test_verify_solr_down(mock_get):
 @pytest.mark.skip(reason="not implemented")
 def test_ingest_status():
     ingest_status()
-    raise Exception("Testing...")
\ No newline at end of file
+    raise Exception("Testing...")
+
+
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_objects_exist_chunks_queries(mock_get):
+    mock_get.return_value.text = '{"response": {"numFound": 2, "docs": [{"PID": "oku:a"}, {"PID": "oku:c"}]}}'
+    response = objects_exist(["a", "b", "c"], "oku", chunk_size=2)
+    assert response == {"a": True, "b": False, "c": True}
+    assert mock_get.call_count == 2
+    assert mock_get.call_args_list[0][1]["params"]["q"] == 'PID:("oku:a" OR "oku:b")'
+
+
+@patch('islandoraq.tasks.tasks.objects_exist')
+@patch('islandoraq.tasks.tasks.object_exists')
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_ingest_status_batched(mock_get, mock_object_exists, mock_objects_exist):
+    mock_get.return_value = Mock(status_code=200, headers={}, iter_content=Mock(
+        return_value=[b'{"recipe": {"uuid": "book", "pages": [{"uuid": "p1"}, {"uuid": "p2"}]}}']))
+    mock_object_exists.return_value = True
+    mock_objects_exist.return_value = {"p1": True, "p2": False}
+    response = ingest_status("https://test.somesite.com/test.json", "oku")
+    mock_objects_exist.assert_called_once_with(["p1", "p2"], "oku")
+    assert response == {"book": "book", "page_status": {"p1": True, "p2": False}, "successful_load": False}
+
+
+@patch('islandoraq.tasks.tasks.workspace.acquire')
+@patch('islandoraq.tasks.tasks.workspace.release')
+@patch('islandoraq.tasks.tasks.stream_output')
+def test_ingest_recipe_concurrent(mock_stream_output, mock_release, mock_acquire, tmp_path):
+    from subprocess import CalledProcessError
+    recipes = [{"recipe": {"uuid": "book{0}".format(i)}} for i in range(4)]
+    workdirs = [tmp_path / str(i) for i in range(4)]
+    for workdir in workdirs:
+        workdir.mkdir()
+    mock_acquire.side_effect = [str(workdir) for workdir in workdirs]
+
+    def drush(command, **kwargs):
+        if "/2/" in command:
+            raise CalledProcessError(1, command)
+        return "ok"
+    mock_stream_output.side_effect = drush
+
+    results = ingest_recipe(recipes, concurrency=3, result_format="verbose")
+    assert len(results["Successful"]) == 3
+    assert results["Failures"][0][1] == "Drush status 1"
+    assert mock_release.call_count == 4
+
+
+@patch('islandoraq.tasks.tasks.workspace.acquire')
+@patch('islandoraq.tasks.tasks.workspace.release')
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_ingest_recipe_pipelined(mock_get, mock_stream_output, mock_release, mock_acquire, tmp_path):
+    missing = "https://test.somesite.com/nonexistent_path/missing.json"
+    recipes = [{"recipe": {"uuid": "book0"}}, missing, {"recipe": {"uuid": "book2"}}, "not a recipe"]
+    mock_get.return_value = Mock(status_code=404)
+    workdirs = [tmp_path / str(i) for i in range(3)]
+    for workdir in workdirs:
+        workdir.mkdir()
+    mock_acquire.side_effect = [str(workdir) for workdir in workdirs]
+
+    results = ingest_recipe(recipes, concurrency=2, prefetch=2, result_format="verbose")
+    assert results["Successful"] == [recipes[0], recipes[2]]
+    assert results["Failures"][0] == [missing, "Server status 404"]
+    assert results["Failures"][1][0] == "not a recipe"
+    assert mock_stream_output.call_count == 2
+    assert mock_release.call_count == 2
+
+
+@patch('islandoraq.tasks.tasks._item_manipulator')
+@patch('islandoraq.tasks.tasks.objects_exist')
+def test_delete_items_skips_missing(mock_objects_exist, mock_item_manipulator):
+    from islandoraq.tasks.tasks import delete_items
+    mock_objects_exist.side_effect = lambda pids, namespace, chunk_size: dict((pid, pid != "gone") for pid in pids)
+    mock_item_manipulator.side_effect = lambda pid, namespace, operation: (
+        {"Error": ["", 1, {}, []]} if pid == "bad" else b"deleted")
+    response = delete_items(["a", "gone", "bad", "a", "b"], "oku", chunk_size=2, concurrency=2)
+    assert response == {"requested": 4, "skipped": 1, "succeeded": 2, "failed": 1, "failures": {"bad": "Drush status 1"}}
+    assert sorted(call[0][0] for call in mock_item_manipulator.call_args_list) == ["a", "b", "bad"]
+
+
+@patch('islandoraq.tasks.tasks._item_manipulator')
+@patch('islandoraq.tasks.tasks.objects_exist')
+def test_deletes_update_the_ingest_ledger(mock_objects_exist, mock_item_manipulator, ingest_ledger):
+    from islandoraq.tasks import ledger
+    from islandoraq.tasks.tasks import delete_item, delete_items
+    ledger.record_status("oku", "a", True, {"a1": True})
+    ledger.record_status("oku", "bad", True, None)
+    ledger.record_status("oku", "c", True, None)
+    mock_objects_exist.side_effect = lambda pids, namespace, chunk_size: dict((pid, True) for pid in pids)
+    mock_item_manipulator.side_effect = lambda pid, namespace, operation: (
+        {"Error": ["", 1, {}, []]} if pid == "bad" else b"deleted")
+    delete_items(["a", "bad"], "oku")
+    assert ingest_ledger.ingested(["oku:a", "oku:a1", "oku:bad", "oku:c"]) == set(["oku:bad", "oku:c"])
+    delete_item("c", "oku")
+    delete_item("bad", "oku")
+    assert ingest_ledger.ingested(["oku:bad", "oku:c"]) == set(["oku:bad"])
+
+
+@patch('islandoraq.tasks.tasks._item_manipulator')
+@patch('islandoraq.tasks.tasks.objects_exist')
+def test_read_items_results_by_pid(mock_objects_exist, mock_item_manipulator):
+    from islandoraq.tasks.tasks import read_items
+    mock_objects_exist.side_effect = lambda pids, namespace, chunk_size: dict((pid, True) for pid in pids)
+    mock_item_manipulator.side_effect = lambda pid, namespace, operation: "label of {0}".format(pid).encode("utf-8")
+    response = read_items(["a", "b"], "oku")
+    assert response["results"] == {"a": "label of a", "b": "label of b"}
+    assert response["succeeded"] == 2
+
+
+@patch('islandoraq.tasks.tasks.sleep')
+@patch('islandoraq.tasks.tasks.bulk_updatecatalog.apply_async')
+@patch('islandoraq.tasks.tasks.httpclient.post')
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_bulk_updatecatalog(mock_get, mock_post, mock_apply_async, mock_sleep):
+    from islandoraq.tasks.tasks import bulk_updatecatalog
+    mock_get.return_value = Mock(text='{"count": 2, "next": null, "results": [{"bag": "Tyler_2019"}, {"bag": "Bad_2019"}]}')
+
+    def post(url, data=None, headers=None):
+        if "Bad_2019" in data:
+            raise HTTPError("500 Server Error")
+        return Mock()
+    mock_post.side_effect = post
+
+    response = bulk_updatecatalog([
+        ["Tyler_2019", "jpeg_040_antialias", "oku:hos", False],
+        {"bag": "Tyler_2019", "paramstring": "jpeg_040_antialias", "collection": "oku:hos", "ingested": True},
+        ["Missing_2019", "jpeg_040_antialias", "oku:hos", True],
+        ["Bad_2019", "jpeg_040_antialias", "oku:hos", True],
+    ])
+    assert mock_get.call_count == 1
+    assert '"$in": ["Tyler_2019", "Missing_2019", "Bad_2019"]' in mock_get.call_args[1]["params"]["query"]
+    assert response["requested"] == 3
+    assert response["updated"] == 1
+    assert response["not_found"] == ["Missing_2019"]
+    assert list(response["failed"]) == ["Bad_2019"]
+    assert response["rescheduled"] == 1
+    assert mock_apply_async.call_args[1]["args"][0][0]["bag"] == "Bad_2019"
+    written = [call for call in mock_post.call_args_list if "Tyler_2019" in call[1]["data"]]
+    assert len(written) == 1 and '"ingested": true' in written[0][1]["data"]
+
+
+def test_catalog_write_buffer_merges_bags():
+    from islandoraq.tasks.catalog import WriteBuffer, make_update
+    buffer = WriteBuffer(max_items=2, max_age=3600)
+    buffer.add(make_update("Tyler_2019", "jpeg_040_antialias", "oku:hos", False))
+    buffer.add(make_update("Tyler_2019", "jpeg_040_antialias", "oku:hos", True))
+    assert not buffer.due()
+    buffer.add(make_update("Other_2019", "jpeg_040_antialias", "oku:hos", True))
+    assert buffer.due()
+    updates = buffer.drain()
+    assert [(update["bag"], update["ingested"]) for update in updates] == [("Tyler_2019", True), ("Other_2019", True)]
+    assert len(buffer) == 0
+
+
+@patch('islandoraq.tasks.tasks.bulk_updatecatalog')
+def test_catalog_write_buffer_flushes_by_age_without_new_updates(mock_bulk):
+    from time import sleep
+    from islandoraq.tasks import catalog, tasks
+    from islandoraq.tasks.catalog import WriteBuffer, make_update
+    from islandoraq.tasks.health import DependencyUnavailable
+    mock_bulk.side_effect = iter([DependencyUnavailable("catalog", 30), {"updated": 1}])
+    buffer = WriteBuffer(max_items=50, max_age=0.05, on_due=tasks._flush_catalog_when_due)
+    with patch.object(catalog, 'write_buffer', buffer):
+        buffer.add(make_update("Tyler_2019", "jpeg_040_antialias", "oku:hos", True))
+        for _ in range(100):
+            if mock_bulk.call_count == 2:
+                break
+            sleep(0.02)
+    assert mock_bulk.call_count == 2
+    assert mock_bulk.call_args[0][0][0]["bag"] == "Tyler_2019"
+    assert len(buffer) == 0
+
+
+
+def test_catalog_updates_kept_when_catalog_unavailable():
+    from islandoraq.tasks import catalog, health
+    from islandoraq.tasks.catalog import WriteBuffer
+    from islandoraq.tasks.tasks import flush_catalog_updates, queue_catalog_update
+    breaker = health.breakers["catalog"]
+    for _ in range(breaker.threshold):
+        breaker.failure()
+    buffer = WriteBuffer(max_items=2, max_age=3600)
+    with patch.object(catalog, 'write_buffer', buffer):
+        assert queue_catalog_update("Tyler_2019", "jpeg_040_antialias", "oku:hos") is None
+        assert queue_catalog_update("Other_2019", "jpeg_040_antialias", "oku:hos") is None
+        assert len(buffer) == 2
+        with pytest.raises(health.DependencyUnavailable):
+            flush_catalog_updates()
+        assert [update["bag"] for update in buffer.drain()] == ["Tyler_2019", "Other_2019"]
+
+@patch('islandoraq.tasks.tasks.httpclient.post')
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_searchcatalog_cached_and_updated_on_write(mock_get, mock_post):
+    mock_get.return_value.text = '{"count": 1, "results": [{"bag": "Tyler_2019"}]}'
+    assert searchcatalog("Tyler_2019") == {"bag": "Tyler_2019"}
+    updatecatalog(bag="Tyler_2019", paramstring="jpeg_040_antialias", collection="oku:hos")
+    assert mock_get.call_count == 2  # the write reads the catalog item fresh
+    cached = searchcatalog("Tyler_2019")
+    assert cached["application"]["islandora"]["derivative"] == "jpeg_040_antialias"
+    assert mock_get.call_count == 2
+
+    mock_get.return_value.text = '{"count": 0, "results": []}'
+    assert searchcatalog("test_bag") == {}
+    assert searchcatalog("test_bag") == {}
+    assert mock_get.call_count == 3
+
+
+@patch('islandoraq.tasks.tasks.httpclient.post')
+@patch('islandoraq.tasks.tasks.httpclient.get')
+def test_updatecatalog_ignores_cached_miss_and_stale_items(mock_get, mock_post):
+    mock_get.return_value.text = '{"count": 0, "results": []}'
+    assert searchcatalog("Tyler_2019") == {}
+    mock_get.return_value.text = '{"count": 1, "results": [{"bag": "Tyler_2019", "project": "edited"}]}'
+    assert updatecatalog(bag="Tyler_2019", paramstring="jpeg_040_antialias", collection="oku:hos") == True
+    written = loads(mock_post.call_args[1]["data"])
+    assert written["project"] == "edited"
+    assert searchcatalog("Tyler_2019")["project"] == "edited"
+
+
+@patch('islandoraq.tasks.tasks.workspace.acquire')
+@patch('islandoraq.tasks.tasks.workspace.release')
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.objects_exist')
+def test_ingest_recipe_resume(mock_objects_exist, mock_stream_output, mock_release, mock_acquire, tmp_path):
+    from json import load
+    partial_book = {"recipe": {"uuid": "book1", "update": "false", "pages": [{"uuid": "p1"}, {"uuid": "p2"}]}}
+    complete_book = {"recipe": {"uuid": "book2", "pages": [{"uuid": "p3"}]}}
+    mock_objects_exist.side_effect = lambda uuids, namespace: dict((uuid, uuid != "p2") for uuid in uuids)
+    mock_acquire.return_value = str(tmp_path)
+
+    results = ingest_recipe([partial_book, complete_book], resume=True, result_format="verbose")
+    assert results["Successful"] == [partial_book, complete_book]
+    assert mock_stream_output.call_count == 1
+    with open(str(tmp_path / "cc_recipe.json")) as f:
+        staged = load(f)
+    assert staged["recipe"]["pages"] == [{"uuid": "p2"}]
+    assert staged["recipe"]["update"] == "true"
+    with open(str(tmp_path / "cc_recipe.json")) as f:
+        assert f.read().count('"update"') == 1
+
+
+@patch('islandoraq.tasks.tasks.workspace.acquire')
+@patch('islandoraq.tasks.tasks.workspace.release')
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.objects_exist')
+def test_ingest_recipe_resume_marks_update(mock_objects_exist, mock_stream_output, mock_release, mock_acquire,
+                                           tmp_path):
+    from json import load
+    partial_book = {"recipe": {"uuid": "book1", "label": "Book", "pages": [{"uuid": "p1"}, {"uuid": "p2"}]}}
+    mock_objects_exist.side_effect = lambda uuids, namespace: dict((uuid, uuid != "p2") for uuid in uuids)
+    mock_acquire.return_value = str(tmp_path)
+
+    ingest_recipe([partial_book], resume=True)
+    with open(str(tmp_path / "cc_recipe.json")) as f:
+        staged = load(f)
+    assert staged["recipe"] == {"uuid": "book1", "label": "Book", "pages": [{"uuid": "p2"}], "update": "true"}
+
+
+@patch('islandoraq.tasks.tasks.sleep')
+@patch('islandoraq.tasks.tasks.objects_exist')
+@patch('islandoraq.tasks.tasks.object_exists')
+@patch('islandoraq.tasks.tasks._recipe_uuids')
+def test_await_ingest_requeries_only_missing(mock_recipe_uuids, mock_object_exists, mock_objects_exist, mock_sleep):
+    from islandoraq.tasks.tasks import await_ingest
+    mock_recipe_uuids.return_value = ("book", ["p1", "p2", "p3"])
+    mock_object_exists.side_effect = [False, True]
+    mock_objects_exist.side_effect = [{"p1": True, "p2": False, "p3": False}, {"p2": True, "p3": True}]
+    response = await_ingest("https://test.somesite.com/test.json", "oku", timeout=60, initial_delay=1, max_delay=60)
+    assert response == {"book": "book", "page_status": {"p1": True, "p2": True, "p3": True},
+                        "successful_load": True, "rounds": 3}
+    assert mock_objects_exist.call_args_list[1][0][0] == ["p2", "p3"]
+    assert [call[0][0] for call in mock_sleep.call_args_list] == [1, 2]
+
+
+@patch('islandoraq.tasks.tasks.sleep')
+@patch('islandoraq.tasks.tasks.objects_exist')
+@patch('islandoraq.tasks.tasks.object_exists')
+@patch('islandoraq.tasks.tasks._recipe_uuids')
+def test_await_ingest_deadline(mock_recipe_uuids, mock_object_exists, mock_objects_exist, mock_sleep):
+    from islandoraq.tasks.tasks import await_ingest
+    mock_recipe_uuids.return_value = ("book", ["p1"])
+    mock_object_exists.return_value = True
+    mock_objects_exist.return_value = {"p1": False}
+    response = await_ingest("https://test.somesite.com/test.json", "oku", timeout=0)
+    assert response["successful_load"] is False
+    assert response["rounds"] == 1
+    assert not mock_sleep.called
+
+
+@patch('islandoraq.tasks.tasks.sleep')
+@patch('islandoraq.tasks.tasks.objects_exist')
+@patch('islandoraq.tasks.tasks.object_exists')
+@patch('islandoraq.tasks.tasks._recipe_uuids')
+def test_await_ingest_reschedules_rounds_under_worker(mock_recipe_uuids, mock_object_exists, mock_objects_exist,
+                                                      mock_sleep):
+    from islandoraq.tasks.tasks import await_ingest
+    mock_recipe_uuids.return_value = ("book", ["p1", "p2", "p3"])
+    mock_object_exists.side_effect = [False, True]
+    mock_objects_exist.side_effect = [{"p1": True, "p2": False, "p3": False}, {"p2": True, "p3": True}]
+    with patch.object(await_ingest, 'retry', wraps=await_ingest.retry) as mock_retry:
+        response = await_ingest.apply(("https://test.somesite.com/test.json", "oku"),
+                                      {"timeout": 60, "initial_delay": 1, "max_delay": 60}).get()
+    assert response == {"book": "book", "page_status": {"p1": True, "p2": True, "p3": True},
+                        "successful_load": True, "rounds": 3}
+    assert not mock_sleep.called
+    assert [call[1]["countdown"] for call in mock_retry.call_args_list] == [1, 2]
+    assert mock_retry.call_args[1]["kwargs"]["pending"] == ["p2", "p3"]
+    assert mock_objects_exist.call_args_list[1][0][0] == ["p2", "p3"]
+
+
+@patch('islandoraq.tasks.tasks.stream_output')
+@patch('islandoraq.tasks.tasks.recipecache.fetch')
+def test_ingest_recipe_unexpected_staging_error(mock_fetch, mock_stream_output):
+    recipes = ["https://test.somesite.com/a.json", "https://test.somesite.com/b.json"]
+    mock_fetch.side_effect = OSError("No space left on device")
+    for prefetch in (0, 2):
+        results = ingest_recipe(recipes, prefetch=prefetch, result_format="verbose")
+        assert results["Successful"] == []
+        assert [failure[0] for failure in results["Failures"]] == recipes
+        assert isinstance(results["Failures"][0][1], OSError)
+    assert not mock_stream_output.called
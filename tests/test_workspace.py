@@ -0,0 +1,80 @@
+from os import getgid, getpid, listdir, mkdir
+from os.path import exists, join
+
+from six import PY2
+
+if PY2:
+    from mock import Mock, patch
+else:
+    from unittest.mock import Mock, patch
+
+from islandoraq.tasks import workspace
+from islandoraq.tasks.workspace import WorkspacePool, sweep
+
+
+@patch('islandoraq.tasks.workspace._gid', None)
+@patch('islandoraq.tasks.workspace.grp.getgrnam')
+def test_workspaces_are_reused(mock_getgrnam, tmp_path):
+    mock_getgrnam.return_value = Mock(gr_gid=getgid())
+    pool = WorkspacePool(root=str(tmp_path), pool_size=1)
+    first = pool.acquire()
+    with open(join(first, "cc_recipe.json"), "w") as f:
+        f.write("{}")
+    mkdir(join(first, "pages"))
+    second = pool.acquire()
+    pool.release(first)
+    pool.release(second)
+    pool.drain()
+    assert listdir(first) == []
+    assert not exists(second)
+    assert pool.acquire() == first
+    assert pool.stats()["created"] == 2
+    assert pool.stats()["reused"] == 1
+    assert mock_getgrnam.call_count == 1
+    pool.close()
+
+
+@patch('islandoraq.tasks.workspace._gid', getgid())
+def test_large_recipes_go_to_disk(tmp_path):
+    ram = tmp_path / "ram"
+    disk = tmp_path / "disk"
+    ram.mkdir()
+    disk.mkdir()
+    pool = WorkspacePool(root=str(disk), ram_root=str(ram), ram_bytes=1000)
+    small = pool.acquire(600)
+    assert small.startswith(str(ram))
+    assert pool.acquire(600).startswith(str(disk))
+    pool.release(small)
+    assert pool.ram_in_use == 0
+    assert pool.acquire(600).startswith(str(ram))
+    pool.close()
+
+
+def test_estimate_counts_pages_drush_downloads():
+    recipe = {"recipe": {"uuid": "book"}}
+    assert workspace.estimate(recipe=recipe) == len(str(recipe))
+    assert workspace.estimate(recipe=recipe, pages=10) == len(str(recipe)) + 10 * workspace.PAGE_BYTES
+
+
+@patch('islandoraq.tasks.workspace._gid', getgid())
+def test_unstaged_pages_count_towards_ram(tmp_path):
+    ram = tmp_path / "ram"
+    disk = tmp_path / "disk"
+    ram.mkdir()
+    disk.mkdir()
+    pool = WorkspacePool(root=str(disk), ram_root=str(ram), ram_bytes=workspace.PAGE_BYTES)
+    assert pool.acquire(workspace.estimate(recipe={"recipe": {"uuid": "book"}}, pages=2)).startswith(str(disk))
+    pool.close()
+
+
+@patch('islandoraq.tasks.workspace._alive')
+def test_sweep_removes_workspaces_of_stopped_workers(mock_alive, tmp_path):
+    mock_alive.side_effect = lambda pid: pid == getpid()
+    root = tmp_path / "workspaces"
+    root.mkdir()
+    mine = "recipeloader_{0}_{1}_a".format(workspace.HOST, getpid())
+    other_host = "recipeloader_{0}x_999999_c".format(workspace.HOST)
+    for name in [mine, "recipeloader_{0}_999999_b".format(workspace.HOST), other_host, "unrelated"]:
+        mkdir(str(root / name))
+    assert sweep([str(root)]) == 1
+    assert sorted(listdir(str(root))) == sorted([mine, other_host, "unrelated"])